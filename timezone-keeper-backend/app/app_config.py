@@ -23,8 +23,51 @@ class Config(object):
 
     JWT_SECRET_KEY = 'You_Will_Never_guess_This_secret_key'
     JWT_ACCESS_TOKEN_EXPIRES = datetime.timedelta(minutes=15)
+    JWT_REFRESH_TOKEN_EXPIRES = datetime.timedelta(days=7)
+    # number of verified access tokens kept to skip re-verification
+    JWT_VERIFIED_CACHE_SIZE = 4096
+    # how often the in-memory revoked tokens index picks up other workers' revocations
+    REVOKED_TOKENS_REFRESH_INTERVAL = 5 # seconds
+    # background purge of expired revoked tokens; 0 disables the sweeper
+    REVOKED_TOKENS_SWEEP_INTERVAL = 300 # seconds
+    REVOKED_TOKENS_SWEEP_BATCH = 500
+
+    # in-process cache of user account status used by the per-request checks
+    USER_STATUS_CACHE_SIZE = 4096
+    USER_STATUS_CACHE_TTL = 30 # seconds
+
+    # password hashing runs on a dedicated process pool; 0 workers hashes inline
+    PASSWORD_HASH_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+    PASSWORD_HASH_MAX_PENDING = 32 # queued or running hash jobs before logins get a 503
+    PASSWORD_HASH_RETRY_AFTER = 1 # seconds
+
+    # password hashing policy; with a target verify latency the cost is calibrated at startup
+    PASSWORD_HASH_SCHEME = 'bcrypt' # bcrypt, pbkdf2_sha256 or sha512_crypt
+    PASSWORD_HASH_ROUNDS = 12
+    PASSWORD_HASH_TARGET_MS = None
+
+    # login attempts token buckets, rates in attempts per second
+    LOGIN_RATE_PER_USER = 0.1
+    LOGIN_BURST_PER_USER = 5
+    LOGIN_RATE_PER_ADDRESS = 1
+    LOGIN_BURST_PER_ADDRESS = 20
+    LOGIN_RATE_LIMIT_MAX_KEYS = 100000
+
+    # bulk user import: rows accepted per request and rows inserted per transaction
+    USER_IMPORT_MAX_ROWS = 10000
+    USER_IMPORT_BATCH_SIZE = 1000
+
+    # largest request body accepted, larger ones are rejected with 413 before being read
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024 # bytes
 
     TIMEZONE_INITIAL_VALUES = "IANA_timezone_names.json"
+    # the timezones catalog only changes at seed time
+    TIMEZONE_CATALOG_MAX_AGE = 86400 # seconds
+    # instants accepted per conversion request, and instants times timezones converted per request
+    TIMEZONE_CONVERT_MAX_INSTANTS = 100000
+    TIMEZONE_CONVERT_MAX_VALUES = 2000000
+    # full reload of the users' primary timezones, for changes made by other workers
+    WORKING_HOURS_INDEX_REFRESH_INTERVAL = 60 # seconds
     DEBUG = False
     FLASK_DEBUG = False
     TESTING = False
@@ -39,3 +82,6 @@ class TestingConfig(Config):
     FLASK_DEBUG = False
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite://' #in memory db
+    REVOKED_TOKENS_SWEEP_INTERVAL = 0
+    PASSWORD_HASH_WORKERS = 0
+    PASSWORD_HASH_ROUNDS = 4
@@ -18,3 +18,14 @@ class AuthError(Exception):
 
 class PermissionsError(AuthError):
     pass
+
+class PreconditionFailedError(Exception):
+    pass
+
+class ServiceBusyError(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class RateLimitError(ServiceBusyError):
+    pass
@@ -0,0 +1,159 @@
+"""
+Bounded process pool for password hashing and verification.
+
+Hashing is CPU bound, so it runs in a dedicated, size-limited pool of
+worker processes instead of on the request threads. The number of jobs
+queued or running is capped; once the cap is reached new jobs are rejected
+with ServiceBusyError rather than piling up behind each other. A pool
+whose worker died, e.g. killed for running out of memory, is replaced by a
+new one instead of failing every later job.
+"""
+import logging
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import app.error as err
+
+log = logging.getLogger(__name__)
+
+
+def _apply_chunk(fn, chunk):
+    '''run fn over a chunk of argument tuples in one job'''
+    return [fn(*args) for args in chunk]
+
+
+class HashingPool(object):
+    """
+    runs hashing jobs on a process pool, rejecting jobs beyond max_pending
+    """
+
+    def __init__(self, workers=0, max_pending=32, retry_after=1):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.pending = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    def configure(self, workers, max_pending, retry_after):
+        """
+        apply new limits; a zero workers count runs jobs on the calling thread
+        """
+        self.shutdown()
+        with self._lock:
+            self.workers = workers
+            self.max_pending = max_pending
+            self.retry_after = retry_after
+            self.rejected = 0
+            self.restarts = 0
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None and self.workers:
+                # spawn, as forking a multi-threaded server process is unsafe
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _replace_executor(self, broken):
+        '''drop a pool that lost a worker, the next job starts a new one'''
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self.restarts += 1
+        log.error('a hashing worker died, restarting the hashing pool')
+        broken.shutdown(wait=False)
+
+    def _unavailable(self):
+        return err.ServiceBusyError('hashing workers unavailable, please retry later', self.retry_after)
+
+    def _acquire(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise err.ServiceBusyError('too many pending login requests, please retry later', self.retry_after)
+            self.pending += 1
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    def run(self, fn, *args):
+        """
+        run fn(*args) on the pool and wait for its result
+        """
+        self._acquire()
+        try:
+            # a job lost with a dead worker is retried once on a new pool
+            for _ in range(2):
+                executor = self._get_executor()
+                if executor is None:
+                    return fn(*args)
+                try:
+                    return executor.submit(fn, *args).result()
+                except BrokenProcessPool:
+                    self._replace_executor(executor)
+            raise self._unavailable()
+        finally:
+            self._release()
+
+    def map(self, fn, args_list, chunksize=16):
+        """
+        run fn over a list of argument tuples in chunks; results are in input order
+
+        Each chunk takes a pending slot of its own, and at most half of the workers
+        run chunks at a time, so a large batch leaves capacity for single jobs.
+        """
+        chunks = [args_list[x:x + chunksize] for x in range(0, len(args_list), chunksize)]
+        executor = self._get_executor()
+        if executor is None:
+            return [x for chunk in chunks for x in self.run(_apply_chunk, fn, chunk)]
+
+        results = []
+        running = collections.deque()
+        try:
+            for chunk in chunks:
+                if len(running) >= max(1, self.workers // 2):
+                    results.extend(running.popleft().result())
+                self._acquire()
+                try:
+                    future = executor.submit(_apply_chunk, fn, chunk)
+                except Exception:
+                    self._release()
+                    raise
+                future.add_done_callback(lambda _: self._release())
+                running.append(future)
+            while running:
+                results.extend(running.popleft().result())
+        except BrokenProcessPool:
+            self._replace_executor(executor)
+            raise self._unavailable()
+        finally:
+            for future in running:
+                future.cancel()
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'rejected': self.rejected,
+                'restarts': self.restarts
+            }
+
+
+hashing_pool = HashingPool()
@@ -0,0 +1,97 @@
+"""
+Cache of verified JWT claims, keyed by a digest of the raw Authorization header.
+
+A hit skips the base64 decoding, signature check and claims validation of
+a token that was already verified; entries are kept until the token
+expires and are dropped as soon as the token is revoked.
+"""
+import logging
+import threading
+import hashlib
+import time
+import collections
+
+log = logging.getLogger(__name__)
+
+
+class VerifiedTokenCache(object):
+    """bounded LRU of header digest -> (exp, decoded token, token header)"""
+
+    def __init__(self, max_size=4096):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._keys_by_jti = {}
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_size):
+        """
+        apply a new size limit and drop all cached tokens
+        """
+        with self._lock:
+            self.max_size = max_size
+            self._entries.clear()
+            self._keys_by_jti.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @staticmethod
+    def key(raw_header):
+        return hashlib.sha256(raw_header.encode()).digest()
+
+    def get(self, key):
+        """
+        return (decoded token, token header) for a cached, unexpired token, or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= now:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, decoded_token, token_header):
+        if self.max_size <= 0 or 'exp' not in decoded_token:
+            return
+        with self._lock:
+            self._entries[key] = (decoded_token['exp'], decoded_token, token_header)
+            self._entries.move_to_end(key)
+            self._keys_by_jti[decoded_token['jti']] = key
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, jti):
+        """
+        drop the cached token with this jti
+        """
+        with self._lock:
+            key = self._keys_by_jti.get(jti)
+            if key is not None:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, decoded_token, _ = self._entries.pop(key)
+        if self._keys_by_jti.get(decoded_token['jti']) == key:
+            del self._keys_by_jti[decoded_token['jti']]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+verified_token_cache = VerifiedTokenCache()
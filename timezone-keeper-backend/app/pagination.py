@@ -0,0 +1,48 @@
+"""
+Helpers for cursor based (keyset) pagination.
+
+Cursors are opaque to clients: url-safe base64 of a small JSON document
+holding the sort key of the last item returned.
+"""
+import base64
+import binascii
+import json
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(key):
+    """
+    return an opaque cursor for a JSON serializable sort key
+    """
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    return the sort key stored in a cursor, None for an empty cursor
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        return json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise ValueError('invalid cursor')
+
+
+def parse_limit(limit, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    """
+    validate a requested page size
+    """
+    if limit is None or limit == '':
+        return default
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError('invalid limit, integer expected')
+    if limit < 1 or limit > maximum:
+        raise ValueError(f'invalid limit, expected a value between 1 and {maximum}')
+    return limit
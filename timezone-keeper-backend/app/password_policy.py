@@ -0,0 +1,122 @@
+"""
+Password hashing policy: algorithm, cost and startup cost calibration.
+
+The hashing functions are module level and take the policy settings as
+arguments so they can run in the hashing pool's worker processes.
+"""
+import logging
+import time
+import functools
+
+log = logging.getLogger(__name__)
+
+# supported schemes and how their rounds setting scales the work factor
+SCHEMES = {
+    'bcrypt': 'log2',
+    'pbkdf2_sha256': 'linear',
+    'sha512_crypt': 'linear',
+}
+
+MIN_ROUNDS = {
+    'bcrypt': 4,
+    'pbkdf2_sha256': 1000,
+    'sha512_crypt': 1000,
+}
+
+MAX_ROUNDS = {
+    'bcrypt': 31,
+    'pbkdf2_sha256': 2**32 - 1,
+    'sha512_crypt': 999999999,
+}
+
+
+@functools.lru_cache(maxsize=8)
+def _crypt_context(scheme, rounds):
+    import passlib.context
+    # hashes made with any other scheme, or with fewer rounds, verify but need updating
+    schemes = [scheme] + [x for x in SCHEMES if x != scheme]
+    settings = {
+        f'{scheme}__default_rounds': rounds,
+        f'{scheme}__min_rounds': rounds,
+    }
+    return passlib.context.CryptContext(schemes=schemes, default=scheme, deprecated='auto', **settings)
+
+
+def hash_password(password, scheme, rounds):
+    return _crypt_context(scheme, rounds).hash(password)
+
+
+def verify_password(password, password_hash, scheme, rounds):
+    return _crypt_context(scheme, rounds).verify(password, password_hash)
+
+
+def verify_and_update_password(password, password_hash, scheme, rounds):
+    """
+    returns (verified, new_hash); new_hash is None unless the stored hash is outdated
+    """
+    return _crypt_context(scheme, rounds).verify_and_update(password, password_hash)
+
+
+class PasswordPolicy(object):
+    """current hashing scheme and cost"""
+
+    def __init__(self, scheme='bcrypt', rounds=12):
+        self.scheme = scheme
+        self.rounds = rounds
+
+    def configure(self, scheme, rounds, target_ms=None):
+        """
+        set the hashing scheme and cost; with target_ms the cost is calibrated instead
+        """
+        if scheme not in SCHEMES:
+            raise ValueError(f'unsupported password hashing scheme {scheme}, expected one of {list(SCHEMES)}')
+        self.scheme = scheme
+        self.rounds = rounds
+        if target_ms:
+            self.rounds = calibrate(scheme, target_ms)
+        log.info(f'password hashing policy: {self.scheme}, rounds={self.rounds}')
+
+    def settings(self):
+        return self.scheme, self.rounds
+
+
+def time_verify(scheme, rounds, samples=3):
+    """
+    return the best of `samples` verify latencies, in milliseconds
+    """
+    password_hash = hash_password('calibration-password', scheme, rounds)
+    best = None
+    for _ in range(samples):
+        start = time.perf_counter()
+        verify_password('calibration-password', password_hash, scheme, rounds)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(scheme, target_ms):
+    """
+    pick the highest rounds value whose verify latency stays within target_ms
+    """
+    rounds = MIN_ROUNDS[scheme]
+    elapsed = time_verify(scheme, rounds)
+    if SCHEMES[scheme] == 'log2':
+        # each extra round doubles the work
+        while rounds < MAX_ROUNDS[scheme] and elapsed * 2 <= target_ms:
+            rounds += 1
+            elapsed = time_verify(scheme, rounds)
+        if elapsed > target_ms and rounds > MIN_ROUNDS[scheme]:
+            rounds -= 1
+    else:
+        # scale linearly from a measurement large enough to time reliably
+        while elapsed < 10 and rounds * 10 <= MAX_ROUNDS[scheme]:
+            rounds *= 10
+            elapsed = time_verify(scheme, rounds)
+        rounds = int(rounds * target_ms / elapsed)
+        rounds = max(MIN_ROUNDS[scheme], min(MAX_ROUNDS[scheme], rounds))
+
+    log.info(f'calibrated {scheme} rounds={rounds} for a {target_ms}ms verify target')
+    return rounds
+
+
+password_policy = PasswordPolicy()
@@ -2,14 +2,30 @@ import logging
 import sqlalchemy
 import app.error as error
 import datetime
+import time
 import re
+import collections
+import itertools
+import numpy
 import flask_jwt_extended
+import app.pagination as pagination
+import app.storage.user_search as user_search
+import app.storage.timezone_convert as timezone_convert
+import app.storage.timezone_overlap as timezone_overlap
+import app.request_context as request_context
 from app.storage.db import db
 from app.storage.timezones import TimeZones
 from app.storage.user_details import UserDetails
 from app.storage.user_roles import UserRoles, UserRolesEnum
 from app.storage.user_timezones import UserTimeZones
 from app.storage.user_token import RevokedUserTokens
+from app.storage.revoked_token_index import revoked_token_index
+from app.jwt_cache import verified_token_cache
+from app.storage.user_status_cache import user_status_cache
+from app.storage.timezone_catalog import timezone_catalog, CATALOG_FIELDS
+from app.storage.working_hours_index import working_hours_index
+from app.storage.timezone_index import parse_offset
+from app.storage.timezone_offsets import format_offset
 
 log = logging.getLogger(__name__)
 
@@ -41,7 +57,7 @@ def create_user_role(role, permissions):
             log.error(f"Invalid perimissions requested:{invalid_perm}. Allowed values: {UserRolesEnum.values()}")
             raise ValueError('Invalid permission value requested')
 
-    new_user_role = UserRoles(role=role, permissions=','.join(permissions))
+    new_user_role = UserRoles(role=role, permissions=UserRolesEnum.to_mask(permissions))
 
     try:
         db.session.add(new_user_role)
@@ -72,65 +88,209 @@ def delete_user_role(role):
 
 
 
-def get_user_all(req_username, permission):
-    '''get all user details depending on user privileges'''
-    base_query = db.session.query(UserDetails, UserRoles.role).outerjoin(UserRoles, UserRoles.id == UserDetails.role_id)
+# columns selected for each field clients may request with ?fields=
+USER_FIELDS = collections.OrderedDict([
+    ('first_name', UserDetails.first_name),
+    ('last_name', UserDetails.last_name),
+    ('username', UserDetails.username),
+    ('email', UserDetails.email),
+    ('role', UserRoles.role),
+    ('enabled', UserDetails.enabled),
+])
+
+# relative_to_gmt selects the timezone id, replaced by the zone's live offset from the catalog
+USER_TIMEZONE_FIELDS = collections.OrderedDict([
+    ('name', UserTimeZones.name),
+    ('location', TimeZones.location),
+    ('city', TimeZones.city),
+    ('relative_to_gmt', TimeZones.id),
+])
+
+def _scope_user_query(query, req_username, permission):
+    '''restrict a UserDetails query to the users visible with the given privileges'''
     if permission == UserRolesEnum.user.value:
-        query = base_query.filter(UserDetails.username == req_username)
-    elif permission == UserRolesEnum.user_privileged.value:
-        query = base_query.filter(UserRoles.permissions.contains(UserRolesEnum.user.value))
-    else:
-        query = base_query
+        return query.filter(UserDetails.username == req_username)
+    if permission == UserRolesEnum.user_privileged.value:
+        role_ids = UserRoles.get_ids_with_permission(UserRolesEnum.user.value)
+        return query.filter(UserDetails.role_id.in_(role_ids))
+    return query
+
+def get_user_all(req_username, permission, limit=pagination.DEFAULT_LIMIT, cursor=None, fields=None):
+    '''get a page of user details depending on user privileges, ordered by user id'''
+    last_id = pagination.decode_cursor(cursor)
+    if last_id is not None and not isinstance(last_id, int):
+        raise ValueError('invalid cursor')
+
+    keys = ['id'] + (fields or list(USER_FIELDS))
+    columns = [UserDetails.id] + [USER_FIELDS[x] for x in keys[1:]]
+    base_query = db.session.query(*columns).outerjoin(UserRoles, UserRoles.id == UserDetails.role_id)
+    query = _scope_user_query(base_query, req_username, permission)
+    if last_id is not None:
+        query = query.filter(UserDetails.id > last_id)
+    query = query.order_by(UserDetails.id).limit(limit + 1)
     try:
         req_list = query.all()
-        ret_list = []
+        ret_list = [dict(zip(keys, item)) for item in req_list[:limit]]
 
-        for item in req_list:
-            user = item.UserDetails.to_dict()
-            user['role'] = item.role
-            ret_list.append(user)
+        next_cursor = None
+        if len(req_list) > limit:
+            next_cursor = pagination.encode_cursor(ret_list[-1]['id'])
 
-        return {'data': ret_list}
+        return {'data': ret_list, 'next_cursor': next_cursor}
+
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        log.error(f'Error while retrieving user details: {ex}')
+        raise error.StorageError('Error while retrieving user details')
+
+DEFAULT_WORKING_HOURS = ('09:00', '17:00')
+DEFAULT_WORKING_DAYS = [0, 1, 2, 3, 4]
+
+def _parse_working_hours(start, end):
+    '''(start, end) minutes since midnight of HH:MM working hours'''
+    start = timezone_overlap.parse_time_of_day(start)
+    end = timezone_overlap.parse_time_of_day(end)
+    if start == end:
+        raise ValueError('invalid working hours, start and end must differ')
+    return start, end
 
+def _check_working_days(weekdays):
+    if not weekdays or any(not isinstance(x, int) or not 0 <= x <= 6 for x in weekdays):
+        raise ValueError('invalid weekdays, 0 (Monday) to 6 (Sunday) expected')
+
+def get_users_working_now(req_username, permission, start=None, end=None, weekdays=None,
+                          limit=pagination.DEFAULT_LIMIT, cursor=None, chunk_size=500):
+    '''
+    page of the users visible with the given privileges whose primary timezone, their first one,
+    is within working hours on a working day now, ordered by user id; answered from the offset
+    buckets of the working hours index, or from the visible ids when the privileges are scoped,
+    then the user details of the page
+    '''
+    last_id = pagination.decode_cursor(cursor)
+    if last_id is not None and not isinstance(last_id, int):
+        raise ValueError('invalid cursor')
+    weekdays = DEFAULT_WORKING_DAYS if weekdays is None else weekdays
+    _check_working_days(weekdays)
+    start, end = _parse_working_hours(start or DEFAULT_WORKING_HOURS[0], end or DEFAULT_WORKING_HOURS[1])
+
+    template = timezone_overlap.week_template(start, end, weekdays)
+    now = int(time.time()) // 60
+    keys = ['id'] + list(USER_FIELDS)
+    base_query = db.session.query(UserDetails.id, *USER_FIELDS.values())\
+        .outerjoin(UserRoles, UserRoles.id == UserDetails.role_id)
+    try:
+        catalog, offsets = working_hours_index.offsets()
+        working = [x for x in offsets if template[timezone_overlap.local_week_minute(now, x)]]
+        if permission in (UserRolesEnum.user.value, UserRolesEnum.user_privileged.value):
+            # walk the visible ids rather than every working user, most of whom are out of scope
+            query = _scope_user_query(db.session.query(UserDetails.id), req_username, permission)
+            if last_id is not None:
+                query = query.filter(UserDetails.id > last_id)
+            scoped = [x for x, in query.order_by(UserDetails.id)]
+            working = set(working)
+            user_ids = iter([
+                x for x, offset in zip(scoped, working_hours_index.user_offsets(scoped)) if offset in working
+            ])
+        else:
+            user_ids = working_hours_index.user_ids(working, after=last_id)
+
+        req_list = []
+        while len(req_list) <= limit:
+            chunk = list(itertools.islice(user_ids, chunk_size))
+            if not chunk:
+                break
+            # the ids are already within the scope
+            query = base_query.filter(UserDetails.id.in_(chunk))\
+                .order_by(UserDetails.id)\
+                .limit(limit + 1 - len(req_list))
+            req_list.extend(query.all())
     except sqlalchemy.exc.SQLAlchemyError as ex:
         log.error(f'Error while retrieving user details: {ex}')
         raise error.StorageError('Error while retrieving user details')
 
+    ret_list = [dict(zip(keys, item)) for item in req_list[:limit]]
+    for item in ret_list:
+        timezone = catalog.rows_by_id.get(working_hours_index.primary_timezone(item['id']))
+        if timezone is None:
+            # timezones removed since the ids were read
+            continue
+        item.update(dict(zip(CATALOG_FIELDS[1:], timezone[1:])))
+        item['local_time'] = timezone_convert.format_instants(
+            numpy.array([(now + parse_offset(timezone[3])) * 60]), iso=True
+        )[0]
+
+    next_cursor = None
+    if len(req_list) > limit:
+        next_cursor = pagination.encode_cursor(ret_list[-1]['id'])
+    return {'data': ret_list, 'next_cursor': next_cursor}
+
+EXPORT_FIELDS = ['id', 'username', 'first_name', 'last_name', 'email', 'role', 'enabled']
+
+def export_users(req_username, permission, batch_size=500):
+    '''generator of all user details visible with the given privileges, streamed from the db'''
+    query = db.session.query(
+        UserDetails.id, UserDetails.username, UserDetails.first_name, UserDetails.last_name,
+        UserDetails.email, UserRoles.role, UserDetails.enabled
+    ).outerjoin(UserRoles, UserRoles.id == UserDetails.role_id)
+    query = _scope_user_query(query, req_username, permission).order_by(UserDetails.id)
+    try:
+        for row in query.yield_per(batch_size):
+            yield dict(zip(EXPORT_FIELDS, row))
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        log.error(f'Error while exporting user details: {ex}')
+        raise error.StorageError('Error while exporting user details')
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+def search_users(req_username, permission, text, limit=SEARCH_DEFAULT_LIMIT, fields=None):
+    '''find users by username, email or name prefixes, depending on user privileges, best matches first'''
+    if not text or not text.strip():
+        raise ValueError('invalid search, q must not be empty')
+
+    keys = fields or list(USER_FIELDS)
+    columns = [USER_FIELDS[x] for x in keys]
+    base_query = db.session.query(*columns).select_from(UserDetails)\
+        .outerjoin(UserRoles, UserRoles.id == UserDetails.role_id)
+    query = _scope_user_query(base_query, req_username, permission)
+    query = user_search.apply_search(query, text).limit(limit)
+    try:
+        return {'data': [dict(zip(keys, item)) for item in query.all()]}
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        log.error(f'Error while searching user details: {ex}')
+        raise error.StorageError('Error while searching user details')
+
 def _validate_user_request(username, req_username, permission):
-    '''checks if the requesting user has the right permissions for the requested action'''
+    '''
+    checks if the requesting user has the right permissions for the requested action;
+    returns the requested user's details from the request context
+    '''
+    if not username == req_username and permission == UserRolesEnum.user.value:
+        raise error.PermissionsError()
+
+    user = request_context.current().user(username)
+    if not user:
+        raise error.RecordNotFoundError(f'username {username} not found')
     if not username == req_username:
-        if permission == UserRolesEnum.user.value:
-            raise error.PermissionsError()
-        user_details = UserDetails.get(username)
-        if not user_details:
+        if user.role_id and user.role is None:
             raise error.RecordNotFoundError(f'username {username} not found')
-        if user_details.role_id:
-            perm_query = db.session.query(UserRoles.permissions).join(UserDetails, UserRoles.id == UserDetails.role_id)
-            perm_query = perm_query.filter(UserDetails.username == username)
-            user_perm = perm_query.one_or_none()
-            if not user_perm:
-                raise error.RecordNotFoundError(f'username {username} not found')
-            if ((UserRolesEnum.user_privileged.value in user_perm.permissions or
-                UserRolesEnum.user_all.value in user_perm.permissions) and
-                not permission == UserRolesEnum.user_all.value):
-                raise error.PermissionsError()
-
-def get_user(username, req_username, permission):
-    '''get a user details'''
-    _validate_user_request(username, req_username, permission)
+        privileged_mask = UserRolesEnum.user_privileged.bit | UserRolesEnum.user_all.bit
+        if (user.permissions or 0) & privileged_mask and not permission == UserRolesEnum.user_all.value:
+            raise error.PermissionsError()
+    return user
 
-    query = db.session.query(UserDetails, UserRoles.role).join(UserRoles, UserRoles.id == UserDetails.role_id)
+def get_user(username, req_username, permission, fields=None):
+    '''get a user details'''
     try:
-        query = query.filter(UserDetails.username == username)
-        res = query.one_or_none()
-        if not res:
-            raise error.RecordNotFoundError(f'username {username} not found')
-        user = res.UserDetails.to_dict()
-        user['role'] = res.role
-        return user
+        user = _validate_user_request(username, req_username, permission)
     except sqlalchemy.exc.SQLAlchemyError as ex:
         log.error(f'Error while retrieving user details: {ex}')
         raise error.StorageError('Error while retrieving user details')
+    # the user is listed with its role, a user without one is not found
+    if user.role is None:
+        raise error.RecordNotFoundError(f'username {username} not found')
+
+    keys = fields or list(USER_FIELDS)
+    return {x: getattr(user, x) for x in keys}
 
 
 def _check_email_address_format(email):
@@ -158,18 +318,50 @@ def _check_passwd_field(password):
     if len(password)<8:
         raise error.InvalidFieldFormat('Invalid password format, minimum 8 characters required')
 
-def create_user(first_name, last_name, username, email, password):
-    '''create a new user'''
+# collection wide actions are routed under /user/all/ and /timezone/all/; all is shorter than
+# any username, it is reserved in case the minimum length changes
+RESERVED_USERNAMES = {'all'}
+
+# /timezone/<username>/now is the world clock, it wins over a timezone name
+RESERVED_TIMEZONE_NAMES = {'now'}
+
+def report_reserved_names():
+    '''
+    log the stored users and user timezones whose name is reserved by a route, they cannot be reached
+    under it until renamed; returns their usernames and (username, timezone name) pairs
+    '''
+    usernames = sorted(_existing_values(UserDetails.username, RESERVED_USERNAMES))
+    for username in usernames:
+        log.warning(f'username {username} is reserved by a route, rename the user to reach it through the API')
+
+    timezones = db.session.query(UserDetails.username, UserTimeZones.name)\
+        .join(UserTimeZones, UserTimeZones.user_id == UserDetails.id)\
+        .filter(UserTimeZones.name.in_(RESERVED_TIMEZONE_NAMES))\
+        .order_by(UserDetails.username, UserTimeZones.name).all()
+    for username, name in timezones:
+        log.warning(f'timezone {name} of user {username} is reserved by a route, rename it to read it through the API')
+    return {'usernames': usernames, 'timezones': [tuple(x) for x in timezones]}
+
+def _check_new_user_fields(first_name, last_name, username, email, password):
+    '''
+    verify the fields of a new user
+    '''
     if not first_name or not last_name or not username or not email or not password:
-        log.error(f'invalid input: {first_name}, {last_name}, {username}, {email}, {password}')
+        log.error(f'invalid input: {first_name}, {last_name}, {username}, {email}')
         raise ValueError('Invalid input values!')
 
     _check_name_field(first_name, 3)
     _check_name_field(last_name, 3)
     _check_name_field(username)
+    if username in RESERVED_USERNAMES:
+        raise error.InvalidFieldFormat(f'Invalid username, {username} is reserved')
     _check_email_address_format(email)
     _check_passwd_field(password)
 
+def create_user(first_name, last_name, username, email, password):
+    '''create a new user'''
+    _check_new_user_fields(first_name, last_name, username, email, password)
+
     user = UserDetails.get(username)
     if user:
         raise error.StorageErrorConflict('username already exists')
@@ -193,11 +385,102 @@ def create_user(first_name, last_name, username, email, password):
         log.error(f'Could not reate user {username}: {ex}')
         raise error.StorageError(f'Could not add user {username}!')
 
+    working_hours_index.drop_users([new_user.id])
     log.info(f'User {username} created')
 
     user_info = new_user.to_dict()
     return user_info
 
+IMPORT_FIELDS = ['first_name', 'last_name', 'username', 'email', 'password']
+
+def _existing_values(column, values, chunk_size=500):
+    '''subset of values already stored in column, queried in chunks'''
+    values = list(values)
+    existing = set()
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i:i + chunk_size]
+        existing.update(x for x, in db.session.query(column).filter(column.in_(chunk)))
+    return existing
+
+def _user_ids(usernames, chunk_size=500):
+    '''ids of the users with the given usernames, queried in chunks'''
+    usernames = list(usernames)
+    ids = []
+    for i in range(0, len(usernames), chunk_size):
+        chunk = usernames[i:i + chunk_size]
+        ids.extend(x for x, in db.session.query(UserDetails.id).filter(UserDetails.username.in_(chunk)))
+    return ids
+
+def import_users(rows, batch_size=1000):
+    '''
+    create many users at once; returns the outcome of every row, in input order.
+    Rows are validated as in create_user, duplicates are found with set based
+    queries, passwords are hashed in parallel and rows inserted in batches.
+    '''
+    results = []
+    valid = []
+    usernames = set()
+    emails = set()
+    for index, row in enumerate(rows):
+        result = {'index': index, 'username': None, 'status': 'created'}
+        results.append(result)
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('Invalid input values!')
+            result['username'] = row.get('username')
+            fields = {x: row.get(x) for x in IMPORT_FIELDS}
+            _check_new_user_fields(**fields)
+            if fields['username'] in usernames:
+                raise error.StorageErrorConflict('duplicate username in import')
+            if fields['email'] in emails:
+                raise error.StorageErrorConflict('duplicate email in import')
+        except (ValueError, TypeError, error.InvalidFieldFormat, error.StorageErrorConflict) as ex:
+            result.update(status='error', message=str(ex) or 'Invalid input values!')
+            continue
+        usernames.add(fields['username'])
+        emails.add(fields['email'])
+        valid.append((result, fields))
+
+    try:
+        existing_usernames = _existing_values(UserDetails.username, usernames)
+        existing_emails = _existing_values(UserDetails.email, emails)
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        log.error(f'Error while checking imported users: {ex}')
+        raise error.StorageError('Error while checking imported users')
+
+    new_users = []
+    for result, fields in valid:
+        if fields['username'] in existing_usernames:
+            result.update(status='error', message='username already exists')
+        elif fields['email'] in existing_emails:
+            result.update(status='error', message='email already registered')
+        else:
+            new_users.append((result, fields))
+
+    hashes = UserDetails.generate_hashes([fields['password'] for _, fields in new_users])
+    for (_, fields), password_hash in zip(new_users, hashes):
+        fields['password'] = password_hash
+
+    insert = UserDetails.__table__.insert()
+    for i in range(0, len(new_users), batch_size):
+        batch = new_users[i:i + batch_size]
+        try:
+            db.session.execute(insert, [fields for _, fields in batch])
+            db.session.commit()
+            # executemany does not return the new ids
+            created_ids = _user_ids(fields['username'] for _, fields in batch)
+        except sqlalchemy.exc.SQLAlchemyError as ex:
+            db.session.rollback()
+            log.error(f'Could not import users batch {i // batch_size}: {ex}')
+            for result, _ in batch:
+                result.update(status='error', message='could not store user')
+            continue
+        working_hours_index.drop_users(created_ids)
+
+    created = sum(1 for x in results if x['status'] == 'created')
+    log.info(f'Imported {created} of {len(results)} users')
+    return {'created': created, 'failed': len(results) - created, 'results': results}
+
 def update_user(username, req_username, permission, **kwargs):
     '''update an existing user'''
     _validate_user_request(username, req_username, permission)
@@ -251,9 +534,11 @@ def update_user(username, req_username, permission, **kwargs):
             changed = True
 
         if changed:
-
+            user.version = UserDetails.version + 1
             db.session.add(user)
             db.session.commit()
+            user_status_cache.invalidate(username)
+            request_context.current().invalidate(username)
     except sqlalchemy.exc.SQLAlchemyError as ex:
         db.session.rollback()
         log.error(f'Could not update user {username}: {ex}')
@@ -268,15 +553,125 @@ def update_user(username, req_username, permission, **kwargs):
 def delete_user(username, req_username, permission):
     '''delete a user'''
     try:
-        user = get_user(username, req_username, permission)
+        user = _validate_user_request(username, req_username, permission)
         UserDetails.delete(username)
     except sqlalchemy.exc.SQLAlchemyError as ex:
         log.error(f'Error while deleting user {username} {ex}')
         raise error.StorageError(f'Error while deleting user {username}')
 
+    working_hours_index.drop_users([user.id])
+    user_status_cache.invalidate(username)
+    request_context.current().invalidate(username)
     log.info(f'User {username} deleted')
 
 
+BATCH_ACTIONS = ['enable', 'disable', 'delete', 'set_role']
+BATCH_MAX_USERNAMES = 1000
+
+def _batch_permission_filter(req_username, permission):
+    '''condition matching the users a requester may modify, as in _validate_user_request'''
+    if permission == UserRolesEnum.user_all.value:
+        return sqlalchemy.true()
+    if permission == UserRolesEnum.user.value:
+        return UserDetails.username == req_username
+    role_ids = UserRoles.get_ids_without_permissions(
+        [UserRolesEnum.user_privileged.value, UserRolesEnum.user_all.value]
+    )
+    return sqlalchemy.or_(
+        UserDetails.username == req_username,
+        UserDetails.role_id.is_(None),
+        UserDetails.role_id.in_(role_ids)
+    )
+
+def batch_update_users(req_username, permission, action, usernames=None, role_filter=None,
+                       enabled_filter=None, role=None):
+    '''
+    enable, disable, delete or change the role of many users with set based statements in one transaction.
+    Users are selected by username, or by role and enabled status; selected usernames the
+    requester may not modify are rejected, users matched by a filter are limited to those it may modify.
+    A delete never removes the requester, who is reported as skipped instead
+    '''
+    if action not in BATCH_ACTIONS:
+        raise ValueError(f'invalid action, expected one of {BATCH_ACTIONS}')
+    if action != 'delete' and not permission == UserRolesEnum.user_all.value:
+        raise error.PermissionsError(f'insufficient permissions to {action} users')
+    if usernames is None and role_filter is None and enabled_filter is None:
+        raise ValueError('usernames or a filter required')
+    if usernames is not None and (role_filter is not None or enabled_filter is not None):
+        raise ValueError('usernames and filter are mutually exclusive')
+
+    conditions = []
+    if usernames is not None:
+        if not isinstance(usernames, list) or not all(isinstance(x, str) for x in usernames):
+            raise ValueError('invalid usernames, list of strings expected')
+        if len(usernames) > BATCH_MAX_USERNAMES:
+            raise ValueError(f'invalid usernames, at most {BATCH_MAX_USERNAMES} allowed')
+        conditions.append(UserDetails.username.in_(usernames))
+    if role_filter is not None:
+        filter_role = UserRoles.get(role_filter)
+        if not filter_role:
+            raise error.RecordNotFoundError(f'role {role_filter} not found')
+        conditions.append(UserDetails.role_id == filter_role['id'])
+    if enabled_filter is not None:
+        conditions.append(UserDetails.enabled == bool(enabled_filter))
+
+    values = {}
+    if action in ('enable', 'disable'):
+        values = {'enabled': action == 'enable'}
+    elif action == 'set_role':
+        role_details = UserRoles.get(role) if role else None
+        if not role_details:
+            raise error.RecordNotFoundError(f'role {role} not found')
+        values = {'role_id': role_details['id']}
+
+    allowed = _batch_permission_filter(req_username, permission)
+    try:
+        matched = db.session.query(UserDetails.username, allowed).filter(*conditions).all()
+        denied = [x for x, is_allowed in matched if not is_allowed]
+        if usernames is not None and denied:
+            log.error(f'unauthorized: user {req_username} cannot {action} users {denied}')
+            raise error.PermissionsError()
+        if action == 'delete':
+            allowed = sqlalchemy.and_(allowed, UserDetails.username != req_username)
+            matched = [(x, is_allowed and x != req_username) for x, is_allowed in matched]
+
+        targets = db.session.query(UserDetails.id).filter(*conditions).filter(allowed)
+        if action == 'delete':
+            deleted_ids = [x for x, in targets]
+            db.session.query(UserTimeZones).filter(UserTimeZones.user_id.in_(targets.subquery()))\
+                .delete(synchronize_session=False)
+            affected = db.session.query(UserDetails).filter(*conditions).filter(allowed)\
+                .delete(synchronize_session=False)
+        else:
+            values['version'] = UserDetails.version + 1
+            affected = db.session.query(UserDetails).filter(*conditions).filter(allowed)\
+                .update(values, synchronize_session=False)
+        db.session.commit()
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        db.session.rollback()
+        log.error(f'Could not {action} users: {ex}')
+        raise error.StorageError(f'Could not {action} users!')
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if action == 'delete':
+        working_hours_index.drop_users(deleted_ids)
+    context = request_context.current()
+    for username, is_allowed in matched:
+        if is_allowed:
+            user_status_cache.invalidate(username)
+            context.invalidate(username)
+
+    result = {'action': action, 'affected': affected}
+    if action == 'delete' and any(x == req_username for x, _ in matched):
+        result['skipped'] = [req_username]
+    if usernames is not None:
+        found = set(x for x, _ in matched)
+        result['not_found'] = [x for x in dict.fromkeys(usernames) if x not in found]
+    log.info(f'{action} applied to {affected} users by {req_username}')
+    return result
+
 def enable_user(username, enable_value):
     '''enable/disble an existing user'''
     user = UserDetails.get(username)
@@ -290,8 +685,11 @@ def enable_user(username, enable_value):
             changed = True
 
         if changed:
+            user.version = UserDetails.version + 1
             db.session.add(user)
             db.session.commit()
+            user_status_cache.invalidate(username)
+            request_context.current().invalidate(username)
     except sqlalchemy.exc.SQLAlchemyError as ex:
         db.session.rollback()
         log.error(f'Could not update user {username}: {ex}')
@@ -305,34 +703,134 @@ def enable_user(username, enable_value):
     log.info(f'User {username} {enabled_str}')
 
 def get_timezone_all():
-    '''get all timezones'''
+    '''get all timezones, as the pre-serialized catalog snapshot'''
     try:
-        ret_list = TimeZones.get_all()
-        return {'data': ret_list}
+        return timezone_catalog.get()
     except sqlalchemy.exc.SQLAlchemyError as ex:
         log.error(f'Error while retrieving timezones: {ex}')
         raise error.StorageError(f'Error while retrieving timezones')
 
-def get_user_timezone_all(username):
+def find_timezones(location=None, city=None, relative_to_gmt=None, relative_to_gmt_min=None,
+                   relative_to_gmt_max=None, sort='id', limit=pagination.DEFAULT_LIMIT, cursor=None):
+    '''
+    filtered, sorted page of the timezones catalog, answered from the in-memory catalog index
+    '''
+    offset_min = parse_offset(relative_to_gmt_min) if relative_to_gmt_min else None
+    offset_max = parse_offset(relative_to_gmt_max) if relative_to_gmt_max else None
+    if relative_to_gmt:
+        offset_min = offset_max = parse_offset(relative_to_gmt)
+
+    after = pagination.decode_cursor(cursor)
+    if after is not None:
+        if not isinstance(after, list) or len(after) != 2:
+            raise ValueError('invalid cursor')
+        after = tuple(after)
+
+    try:
+        index = timezone_catalog.get().index
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        log.error(f'Error while retrieving timezones: {ex}')
+        raise error.StorageError(f'Error while retrieving timezones')
+
+    rows, last_key = index.search(
+        location=location, city=city, offset_min=offset_min, offset_max=offset_max,
+        sort=sort, after=after, limit=limit
+    )
+    return {
+        'data': [dict(zip(CATALOG_FIELDS, x)) for x in rows],
+        'next_cursor': pagination.encode_cursor(last_key) if last_key else None
+    }
+
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+def suggest_timezones(text, limit=SUGGEST_DEFAULT_LIMIT):
+    '''
+    timezones whose location or city best match a possibly misspelled, partially typed name
+    '''
+    if not text or not text.strip():
+        raise ValueError('invalid search, q must not be empty')
+    try:
+        index = timezone_catalog.get().suggest_index
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        log.error(f'Error while retrieving timezones: {ex}')
+        raise error.StorageError(f'Error while retrieving timezones')
+
+    return {'data': [dict(zip(CATALOG_FIELDS, row), score=score) for score, row in index.suggest(text, limit)]}
+
+CONVERT_MAX_TIMEZONES = 20
+CONVERT_FORMATS = ['epoch', 'iso']
+
+def _timezone_arrays(catalog, timezone_id):
+    '''conversion arrays of a catalog timezone, at its seeded offset when tzdata does not know it'''
+    row = catalog.rows_by_id.get(timezone_id)
+    if row is None:
+        raise error.RecordNotFoundError(f'timezone {timezone_id} not found')
+    arrays = timezone_convert.zone_arrays(f'{row[1]}/{row[2]}')
+    if arrays is None:
+        arrays = timezone_convert.fixed_offset(parse_offset(row[3]) * 60)
+    return row, arrays
+
+def convert_instants(instants, timezone_ids, from_timezone_id=None, output_format=None):
+    '''
+    wall times and offsets in each of timezone_ids of UTC instants, or of wall times
+    in from_timezone_id; epoch seconds or ISO 8601 strings, output as the input unless
+    output_format is given
+    '''
+    if not isinstance(timezone_ids, list) or not timezone_ids or len(timezone_ids) > CONVERT_MAX_TIMEZONES:
+        raise ValueError(f'invalid timezone_ids, 1 to {CONVERT_MAX_TIMEZONES} timezone ids expected')
+    if output_format is not None and output_format not in CONVERT_FORMATS:
+        raise ValueError(f'invalid format, expected one of {CONVERT_FORMATS}')
+    values, iso = timezone_convert.parse_instants(instants)
+    if output_format is not None:
+        iso = output_format == 'iso'
+
+    try:
+        catalog = timezone_catalog.get()
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        log.error(f'Error while retrieving timezones: {ex}')
+        raise error.StorageError(f'Error while retrieving timezones')
+
+    result = {}
+    utc = values
+    if from_timezone_id is not None:
+        _, arrays = _timezone_arrays(catalog, from_timezone_id)
+        utc, _ = arrays.to_utc(values)
+        result['utc'] = timezone_convert.format_instants(utc, iso)
+
+    result['data'] = []
+    for timezone_id in timezone_ids:
+        row, arrays = _timezone_arrays(catalog, timezone_id)
+        local, offsets = arrays.to_local(utc)
+        result['data'].append({
+            'timezone_id': timezone_id,
+            'location': row[1],
+            'city': row[2],
+            'local': timezone_convert.format_instants(local, iso),
+            'offsets': offsets.tolist()
+        })
+    return result
+
+def get_user_timezone_all(username, fields=None):
     '''get all timezones for a user'''
-    user = UserDetails.get(username)
+    user = request_context.current().user(username)
     if not user:
         raise error.RecordNotFoundError(f'username {username} not found')
 
-    query = db.session.query(UserTimeZones, TimeZones, UserDetails.username)\
-            .join(UserDetails, UserTimeZones.user_id == UserDetails.id)\
+    keys = fields or list(USER_TIMEZONE_FIELDS)
+    query = db.session.query(*[USER_TIMEZONE_FIELDS[x] for x in keys])\
+            .select_from(UserTimeZones)\
             .join(TimeZones, UserTimeZones.timezone_id == TimeZones.id)\
-            .filter(UserDetails.username == username)
+            .filter(UserTimeZones.user_id == user.id)\
+            .order_by(UserTimeZones.id)
 
     try:
         req_list = query.all()
-        ret_list = []
-
-        for item in req_list:
-            tz = item.TimeZones.to_dict()
-            tz.update(item.UserTimeZones.to_dict())
-            tz['username'] = item.username
-            ret_list.append(tz)
+        ret_list = [dict(zip(keys, item)) for item in req_list]
+        if 'relative_to_gmt' in keys:
+            offsets = timezone_catalog.get().offsets_by_id
+            for item in ret_list:
+                item['relative_to_gmt'] = offsets.get(item['relative_to_gmt'])
 
         return {'data': ret_list}
 
@@ -341,16 +839,177 @@ def get_user_timezone_all(username):
         raise error.StorageError(f'Error while retrieving user {username} timezones')
 
 
+OVERLAP_MAX_PARTICIPANTS = 500
+OVERLAP_MAX_DAYS = 366
+
+def _participant_timezones(participants, chunk_size=500):
+    '''
+    (username, timezone name, TimeZones row) of each (username, timezone name or None for the
+    primary timezone) participant, None when not found; a user's primary timezone is their first one
+    '''
+    usernames = list(set(x[0] for x in participants))
+    by_user = collections.defaultdict(list)
+    for i in range(0, len(usernames), chunk_size):
+        query = db.session.query(
+            UserDetails.username, UserTimeZones.name, TimeZones.id, TimeZones.location, TimeZones.city
+        ).select_from(UserTimeZones)\
+            .join(UserDetails, UserTimeZones.user_id == UserDetails.id)\
+            .join(TimeZones, UserTimeZones.timezone_id == TimeZones.id)\
+            .filter(UserDetails.username.in_(usernames[i:i + chunk_size]))\
+            .order_by(UserTimeZones.id)
+        for row in query:
+            by_user[row.username].append(row)
+
+    found = []
+    for username, name in participants:
+        rows = [x for x in by_user[username] if name is None or x.name == name]
+        found.append(rows[0] if rows else None)
+    return found
+
+def find_meeting_windows(start_date, end_date, usernames=None, user_timezones=None, working_hours=None,
+                         weekdays=None, min_minutes=30):
+    '''
+    UTC windows of at least min_minutes between start_date and end_date, both included, in which
+    every participant is within working hours on one of weekdays, local time; participants are
+    usernames, meeting in their primary timezone, and user timezones, each with optional
+    working hours of its own
+    '''
+    try:
+        first_day = datetime.date.fromisoformat(start_date)
+        last_day = datetime.date.fromisoformat(end_date)
+    except (TypeError, ValueError):
+        raise ValueError('invalid date, YYYY-MM-DD expected')
+    days = (last_day - first_day).days + 1
+    if not 1 <= days <= OVERLAP_MAX_DAYS:
+        raise ValueError(f'invalid date range, 1 to {OVERLAP_MAX_DAYS} days expected')
+
+    weekdays = DEFAULT_WORKING_DAYS if weekdays is None else weekdays
+    _check_working_days(weekdays)
+    if not isinstance(min_minutes, int) or min_minutes < 1:
+        raise ValueError('invalid min_minutes, positive number of minutes expected')
+
+    working_hours = working_hours or {}
+    default_hours = working_hours.get('start', DEFAULT_WORKING_HOURS[0]), working_hours.get('end', DEFAULT_WORKING_HOURS[1])
+
+    def hours(value):
+        '''(start, end) minutes of a participant's working hours'''
+        value = value or {}
+        return _parse_working_hours(value.get('start', default_hours[0]), value.get('end', default_hours[1]))
+
+    participants = [(x, None, hours(None)) for x in usernames or []]
+    participants += [(x['username'], x.get('name'), hours(x)) for x in user_timezones or []]
+    if not participants or len(participants) > OVERLAP_MAX_PARTICIPANTS:
+        raise ValueError(f'invalid participants, 1 to {OVERLAP_MAX_PARTICIPANTS} expected')
+
+    try:
+        rows = _participant_timezones([x[:2] for x in participants])
+        catalog = timezone_catalog.get()
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        log.error(f'Error while retrieving participant timezones: {ex}')
+        raise error.StorageError(f'Error while retrieving participant timezones')
+    missing = [f'{x[0]}/{x[1]}' if x[1] else x[0] for x, row in zip(participants, rows) if row is None]
+    if missing:
+        raise error.RecordNotFoundError(f'timezones not found for {", ".join(missing[:10])}')
+
+    arrays = {x.id: _timezone_arrays(catalog, x.id)[1] for x in rows}
+    start = (first_day - datetime.date(1970, 1, 1)).days * timezone_overlap.MINUTES_PER_DAY
+    windows = timezone_overlap.meeting_windows(
+        [(row.id, arrays[row.id], x[2]) for x, row in zip(participants, rows)],
+        weekdays, start, start + days * timezone_overlap.MINUTES_PER_DAY, min_minutes
+    )
+    bounds = timezone_convert.format_instants(
+        numpy.array([x for first, length in windows for x in (first, first + length)], dtype=numpy.int64) * 60, iso=True
+    )
+    return {
+        'participants': [
+            {'username': row.username, 'name': row.name, 'timezone_id': row.id, 'location': row.location, 'city': row.city}
+            for row in rows
+        ],
+        'windows': [
+            {'start': bounds[2 * n], 'end': bounds[2 * n + 1], 'minutes': length}
+            for n, (_, length) in enumerate(windows)
+        ]
+    }
+
+def get_user_world_clock(username):
+    '''
+    current local time, offset, DST flag and next transition of every timezone of a user,
+    and the hour differences between each pair of them
+    '''
+    user = request_context.current().user(username)
+    if not user:
+        raise error.RecordNotFoundError(f'username {username} not found')
+
+    query = db.session.query(
+        UserTimeZones.name, TimeZones.id, TimeZones.location, TimeZones.city, TimeZones.relative_to_gmt
+    ).select_from(UserTimeZones)\
+        .join(TimeZones, UserTimeZones.timezone_id == TimeZones.id)\
+        .filter(UserTimeZones.user_id == user.id)\
+        .order_by(UserTimeZones.id)
+
+    try:
+        rows = query.all()
+        catalog = timezone_catalog.get()
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        log.error(f'Error while retrieving user timezones: {ex}')
+        raise error.StorageError(f'Error while retrieving user {username} timezones')
+
+    now = int(time.time())
+    utc = timezone_convert.format_instants(numpy.array([now]), iso=True)[0]
+    if not rows:
+        return {'utc': utc, 'data': [], 'hour_differences': []}
+
+    positions = [catalog.positions_by_id[x.id] for x in rows]
+    offsets, dst, next_transitions = catalog.zones.at(positions, now)
+    known = catalog.zones.known[positions]
+    # zones missing from tzdata stay at their seeded offset
+    offsets[~known] = [parse_offset(x.relative_to_gmt) * 60 for x, k in zip(rows, known) if not k]
+    next_transitions = numpy.where(known & (next_transitions != timezone_convert.NO_TRANSITION), next_transitions, 0)
+
+    local_times = timezone_convert.format_instants(now + offsets, iso=True)
+    transitions = timezone_convert.format_instants(next_transitions, iso=True)
+    data = []
+    for n, row in enumerate(rows):
+        data.append({
+            'name': row.name,
+            'timezone_id': row.id,
+            'location': row.location,
+            'city': row.city,
+            'local_time': local_times[n],
+            'relative_to_gmt': format_offset(int(offsets[n])),
+            'dst': bool(dst[n]),
+            'next_transition': transitions[n] if next_transitions[n] else None
+        })
+
+    return {
+        'utc': utc,
+        'data': data,
+        'hour_differences': ((offsets[numpy.newaxis, :] - offsets[:, numpy.newaxis]) / 3600).tolist()
+    }
+
 def _get_timezone_by_username_and_name(username, name):
     query = db.session.query(UserTimeZones).join(UserDetails, UserTimeZones.user_id == UserDetails.id)
     query = query.filter(UserDetails.username == username).filter(UserTimeZones.name == name)
     return query.one_or_none()
 
+def _bump_timezones_version(user_id):
+    '''mark a user's timezones collection as changed, within the current transaction'''
+    db.session.query(UserDetails).filter(UserDetails.id == user_id)\
+        .update({'timezones_version': UserDetails.timezones_version + 1}, synchronize_session=False)
+
+def _check_timezone_name(name):
+    '''
+    verify a user timezone name is not taken by a route
+    '''
+    if name in RESERVED_TIMEZONE_NAMES:
+        raise error.InvalidFieldFormat(f'Invalid timezone name, {name} is reserved')
+
 def create_user_timezone(username, name, timezone_id):
     '''create a new user timezone'''
     if not name or not timezone_id:
         log.error(f'invalid input: {name}, {timezone_id}')
         raise ValueError('Invalid input values!')
+    _check_timezone_name(name)
 
     user = UserDetails.get(username)
     if not user:
@@ -371,25 +1030,26 @@ def create_user_timezone(username, name, timezone_id):
 
     try:
         db.session.add(new_user_timezone)
+        _bump_timezones_version(user.id)
         db.session.commit()
     except sqlalchemy.exc.SQLAlchemyError as ex:
         db.session.rollback()
         log.error(f'Could not create timezone {name} for {username}: {ex}')
         raise error.StorageError(f'Could not add timezone {name} for user {username}!')
 
+    working_hours_index.refresh_user(user.id)
     log.info(f'User {username} created')
     return new_user_timezone
 
 def get_user_timezone(username, name):
     '''get a user timezone'''
-    user = UserDetails.get(username)
+    user = request_context.current().user(username)
     if not user:
         raise error.RecordNotFoundError(f'username {username} not found')
 
     query = db.session.query(UserTimeZones, TimeZones)\
-            .join(UserDetails, UserTimeZones.user_id == UserDetails.id)\
             .join(TimeZones, UserTimeZones.timezone_id == TimeZones.id)\
-            .filter(UserDetails.username == username)\
+            .filter(UserTimeZones.user_id == user.id)\
             .filter(UserTimeZones.name == name)
 
     res = query.one_or_none()
@@ -397,6 +1057,7 @@ def get_user_timezone(username, name):
         raise error.RecordNotFoundError(f'user {username} timezone {name} not found')
 
     timezone = res.TimeZones.to_dict()
+    timezone['relative_to_gmt'] = timezone_catalog.get().offsets_by_id.get(res.TimeZones.id, res.TimeZones.relative_to_gmt)
     timezone.update(res.UserTimeZones.to_dict())
 
     return timezone
@@ -405,6 +1066,8 @@ def update_user_timezone(username, tz_name, **kwargs):
     '''update a user timezone'''
     new_name = kwargs.get('name')
     timezone_id = kwargs.get('timezone_id')
+    if new_name:
+        _check_timezone_name(new_name)
 
     user = UserDetails.get(username)
     if not user:
@@ -431,11 +1094,13 @@ def update_user_timezone(username, tz_name, **kwargs):
     if changed:
         try:
             db.session.add(timezone)
+            _bump_timezones_version(user.id)
             db.session.commit()
         except sqlalchemy.exc.SQLAlchemyError as ex:
             db.session.rollback()
             log.error(f'Could not update timezone {tz_name}: {ex}')
             raise error.StorageError(f'Could not update timezone {tz_name}!')
+        working_hours_index.refresh_user(user.id)
 
     log.info(f'timezone {tz_name} updated user {username}')
 
@@ -452,15 +1117,29 @@ def delete_user_timezone(username, name):
     log.error(f'deleteing {timezone}')
     try:
         db.session.delete(timezone)
+        _bump_timezones_version(user.id)
         db.session.commit()
     except sqlalchemy.exc.SQLAlchemyError as ex:
         db.session.rollback()
         log.error(f'Error while deleting timezone {name}: {ex}')
         raise error.StorageError(f'Error while deleting timezone {name}')
 
+    working_hours_index.refresh_user(user.id)
     log.info(f'timezone {name} deleted for user {username}')
 
 
+def _rehash_user_password(user, new_hash):
+    '''store a password hash upgraded to the current hashing policy'''
+    try:
+        user.password = new_hash
+        db.session.add(user)
+        db.session.commit()
+        log.info(f'rehashed password for user {user.username}')
+    except sqlalchemy.exc.SQLAlchemyError as ex:
+        # the old hash still verifies, so the login goes ahead
+        db.session.rollback()
+        log.error(f'Could not rehash password for user {user.username}: {ex}')
+
 def authenticate_user(username, passwd):
     """
     generates jwt token for user
@@ -475,24 +1154,66 @@ def authenticate_user(username, passwd):
         if res and ( not res.UserDetails.enabled or not res.UserDetails.role_id ):
             raise error.AuthError('User Account is not yet active, please contact support')
 
-        if not(res and UserDetails.verify_hash(passwd, res.UserDetails.password)):
+        if not res:
             raise error.AuthError('invalid user credentials')
 
+        verified, new_hash = UserDetails.verify_and_update_hash(passwd, res.UserDetails.password)
+        if not verified:
+            raise error.AuthError('invalid user credentials')
+
+        if new_hash:
+            _rehash_user_password(res.UserDetails, new_hash)
+
         user = res.UserRoles.to_dict()
         user.update(res.UserDetails.to_dict())
     else:
         raise error.AuthError("invalid username format")
 
+    refresh_token = flask_jwt_extended.create_refresh_token(identity=user)
+    refresh_jwt = flask_jwt_extended.decode_token(refresh_token)
+    user['refresh_jti'] = refresh_jwt['jti']
+    user['refresh_exp'] = refresh_jwt['exp']
+
     access_token = flask_jwt_extended.create_access_token(identity=user)
     log.info(f'created JWT access tokens for user {username}: {access_token}')
 
+    return {'access_token': access_token, 'refresh_token': refresh_token}
+
+def refresh_access_token(username, refresh_jwt):
+    """
+    generates a new jwt access token for a user holding a valid refresh token
+    """
+    user_status = user_status_cache.get(username, UserDetails.get_status)
+    if not user_status:
+        raise error.AuthError('invalid user credentials')
+    if not user_status.enabled or not user_status.role_id:
+        raise error.AuthError('User Account is not yet active, please contact support')
+
+    user_role = UserRoles.get_by_id(user_status.role_id)
+    if not user_role:
+        raise error.AuthError('invalid user credentials')
+
+    user = {
+        'username': username,
+        'role': user_role['role'],
+        'permissions': user_role['permissions'],
+        'permission_mask': user_role['permission_mask'],
+        'refresh_jti': refresh_jwt['jti'],
+        'refresh_exp': refresh_jwt['exp']
+    }
+    access_token = flask_jwt_extended.create_access_token(identity=user)
+    log.info(f'refreshed JWT access token for user {username}')
+
     return {'access_token': access_token}
 
-def revoke_token(jti):
+def revoke_token(jti, exp):
     """
-    revoke a token
+    revoke a token; exp is the token expiry as a UTC epoch
     """
-    revoked_token = RevokedUserTokens(jti=jti)
+    if revoked_token_index.is_revoked(jti):
+        return
+
+    revoked_token = RevokedUserTokens(jti=jti, exp=datetime.datetime.utcfromtimestamp(exp))
     try:
         db.session.add(revoked_token)
         db.session.commit()
@@ -501,4 +1222,6 @@ def revoke_token(jti):
         log.error(f'Could not add token JTI {jti} to revoked tokens: {ex}')
         raise error.StorageError(f'problem revoking token')
 
+    revoked_token_index.add(jti, expires=exp)
+    verified_token_cache.invalidate(jti)
     log.info(f'token {jti} revoked')
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+In-memory token bucket rate limiting for login attempts.
+
+Buckets are kept per key in a bounded LRU, so the memory used is capped
+no matter how many distinct usernames or addresses are tried.
+"""
+import logging
+import threading
+import math
+import time
+import collections
+import app.error as err
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucketLimiter(object):
+    """token buckets refilled at `rate` tokens per second, holding at most `burst` tokens"""
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self._lock = threading.Lock()
+        self._buckets = collections.OrderedDict()
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.rejected = 0
+
+    def acquire(self, key):
+        """
+        take a token from key's bucket; returns 0 when allowed, else the seconds until a token is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate if self.rate else 3600
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def refund(self, key):
+        """
+        return a token taken from key's bucket
+        """
+        with self._lock:
+            if key in self._buckets:
+                tokens, last = self._buckets[key]
+                self._buckets[key] = (min(self.burst, tokens + 1), last)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'keys': len(self._buckets),
+                'max_keys': self.max_keys,
+                'rejected': self.rejected
+            }
+
+
+class LoginRateLimiter(object):
+    """limits login attempts per client address and per username"""
+
+    def __init__(self):
+        self.configure(user_rate=0.1, user_burst=5, address_rate=1, address_burst=20, max_keys=100000)
+
+    def configure(self, user_rate, user_burst, address_rate, address_burst, max_keys):
+        self.by_user = TokenBucketLimiter(user_rate, user_burst, max_keys)
+        self.by_address = TokenBucketLimiter(address_rate, address_burst, max_keys)
+
+    def check(self, username, address):
+        """
+        raise RateLimitError if the attempt exceeds the address or the username rate
+        """
+        wait = self.by_address.acquire(address)
+        if not wait:
+            wait = self.by_user.acquire(username)
+        if wait:
+            log.warning(f'login attempt rejected for user {username} from {address}')
+            raise err.RateLimitError('too many login attempts, please retry later', math.ceil(wait))
+
+    def succeeded(self, username):
+        """
+        only failed attempts count against a username, so a successful login gives its token back
+        """
+        self.by_user.refund(username)
+
+    def stats(self):
+        return {
+            'by_user': self.by_user.stats(),
+            'by_address': self.by_address.stats()
+        }
+
+
+login_rate_limiter = LoginRateLimiter()
@@ -0,0 +1,80 @@
+"""
+Per-request cache of user rows shared by the auth checks and the queries.
+
+The caller's and the target user's details, role and permissions are read
+together with one joined SELECT the first time either is needed; the rest
+of the request reuses them.
+"""
+import logging
+import collections
+import flask
+
+from app.storage.db import db
+from app.storage.user_details import UserDetails
+from app.storage.user_roles import UserRoles
+from app.storage.user_status_cache import UserStatus
+
+log = logging.getLogger(__name__)
+
+UserContext = collections.namedtuple('UserContext', [
+    'id', 'username', 'first_name', 'last_name', 'email', 'enabled', 'role_id', 'role', 'permissions',
+    'version', 'timezones_version', 'created'
+])
+
+
+class RequestContext(object):
+    """users loaded during one request, by username; None marks a missing user"""
+
+    def __init__(self):
+        self._users = {}
+        self.queries = 0
+
+    def load(self, *usernames):
+        """
+        load the given users not loaded yet, with a single query
+        """
+        missing = [x for x in dict.fromkeys(usernames) if x is not None and x not in self._users]
+        if not missing:
+            return
+
+        rows = db.session.query(
+            UserDetails.id, UserDetails.username, UserDetails.first_name, UserDetails.last_name,
+            UserDetails.email, UserDetails.enabled, UserDetails.role_id, UserRoles.role, UserRoles.permissions,
+            UserDetails.version, UserDetails.timezones_version, UserDetails.created
+        ).outerjoin(UserRoles, UserRoles.id == UserDetails.role_id)\
+            .filter(UserDetails.username.in_(missing)).all()
+        self.queries += 1
+
+        self._users.update(dict.fromkeys(missing))
+        for row in rows:
+            self._users[row.username] = UserContext(*row)
+
+    def user(self, username):
+        """
+        get a user's details, role and permissions, None if the user does not exist
+        """
+        self.load(username)
+        return self._users[username]
+
+    def status(self, username):
+        """
+        get a user's account status, as cached by the user status cache
+        """
+        user = self.user(username)
+        return UserStatus(enabled=user.enabled, role_id=user.role_id, user_id=user.id) if user else None
+
+    def invalidate(self, username):
+        self._users.pop(username, None)
+
+
+def current():
+    """
+    context of the current request; outside of a request a new, unshared context is returned
+    """
+    top = flask._request_ctx_stack.top
+    if top is None:
+        return RequestContext()
+    context = getattr(top, 'timekeeper_context', None)
+    if context is None:
+        context = top.timekeeper_context = RequestContext()
+    return context
@@ -58,6 +58,20 @@ def handle_auth_errors(error):
             msg = str(error)
     return {'error': {'message': msg}}, http_status
 
+@flask_api.errorhandler(err.PreconditionFailedError)
+def handle_precondition_errors(error):
+    """Resource changed since the client read it"""
+    http_status = 412
+    return {'error': {'code': http_status, 'message': str(error)}}, http_status
+
+@flask_api.errorhandler(err.ServiceBusyError)
+def handle_busy_errors(error):
+    """Service temporarily overloaded"""
+    http_status = 503
+    if isinstance(error, err.RateLimitError):
+        http_status = 429
+    return {'error': {'code': http_status, 'message': str(error)}}, http_status, {'Retry-After': str(error.retry_after)}
+
 @flask_api.errorhandler(jwt.PyJWTError)
 def handle_expired_tokens(error):
     '''Handles errors dues to using expired tokens'''
@@ -89,6 +103,11 @@ def handle_not_found(error):
     """Not Found"""
     return {'error': {'message': str(error)}}, 404
 
+@flask_api.errorhandler(werkzeug.exceptions.RequestEntityTooLarge)
+def handle_request_too_large(error):
+    """Request body too large"""
+    return {'error': {'message': str(error)}}, 413
+
 @flask_api.errorhandler
 def handle_default_error(error):
     """Internal processing error"""
@@ -1,19 +1,33 @@
 """
-Flask RESTPlus API with 3 namespaces
+Flask RESTPlus API with 4 namespaces
 1. User API for managing user details
 2. Role API for managing user roles
 3. Timezone API for managing user timezones
+4. Metrics API for internal counters
 """
 import logging
+import werkzeug
 import flask_jwt_extended
-from flask import Flask, Blueprint, request
+from flask import Flask, Blueprint, request, current_app
 from app.rest import flask_api
 from app.view.auth_api import ns as auth_ns
 from app.view.role_api import ns as role_ns
 from app.view.user_api import ns as user_ns
 from app.view.timezone_api import ns as timezone_ns
+from app.view.metrics_api import ns as metrics_ns
 from app.storage.db import db
-from app.storage.user_token import RevokedUserTokens
+from app.storage.revoked_token_index import revoked_token_index
+from app.storage.revoked_token_sweeper import revoked_token_sweeper
+from app.storage.user_status_cache import user_status_cache
+from app.storage.timezone_catalog import timezone_catalog
+from app.storage.working_hours_index import working_hours_index
+import app.storage.schema_upgrade as schema_upgrade
+import app.storage.user_search as user_search
+import app.queries_handler as qh
+from app.hashing_pool import hashing_pool
+from app.jwt_cache import verified_token_cache
+from app.rate_limiter import login_rate_limiter
+from app.password_policy import password_policy
 from app.view.utils import check_user_enabled
 
 
@@ -44,11 +58,40 @@ class FlaskCfgObject(object):
 
         self.JWT_SECRET_KEY = server_cfg.JWT_SECRET_KEY
         self.JWT_BLACKLIST_ENABLED = True
-        self.JWT_BLACKLIST_TOKEN_CHECKS = ['access', ]
+        self.JWT_BLACKLIST_TOKEN_CHECKS = ['access', 'refresh']
         self.JWT_ACCESS_TOKEN_EXPIRES = server_cfg.JWT_ACCESS_TOKEN_EXPIRES
+        self.JWT_REFRESH_TOKEN_EXPIRES = server_cfg.JWT_REFRESH_TOKEN_EXPIRES
+        self.JWT_VERIFIED_CACHE_SIZE = server_cfg.JWT_VERIFIED_CACHE_SIZE
+        self.REVOKED_TOKENS_REFRESH_INTERVAL = server_cfg.REVOKED_TOKENS_REFRESH_INTERVAL
+        self.REVOKED_TOKENS_SWEEP_INTERVAL = server_cfg.REVOKED_TOKENS_SWEEP_INTERVAL
+        self.REVOKED_TOKENS_SWEEP_BATCH = server_cfg.REVOKED_TOKENS_SWEEP_BATCH
+
+        self.USER_STATUS_CACHE_SIZE = server_cfg.USER_STATUS_CACHE_SIZE
+        self.USER_STATUS_CACHE_TTL = server_cfg.USER_STATUS_CACHE_TTL
+
+        self.PASSWORD_HASH_WORKERS = server_cfg.PASSWORD_HASH_WORKERS
+        self.PASSWORD_HASH_MAX_PENDING = server_cfg.PASSWORD_HASH_MAX_PENDING
+        self.PASSWORD_HASH_RETRY_AFTER = server_cfg.PASSWORD_HASH_RETRY_AFTER
+        self.PASSWORD_HASH_SCHEME = server_cfg.PASSWORD_HASH_SCHEME
+        self.PASSWORD_HASH_ROUNDS = server_cfg.PASSWORD_HASH_ROUNDS
+        self.PASSWORD_HASH_TARGET_MS = server_cfg.PASSWORD_HASH_TARGET_MS
+
+        self.LOGIN_RATE_PER_USER = server_cfg.LOGIN_RATE_PER_USER
+        self.LOGIN_BURST_PER_USER = server_cfg.LOGIN_BURST_PER_USER
+        self.LOGIN_RATE_PER_ADDRESS = server_cfg.LOGIN_RATE_PER_ADDRESS
+        self.LOGIN_BURST_PER_ADDRESS = server_cfg.LOGIN_BURST_PER_ADDRESS
+        self.LOGIN_RATE_LIMIT_MAX_KEYS = server_cfg.LOGIN_RATE_LIMIT_MAX_KEYS
+
+        self.USER_IMPORT_MAX_ROWS = server_cfg.USER_IMPORT_MAX_ROWS
+        self.USER_IMPORT_BATCH_SIZE = server_cfg.USER_IMPORT_BATCH_SIZE
+        self.MAX_CONTENT_LENGTH = server_cfg.MAX_CONTENT_LENGTH
 
         self.CORS = 'Content-Type'
         self.TIMEZONE_INITIAL_VALUES = server_cfg.TIMEZONE_INITIAL_VALUES
+        self.TIMEZONE_CATALOG_MAX_AGE = server_cfg.TIMEZONE_CATALOG_MAX_AGE
+        self.TIMEZONE_CONVERT_MAX_INSTANTS = server_cfg.TIMEZONE_CONVERT_MAX_INSTANTS
+        self.TIMEZONE_CONVERT_MAX_VALUES = server_cfg.TIMEZONE_CONVERT_MAX_VALUES
+        self.WORKING_HOURS_INDEX_REFRESH_INTERVAL = server_cfg.WORKING_HOURS_INDEX_REFRESH_INTERVAL
         self.TESTING = server_cfg.TESTING
 
         # flask uses ENV
@@ -58,10 +101,16 @@ class FlaskCfgObject(object):
 # callback for create_access_token
 # Lets us define the custom claims in access token
 def jwt_add_claims_to_access_token(user):
-    return {
+    claims = {
         'role': user['role'],
-        'permissions': user['permissions']
+        'permissions': user['permissions'],
+        'permission_mask': user.get('permission_mask')
     }
+    # ties the access token to its refresh token so logout can revoke both
+    if user.get('refresh_jti'):
+        claims['refresh_jti'] = user['refresh_jti']
+        claims['refresh_exp'] = user['refresh_exp']
+    return claims
 
 # callback for create_access_token
 # Lets us define the identity in access token
@@ -71,7 +120,7 @@ def jwt_user_identity_lookup(user):
 # callback for jti blacklist loader
 def jwt_check_blacklisted(decrypted_token):
     jti = decrypted_token['jti']
-    return RevokedUserTokens.is_blacklisted(jti)
+    return revoked_token_index.is_revoked(jti)
 
 
 # callback to add CORS headers to each response
@@ -84,6 +133,13 @@ def add_cors_headers(response):
                 response.headers['Access-Control-Allow-Headers'] = headers
         return response
 
+# callback to reject request bodies over MAX_CONTENT_LENGTH before reading them,
+# werkzeug only enforces the limit when parsing form data
+def check_content_length():
+    max_length = current_app.config['MAX_CONTENT_LENGTH']
+    if max_length is not None and (request.content_length or 0) > max_length:
+        raise werkzeug.exceptions.RequestEntityTooLarge()
+
 def create_app(config):
     """
     Create a Flask app with a registered API and namespaces
@@ -96,18 +152,38 @@ def create_app(config):
     flask_api.add_namespace(user_ns)
     flask_api.add_namespace(role_ns)
     flask_api.add_namespace(timezone_ns)
+    flask_api.add_namespace(metrics_ns)
 
     if 'api' not in flask_app.blueprints:
         flask_app.register_blueprint(blueprint)
 
     log.info('Database path: %s', config.SQLALCHEMY_DATABASE_URI)
     db.init_app(flask_app)
+    verified_token_cache.configure(config.JWT_VERIFIED_CACHE_SIZE)
+    user_status_cache.configure(config.USER_STATUS_CACHE_SIZE, config.USER_STATUS_CACHE_TTL)
+    revoked_token_index.configure(
+        int(config.JWT_ACCESS_TOKEN_EXPIRES.total_seconds()), config.REVOKED_TOKENS_REFRESH_INTERVAL
+    )
+    password_policy.configure(
+        config.PASSWORD_HASH_SCHEME, config.PASSWORD_HASH_ROUNDS, config.PASSWORD_HASH_TARGET_MS
+    )
+    hashing_pool.configure(
+        config.PASSWORD_HASH_WORKERS, config.PASSWORD_HASH_MAX_PENDING, config.PASSWORD_HASH_RETRY_AFTER
+    )
+    login_rate_limiter.configure(
+        config.LOGIN_RATE_PER_USER, config.LOGIN_BURST_PER_USER,
+        config.LOGIN_RATE_PER_ADDRESS, config.LOGIN_BURST_PER_ADDRESS,
+        config.LOGIN_RATE_LIMIT_MAX_KEYS
+    )
+    revoked_token_sweeper.configure(config.REVOKED_TOKENS_SWEEP_INTERVAL, config.REVOKED_TOKENS_SWEEP_BATCH)
+    working_hours_index.configure(config.WORKING_HOURS_INDEX_REFRESH_INTERVAL)
 
     jwt = flask_jwt_extended.JWTManager(flask_app)
     jwt.user_claims_loader(jwt_add_claims_to_access_token)
     jwt.user_identity_loader(jwt_user_identity_lookup)
     jwt.token_in_blacklist_loader(jwt_check_blacklisted)
 
+    flask_app.before_request(check_content_length)
     flask_app.after_request(add_cors_headers)
 
     return flask_app
@@ -116,9 +192,16 @@ def init_db(app):
     with app.app_context():
         db.create_all()
         db.session.commit()
+        schema_upgrade.upgrade(app.config)
+        user_search.ensure_search_index()
+        qh.report_reserved_names()
+        revoked_token_index.load()
+        timezone_catalog.load()
+        working_hours_index.load()
 
 def initialize_app(cfg):
     app = create_app(cfg)
     init_db(app)
+    revoked_token_sweeper.start(app)
 
     return app
@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+import calendar
+
+from app.storage.db import db
+from app.storage.user_token import RevokedUserTokens
+
+log = logging.getLogger(__name__)
+
+
+def _to_epoch(utc_datetime):
+    return calendar.timegm(utc_datetime.utctimetuple())
+
+
+class RevokedTokenIndex(object):
+    """
+    in-memory index of revoked token JTIs, mirroring RevokedUserTokens
+
+    Entries are dropped once the revoked token has expired and could no
+    longer pass the expiry check anyway. Rows revoked by other worker
+    processes are picked up by an incremental reload every
+    `refresh_interval` seconds.
+    """
+
+    def __init__(self, token_ttl=900, refresh_interval=5, prune_interval=60):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._last_id = 0
+        self.token_ttl = token_ttl
+        self.refresh_interval = refresh_interval
+        self.prune_interval = prune_interval
+        self._next_refresh = 0
+        self._next_prune = 0
+
+    def configure(self, token_ttl, refresh_interval, prune_interval=60):
+        """
+        apply new settings and drop all indexed entries
+        """
+        with self._lock:
+            self.token_ttl = token_ttl
+            self.refresh_interval = refresh_interval
+            self.prune_interval = prune_interval
+            self._entries.clear()
+            self._last_id = 0
+
+    def load(self):
+        """
+        (re)load all still relevant revocations from the database
+        """
+        with self._lock:
+            self._entries.clear()
+            self._last_id = 0
+        self._load_rows_after(0)
+        log.info(f'loaded {len(self)} revoked tokens')
+
+    def _load_rows_after(self, last_id):
+        query = db.session.query(RevokedUserTokens.id, RevokedUserTokens.jti, RevokedUserTokens.exp)\
+                .filter(RevokedUserTokens.id > last_id)
+        now = time.time()
+        with self._lock:
+            for row in query:
+                expires = _to_epoch(row.exp)
+                if expires > now:
+                    self._entries[row.jti] = expires
+                self._last_id = max(self._last_id, row.id)
+            self._next_refresh = time.monotonic() + self.refresh_interval
+
+    def add(self, jti, expires=None):
+        """
+        add a revoked token JTI; expires is the epoch after which it can be dropped
+        """
+        if expires is None:
+            expires = time.time() + self.token_ttl
+        with self._lock:
+            self._entries[jti] = expires
+
+    def is_revoked(self, jti):
+        """
+        checks if token jti is revoked
+        """
+        now = time.monotonic()
+        if self.refresh_interval and now >= self._next_refresh:
+            self._load_rows_after(self._last_id)
+        if now >= self._next_prune:
+            self.prune()
+        return jti in self._entries
+
+    def prune(self):
+        """
+        drop entries for tokens that have expired
+        """
+        now = time.time()
+        with self._lock:
+            expired = [jti for jti, expires in self._entries.items() if expires <= now]
+            for jti in expired:
+                del self._entries[jti]
+            self._next_prune = time.monotonic() + self.prune_interval
+        return len(expired)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+revoked_token_index = RevokedTokenIndex()
@@ -0,0 +1,89 @@
+import logging
+import threading
+import datetime
+import time
+
+from app.storage.db import db
+from app.storage.user_token import RevokedUserTokens
+
+log = logging.getLogger(__name__)
+
+
+class RevokedTokenSweeper(object):
+    """
+    background thread purging expired rows from RevokedUserTokens
+
+    Rows are deleted in batches of `batch_size`, each in its own short
+    transaction, pausing `batch_pause` seconds in between so other writers
+    can take the SQLite write lock.
+    """
+
+    def __init__(self, interval=300, batch_size=500, batch_pause=0.05):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self._thread = None
+        self._stop = threading.Event()
+        self.table_size = None
+        self.last_purged = 0
+        self.total_purged = 0
+
+    def configure(self, interval, batch_size):
+        self.interval = interval
+        self.batch_size = batch_size
+
+    def start(self, app):
+        """
+        start sweeping in a daemon thread; a zero interval disables the sweeper
+        """
+        if not self.interval or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(app,), name='revoked-token-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, app):
+        while not self._stop.wait(self.interval):
+            with app.app_context():
+                try:
+                    self.sweep()
+                except Exception as ex:
+                    log.error(f'revoked tokens sweep failed: {ex}')
+                finally:
+                    db.session.remove()
+
+    def sweep(self, now=None):
+        """
+        delete all expired revocations, one bounded batch at a time
+        """
+        now = now or datetime.datetime.utcnow()
+        purged = 0
+        while True:
+            nr_deleted = RevokedUserTokens.delete_expired(now, self.batch_size)
+            purged += nr_deleted
+            if nr_deleted < self.batch_size or self._stop.is_set():
+                break
+            time.sleep(self.batch_pause)
+
+        self.last_purged = purged
+        self.total_purged += purged
+        self.table_size = RevokedUserTokens.count()
+        if purged:
+            log.info(f'purged {purged} expired revoked tokens, {self.table_size} left')
+        return purged
+
+    def stats(self):
+        return {
+            'table_size': self.table_size,
+            'last_purged': self.last_purged,
+            'total_purged': self.total_purged
+        }
+
+
+revoked_token_sweeper = RevokedTokenSweeper()
@@ -0,0 +1,140 @@
+"""
+In-place upgrade of databases created before columns were added to existing tables
+or changed type.
+
+db.create_all only creates missing tables, so each column listed in UPGRADES
+is added with ALTER TABLE when its table exists without it, together with its
+indexes, and the existing rows are then backfilled.
+
+SQLite cannot change the type of a column, and a value stored in a column
+declared as text stays text. A table with a column of RETYPES still stored
+with another type affinity is rebuilt from its model: the stored values are
+converted first, then copied to a new table that replaces the old one.
+"""
+import logging
+import sqlalchemy
+
+from app.storage.db import db
+from app.storage.user_token import RevokedUserTokens
+from app.storage.user_details import UserDetails
+from app.storage.user_roles import UserRoles, UserRolesEnum
+import app.storage.user_search as user_search
+
+log = logging.getLogger(__name__)
+
+
+def _backfill_revocation_expiry(config):
+    '''revoked tokens were issued before they were revoked, so none outlives revoke_ts plus the refresh token lifetime'''
+    refresh_expires = config['JWT_REFRESH_TOKEN_EXPIRES']
+    rows = db.session.query(RevokedUserTokens.id, RevokedUserTokens.revoke_ts).all()
+    db.session.bulk_update_mappings(
+        RevokedUserTokens, [{'id': x.id, 'exp': x.revoke_ts + refresh_expires} for x in rows]
+    )
+
+
+# (column, SQL literal default for the existing rows, backfill function or None)
+UPGRADES = [
+    (RevokedUserTokens.__table__.c.exp, "'1970-01-01 00:00:00'", _backfill_revocation_expiry),
+    (UserDetails.__table__.c.version, "1", None),
+    (UserDetails.__table__.c.timezones_version, "1", None),
+    (UserDetails.__table__.c.created, "'1970-01-01 00:00:00'", None),
+]
+
+
+def _convert_permissions(connection):
+    '''comma joined permission values, as stored before permissions became bitmasks, to their bitmask'''
+    rows = connection.execute('SELECT id, permissions FROM "UserRoles"').fetchall()
+    for role_id, permissions in rows:
+        if isinstance(permissions, str) and not permissions.isdigit():
+            mask = UserRolesEnum.to_mask([x for x in permissions.split(',') if x])
+            connection.execute('UPDATE "UserRoles" SET permissions = ? WHERE id = ?', (mask, role_id))
+
+
+def _drop_search_index(connection):
+    '''the search triggers went with the old UserDetails table, the index is created again at startup'''
+    connection.execute(f'DROP TABLE IF EXISTS "{user_search.SEARCH_TABLE}"')
+
+
+# (column, function converting its stored values or None); the whole table is rebuilt
+RETYPES = [
+    (UserRoles.__table__.c.permissions, _convert_permissions),
+    (UserDetails.__table__.c.role_id, None),
+]
+
+# (table, function run once the table was rebuilt)
+AFTER_REBUILD = {
+    UserDetails.__table__: _drop_search_index,
+}
+
+
+def _rebuild_table(table, columns):
+    '''replace a table by one created from its model, keeping the rows of the given columns'''
+    connection = db.session.connection()
+    name = table.name
+    create = str(sqlalchemy.schema.CreateTable(table).compile(dialect=connection.dialect))
+    # pysqlite runs CREATE TABLE outside the transaction, so a failed rebuild can leave it behind
+    connection.execute(f'DROP TABLE IF EXISTS "{name}_upgrade"')
+    connection.execute(create.replace(f'CREATE TABLE "{name}"', f'CREATE TABLE "{name}_upgrade"', 1))
+    names = ', '.join(f'"{x}"' for x in columns)
+    connection.execute(f'INSERT INTO "{name}_upgrade" ({names}) SELECT {names} FROM "{name}"')
+    connection.execute(f'DROP TABLE "{name}"')
+    connection.execute(f'ALTER TABLE "{name}_upgrade" RENAME TO "{name}"')
+    for index in table.indexes:
+        index.create(bind=connection)
+
+
+def _add_column(column, default):
+    connection = db.session.connection()
+    column_type = column.type.compile(dialect=connection.dialect)
+    nullable = '' if column.nullable else ' NOT NULL'
+    connection.execute(f'ALTER TABLE "{column.table.name}" ADD COLUMN "{column.name}" {column_type}{nullable} DEFAULT {default}')
+    for index in column.table.indexes:
+        if column.name in index.columns:
+            index.create(bind=connection)
+
+
+def upgrade(config):
+    """
+    add the columns of UPGRADES missing from existing tables and backfill them
+    """
+    inspector = sqlalchemy.inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    for column, default, backfill in UPGRADES:
+        table = column.table.name
+        if table not in tables or column.name in [x['name'] for x in inspector.get_columns(table)]:
+            continue
+        log.warning(f'upgrading database: adding column {table}.{column.name}')
+        try:
+            _add_column(column, default)
+            if backfill:
+                backfill(config)
+            db.session.commit()
+        except sqlalchemy.exc.SQLAlchemyError:
+            db.session.rollback()
+            raise
+
+    # a new inspector, the columns added above are not in the cached reflection
+    inspector = sqlalchemy.inspect(db.engine)
+    for table in dict.fromkeys(x.table for x, _ in RETYPES):
+        if table.name not in tables:
+            continue
+        stored = {x['name']: x['type'] for x in inspector.get_columns(table.name)}
+        retyped = [
+            (column, convert) for column, convert in RETYPES if column.table is table and column.name in stored
+            and stored[column.name]._type_affinity is not column.type._type_affinity
+        ]
+        if not retyped:
+            continue
+        log.warning(f'upgrading database: rebuilding table {table.name} for columns {[x.name for x, _ in retyped]}')
+        try:
+            connection = db.session.connection()
+            for _, convert in retyped:
+                if convert:
+                    convert(connection)
+            _rebuild_table(table, [x.name for x in table.columns if x.name in stored])
+            if table in AFTER_REBUILD:
+                AFTER_REBUILD[table](connection)
+            db.session.commit()
+        except sqlalchemy.exc.SQLAlchemyError:
+            db.session.rollback()
+            raise
@@ -0,0 +1,163 @@
+"""
+In-memory, pre-serialized copy of the timezones catalog.
+
+The catalog only changes when it is seeded, so the GET /timezone body is
+built once, together with its compressed variants and ETag, and rebuilt
+lazily after any change to the TimeZones table. Offsets are the live ones
+from tzdata rather than the seeded relative_to_gmt strings; the snapshot is
+also rebuilt, without reading the database, once any zone's offset changes.
+"""
+import logging
+import threading
+import time
+import hashlib
+import gzip
+import json
+import sqlalchemy
+
+from app.storage.db import db
+from app.storage.timezones import TimeZones
+from app.storage.timezone_index import TimezoneIndex
+from app.storage.timezone_suggest import SuggestIndex
+from app.storage.timezone_offsets import format_offset
+from app.storage.timezone_convert import ZoneTable, NO_TRANSITION
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+CATALOG_FIELDS = ['id', 'location', 'city', 'relative_to_gmt']
+
+
+class CatalogSnapshot(object):
+    """serialized catalog: the rows, their indexes, the JSON body by content encoding and its ETag"""
+
+    def __init__(self, rows, valid_until=float('inf'), zones=None):
+        self.rows = rows
+        self.valid_until = valid_until
+        # transition tables of the rows, in row order
+        self.zones = zones
+        self.positions_by_id = {x[0]: i for i, x in enumerate(rows)}
+        self.rows_by_id = {x[0]: x for x in rows}
+        self.offsets_by_id = {x[0]: x[3] for x in rows}
+        self.index = TimezoneIndex(rows)
+        self.suggest_index = SuggestIndex(rows)
+        body = json.dumps({'data': [dict(zip(CATALOG_FIELDS, x)) for x in rows]}, separators=(',', ':')).encode()
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=11)
+
+    def encodings(self):
+        '''available content encodings, preferred first'''
+        return [x for x in ('br', 'gzip', 'identity') if x in self.bodies]
+
+
+class TimezoneCatalog(object):
+    """lazily built catalog snapshot, dropped whenever TimeZones changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # held while loading or building, so concurrent requests wait for one build instead of repeating it
+        self._build_lock = threading.RLock()
+        self._snapshot = None
+        self._rows = None
+        self._zones = None
+        # bumped by invalidate, a load or build started before it is not kept
+        self._generation = 0
+        self.builds = 0
+
+    def load(self):
+        """
+        read the catalog from the database and build its snapshot
+        """
+        with self._build_lock:
+            with self._lock:
+                generation = self._generation
+            rows = [tuple(x) for x in db.session.query(
+                TimeZones.id, TimeZones.location, TimeZones.city, TimeZones.relative_to_gmt
+            ).order_by(TimeZones.id)]
+            zones = ZoneTable([f'{x[1]}/{x[2]}' for x in rows])
+            with self._lock:
+                if generation == self._generation:
+                    self._rows = rows
+                    self._zones = zones
+            return self._build(rows, zones, generation)
+
+    def _build(self, rows, zones, generation):
+        '''snapshot of rows with the offsets in effect now, kept unless invalidated since generation'''
+        offsets, _, next_transitions = zones.at(range(len(rows)), time.time())
+        next_transitions = next_transitions[zones.known & (next_transitions != NO_TRANSITION)]
+        valid_until = float(next_transitions.min()) if len(next_transitions) else float('inf')
+        live_rows = [
+            x[:3] + (format_offset(int(offset)),) if known else x
+            for x, offset, known in zip(rows, offsets, zones.known)
+        ]
+        snapshot = CatalogSnapshot(live_rows, valid_until, zones)
+        with self._lock:
+            if generation == self._generation:
+                self._snapshot = snapshot
+            self.builds += 1
+        log.info(f'timezone catalog built: {len(rows)} entries, etag {snapshot.etag}')
+        return snapshot
+
+    def _current(self):
+        '''(snapshot if still valid else None, rows, zones, generation) read together'''
+        with self._lock:
+            snapshot, rows, zones, generation = self._snapshot, self._rows, self._zones, self._generation
+        if snapshot is None or rows is None or time.time() >= snapshot.valid_until:
+            snapshot = None
+        return snapshot, rows, zones, generation
+
+    def get(self):
+        """
+        current snapshot, rebuilt first if the catalog or any zone's offset changed since it was built
+        """
+        snapshot = self._current()[0]
+        if snapshot is not None:
+            return snapshot
+        with self._build_lock:
+            # built by another request while this one waited
+            snapshot, rows, zones, generation = self._current()
+            if snapshot is not None:
+                return snapshot
+            if rows is None:
+                return self.load()
+            return self._build(rows, zones, generation)
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._rows = None
+            self._zones = None
+            self._generation += 1
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'entries': len(snapshot.rows) if snapshot else None,
+            'etag': snapshot.etag if snapshot else None,
+            'valid_until': snapshot.valid_until if snapshot and snapshot.valid_until != float('inf') else None,
+            'bytes': {k: len(v) for k, v in snapshot.bodies.items()} if snapshot else None,
+            'builds': self.builds
+        }
+
+
+timezone_catalog = TimezoneCatalog()
+
+
+@sqlalchemy.event.listens_for(TimeZones, 'after_insert')
+@sqlalchemy.event.listens_for(TimeZones, 'after_update')
+@sqlalchemy.event.listens_for(TimeZones, 'after_delete')
+def _timezone_changed(mapper, connection, target):
+    timezone_catalog.invalidate()
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_bulk_update')
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_bulk_delete')
+def _timezones_bulk_changed(context):
+    if context.primary_table is TimeZones.__table__:
+        timezone_catalog.invalidate()
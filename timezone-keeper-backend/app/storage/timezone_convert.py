@@ -0,0 +1,127 @@
+"""
+Vectorized conversion of instants between UTC and zone wall times.
+
+Each zone's tzdata transition table is kept as NumPy arrays, once as UTC
+instants and once as the wall times from which each offset applies, so
+converting any number of instants is one searchsorted over the table and an
+indexed add. Wall times are seconds since 1970-01-01T00:00 on the zone's own
+clock. Wall times skipped or repeated by a transition take the offset in
+effect before it, as datetime does with fold=0.
+
+ZoneTable stacks the tables of many zones into padded matrices, so the
+offsets of any set of zones at one instant are evaluated in one pass.
+"""
+import functools
+import numpy
+
+from app.storage.timezone_offsets import zone_transitions
+
+_FIRST = numpy.iinfo(numpy.int64).min
+NO_TRANSITION = numpy.iinfo(numpy.int64).max
+
+
+class ZoneArrays(object):
+    """transition table of one zone as arrays of UTC instants, wall times and offsets"""
+
+    __slots__ = ('times', 'wall_times', 'offsets', 'dst')
+
+    def __init__(self, times, offsets, dst=None):
+        self.offsets = numpy.array(offsets, dtype=numpy.int64)
+        self.dst = numpy.array(dst if dst is not None else [False] * len(offsets), dtype=bool)
+        self.times = numpy.array([_FIRST] + list(times[1:]), dtype=numpy.int64)
+        self.wall_times = self.times.copy()
+        self.wall_times[1:] += numpy.maximum(self.offsets[:-1], self.offsets[1:])
+
+    def utc_offsets(self, utc):
+        '''offsets in seconds in effect at each UTC instant'''
+        return self.offsets[numpy.searchsorted(self.times, utc, side='right') - 1]
+
+    def local_offsets(self, wall):
+        '''offsets in seconds in effect at each wall time'''
+        return self.offsets[numpy.searchsorted(self.wall_times, wall, side='right') - 1]
+
+    def to_local(self, utc):
+        '''(wall times, offsets) of UTC instants'''
+        offsets = self.utc_offsets(utc)
+        return utc + offsets, offsets
+
+    def to_utc(self, wall):
+        '''(UTC instants, offsets) of wall times'''
+        offsets = self.local_offsets(wall)
+        return wall - offsets, offsets
+
+
+@functools.lru_cache(maxsize=None)
+def zone_arrays(name):
+    """
+    arrays of an IANA zone name, None when tzdata does not know the zone
+    """
+    table = zone_transitions(name)
+    if table is None:
+        return None
+    return ZoneArrays(table.times, table.offsets, table.dst)
+
+
+def fixed_offset(seconds):
+    """
+    arrays of a zone that is always at the same offset
+    """
+    return ZoneArrays([_FIRST], [seconds])
+
+
+class ZoneTable(object):
+    """transition tables of a list of zone names, one padded matrix row per zone"""
+
+    def __init__(self, names):
+        arrays = [zone_arrays(x) for x in names]
+        self.known = numpy.array([x is not None for x in arrays], dtype=bool)
+        # one spare column, so the transition after the last one is always NO_TRANSITION
+        width = max([len(x.times) for x in arrays if x is not None], default=1) + 1
+        self.times = numpy.full((len(names), width), NO_TRANSITION, dtype=numpy.int64)
+        self.offsets = numpy.zeros((len(names), width), dtype=numpy.int64)
+        self.dst = numpy.zeros((len(names), width), dtype=bool)
+        for i, x in enumerate(arrays):
+            if x is not None:
+                self.times[i, :len(x.times)] = x.times
+                self.offsets[i, :len(x.offsets)] = x.offsets
+                self.dst[i, :len(x.dst)] = x.dst
+
+    def at(self, rows, when):
+        """
+        (offsets, DST flags, next transitions or NO_TRANSITION) of the zones at rows at epoch time when;
+        offsets of unknown zones are 0
+        """
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        times = self.times[rows]
+        pos = numpy.maximum((times <= when).sum(axis=1) - 1, 0)
+        return self.offsets[rows, pos], self.dst[rows, pos], times[numpy.arange(len(rows)), pos + 1]
+
+
+def parse_instants(values):
+    """
+    array of epoch seconds from numbers, or from ISO 8601 date times without an offset;
+    returns (array, True when the values were ISO strings)
+    """
+    if not isinstance(values, list) or not values:
+        raise ValueError('invalid instants, non empty array expected')
+    if isinstance(values[0], str):
+        try:
+            return numpy.array(values, dtype='datetime64[s]').astype(numpy.int64), True
+        except (ValueError, TypeError):
+            raise ValueError('invalid instants, ISO 8601 date times expected')
+
+    instants = numpy.array(values)
+    if instants.ndim != 1 or instants.dtype.kind not in 'iuf':
+        raise ValueError('invalid instants, epoch seconds expected')
+    if instants.dtype.kind == 'f' and not numpy.isfinite(instants).all():
+        raise ValueError('invalid instants, epoch seconds expected')
+    return instants, False
+
+
+def format_instants(values, iso):
+    """
+    JSON ready list of epoch seconds, or of ISO 8601 date times with iso
+    """
+    if iso:
+        return numpy.datetime_as_string(values.astype(numpy.int64).astype('datetime64[s]')).tolist()
+    return values.tolist()
@@ -0,0 +1,108 @@
+"""
+In-memory index over the timezones catalog for filtered, sorted and paged reads.
+
+Built once per catalog snapshot from sorted arrays: a sorted array of
+lowercase locations answers prefix queries with two bisections, a sorted
+array of GMT offsets answers exact and range queries the same way, and one
+precomputed order per sort key serves keyset pagination.
+"""
+import bisect
+import re
+
+SORT_KEYS = ['id', 'location', 'city', 'relative_to_gmt']
+
+_OFFSET_RE = re.compile(r'([+-]?)(\d{1,2}):(\d{2})')
+
+
+def parse_offset(value):
+    """
+    minutes east of GMT of a [+-]HH:MM offset
+    """
+    match = _OFFSET_RE.fullmatch(value.strip()) if isinstance(value, str) else None
+    if not match:
+        raise ValueError(f'invalid offset {value}, [+-]HH:MM expected')
+    sign, hours, minutes = match.groups()
+    offset = int(hours) * 60 + int(minutes)
+    return -offset if sign == '-' else offset
+
+
+def _prefix_end(prefix):
+    '''smallest string greater than every string starting with prefix'''
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class TimezoneIndex(object):
+    """indexes of catalog rows (id, location, city, relative_to_gmt)"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.offsets = [parse_offset(x[3]) for x in rows]
+        self._cities = [x[2].lower() for x in rows]
+
+        locations = sorted((x[1].lower(), i) for i, x in enumerate(rows))
+        self._location_keys = [x[0] for x in locations]
+        self._location_rows = [x[1] for x in locations]
+
+        by_offset = sorted(range(len(rows)), key=lambda i: (self.offsets[i], rows[i][0]))
+        self._offset_keys = [self.offsets[i] for i in by_offset]
+        self._offset_rows = by_offset
+
+        self._orders = {}
+        self._order_keys = {}
+        for key in SORT_KEYS:
+            keys = sorted((self.sort_key(key, i), i) for i in range(len(rows)))
+            self._order_keys[key] = [x[0] for x in keys]
+            self._orders[key] = [x[1] for x in keys]
+
+    def sort_key(self, key, i):
+        '''(sort value, id) of row i, unique per row'''
+        if key == 'relative_to_gmt':
+            return self.offsets[i], self.rows[i][0]
+        return self.rows[i][SORT_KEYS.index(key)], self.rows[i][0]
+
+    def _location_prefix(self, prefix):
+        prefix = prefix.lower()
+        lo = bisect.bisect_left(self._location_keys, prefix)
+        hi = bisect.bisect_left(self._location_keys, _prefix_end(prefix))
+        return set(self._location_rows[lo:hi])
+
+    def _offset_range(self, offset_min, offset_max):
+        lo = 0 if offset_min is None else bisect.bisect_left(self._offset_keys, offset_min)
+        hi = len(self._offset_keys) if offset_max is None else bisect.bisect_right(self._offset_keys, offset_max)
+        return set(self._offset_rows[lo:hi])
+
+    def search(self, location=None, city=None, offset_min=None, offset_max=None, sort='id', after=None, limit=100):
+        """
+        rows matching all the given filters in sort order, starting after the `after` sort key;
+        returns (rows, sort key of the last row when more rows follow, else None)
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f'invalid sort key, expected one of {SORT_KEYS}')
+
+        candidates = None
+        if location:
+            candidates = self._location_prefix(location)
+        if offset_min is not None or offset_max is not None:
+            in_range = self._offset_range(offset_min, offset_max)
+            candidates = in_range if candidates is None else candidates & in_range
+        city = city.lower() if city else None
+
+        order = self._orders[sort]
+        start = 0
+        if after is not None:
+            try:
+                start = bisect.bisect_right(self._order_keys[sort], after)
+            except TypeError:
+                raise ValueError('invalid cursor')
+
+        found = []
+        for pos in range(start, len(order)):
+            i = order[pos]
+            if candidates is not None and i not in candidates:
+                continue
+            if city and city not in self._cities[i]:
+                continue
+            if len(found) == limit:
+                return [self.rows[x] for x in found], self.sort_key(sort, found[-1])
+            found.append(i)
+        return [self.rows[x] for x in found], None
@@ -0,0 +1,56 @@
+"""
+Live UTC offsets of IANA zones from tzdata transition tables.
+
+Each zone's table of UTC transition instants and the offsets in effect from
+them is read from tzdata once; timezone_convert turns it into the arrays
+offsets are looked up in. Runs on Python 3.8, without zoneinfo, so tzdata
+comes from pytz.
+"""
+import logging
+import calendar
+import functools
+import pytz
+
+log = logging.getLogger(__name__)
+
+
+def format_offset(seconds):
+    """
+    [+-]HH:MM form of an offset in seconds, as relative_to_gmt values are stored
+    """
+    sign = '-' if seconds < 0 else '+'
+    minutes = abs(seconds) // 60
+    return f'{sign}{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+class ZoneTransitions(object):
+    """sorted UTC transition instants, in epoch seconds, the offset in effect from each and whether it is DST"""
+
+    __slots__ = ('times', 'offsets', 'dst')
+
+    def __init__(self, times, offsets, dst):
+        self.times = times
+        self.offsets = offsets
+        self.dst = dst
+
+
+@functools.lru_cache(maxsize=None)
+def zone_transitions(name):
+    """
+    transition table of an IANA zone name, None when tzdata does not know the zone
+    """
+    try:
+        tz = pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        log.warning(f'timezone {name} not found in tzdata')
+        return None
+
+    times = getattr(tz, '_utc_transition_times', None)
+    if times is None:
+        # fixed offset zone
+        return ZoneTransitions([float('-inf')], [int(tz.utcoffset(None).total_seconds())], [False])
+    return ZoneTransitions(
+        [float('-inf')] + [calendar.timegm(x.utctimetuple()) for x in times[1:]],
+        [int(x[0].total_seconds()) for x in tz._transition_info],
+        [bool(x[1]) for x in tz._transition_info]
+    )
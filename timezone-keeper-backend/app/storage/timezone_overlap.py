@@ -0,0 +1,116 @@
+"""
+Common availability of participants in many timezones over a date range.
+
+Availability is a NumPy bitmap with one entry per UTC minute of the range.
+Working hours are a bitmap of one local week; within each span of constant
+offset a participant's availability is that week bitmap shifted by the
+offset and wrapped over the span, so DST transitions only split the range
+into a few spans. Participants with the same timezone, working hours and
+days share a bitmap, so the cost grows with distinct timezones rather than
+participants. Common windows are the runs of minutes set in every bitmap.
+"""
+import re
+import numpy
+
+MINUTES_PER_DAY = 1440
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# 1970-01-01 was a Thursday, weekdays count from Monday as 0
+_EPOCH_WEEKDAY = 3
+
+_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})')
+
+
+def parse_time_of_day(value):
+    """
+    minutes since midnight of a HH:MM time, 24:00 included
+    """
+    match = _TIME_RE.fullmatch(value.strip()) if isinstance(value, str) else None
+    if not match:
+        raise ValueError(f'invalid time {value}, HH:MM expected')
+    minutes = int(match.group(1)) * 60 + int(match.group(2))
+    if int(match.group(2)) > 59 or minutes > MINUTES_PER_DAY:
+        raise ValueError(f'invalid time {value}, HH:MM expected')
+    return minutes
+
+
+def local_week_minute(minute, offset):
+    """
+    minute of the local week, from Monday 00:00, of UTC epoch minute at offset minutes
+    """
+    return (minute + offset + _EPOCH_WEEKDAY * MINUTES_PER_DAY) % MINUTES_PER_WEEK
+
+
+def week_template(start, end, weekdays):
+    """
+    bitmap of the local minutes of a week, from Monday 00:00, inside start to end minutes on weekdays;
+    a window ending before it starts runs past midnight into the next day
+    """
+    template = numpy.zeros(MINUTES_PER_WEEK, dtype=bool)
+    length = (end - start) % MINUTES_PER_DAY or (MINUTES_PER_DAY if end != start else 0)
+    for day in set(weekdays):
+        first = day * MINUTES_PER_DAY + start
+        template[numpy.arange(first, first + length) % MINUTES_PER_WEEK] = True
+    return template
+
+
+def offset_spans(arrays, start, end):
+    """
+    ((first minute, offset in minutes), ...) spans of constant offset of a zone's ZoneArrays
+    between epoch minutes start and end
+    """
+    times = arrays.times
+    first = numpy.searchsorted(times, start * 60, side='right') - 1
+    last = numpy.searchsorted(times, end * 60, side='left')
+    spans = [(start, int(arrays.offsets[first]) // 60)]
+    for i in range(first + 1, last):
+        # transitions fall on whole minutes in tzdata since 1972
+        spans.append((int(times[i]) // 60, int(arrays.offsets[i]) // 60))
+    return tuple(spans)
+
+
+def availability(template, spans, start, end):
+    """
+    bitmap of the minutes from epoch minute start to end whose local time falls in template
+    """
+    bitmap = numpy.empty(end - start, dtype=bool)
+    bounds = [x[0] for x in spans[1:]] + [end]
+    for (first, offset), last in zip(spans, bounds):
+        # the span is the week rotated to the local week minute of its first minute, repeated
+        week_minute = local_week_minute(first, offset)
+        bitmap[first - start:last - start] = numpy.resize(numpy.roll(template, -week_minute), last - first)
+    return bitmap
+
+
+def common_windows(bitmaps, start, end, min_minutes=1):
+    """
+    [(first minute, minutes)] runs of at least min_minutes of the epoch minutes from start to end
+    set in every bitmap
+    """
+    common = numpy.ones(end - start, dtype=bool)
+    for bitmap in bitmaps:
+        common &= bitmap
+    edges = numpy.diff(numpy.concatenate(([0], common.view(numpy.int8), [0])))
+    firsts = numpy.flatnonzero(edges == 1)
+    lengths = numpy.flatnonzero(edges == -1) - firsts
+    keep = lengths >= min_minutes
+    return list(zip((firsts[keep] + start).tolist(), lengths[keep].tolist()))
+
+
+def meeting_windows(participants, weekdays, start, end, min_minutes=1):
+    """
+    common_windows of (zone key, ZoneArrays, (start, end) working minutes) participants
+    working on weekdays, between epoch minutes start and end
+    """
+    templates = {}
+    spans = {}
+    bitmaps = {}
+    for zone, arrays, hours in participants:
+        if hours not in templates:
+            templates[hours] = week_template(hours[0], hours[1], weekdays)
+        if zone not in spans:
+            spans[zone] = offset_spans(arrays, start, end)
+        # zones with the same offsets over the range share a bitmap
+        key = (hours, spans[zone])
+        if key not in bitmaps:
+            bitmaps[key] = availability(templates[hours], spans[zone], start, end)
+    return common_windows(bitmaps.values(), start, end, min_minutes)
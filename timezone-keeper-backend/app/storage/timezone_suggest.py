@@ -0,0 +1,87 @@
+"""
+Trigram index over the timezones catalog for typo tolerant, ranked typeahead.
+
+Every zone name ("America/Argentina/Buenos_Aires") is normalized to lowercase
+words ("america argentina buenos aires") and split into padded trigrams as
+pg_trgm does. A query is split the same way, except that its last word is
+treated as a prefix still being typed. Candidates are the zones sharing at
+least one trigram, found through the posting lists, and are ranked by the
+share of the query's trigrams they contain, their trigram similarity and a
+bonus for a city word starting with the query.
+"""
+import collections
+import heapq
+import re
+import unicodedata
+
+MIN_MATCH = 0.3
+PREFIX_BONUS = 0.2
+
+_SEPARATORS = re.compile(r'[\s_/\-]+')
+
+
+def normalize(text):
+    """
+    lowercase ascii words of a name or query
+    """
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return [x for x in _SEPARATORS.split(text) if x]
+
+
+def trigrams(words, prefix=False):
+    """
+    padded trigrams of words; with prefix the last word is not closed, as it may still be typed
+    """
+    found = set()
+    for n, word in enumerate(words):
+        padded = '  ' + word
+        if not (prefix and n == len(words) - 1):
+            padded += ' '
+        found.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return found
+
+
+class SuggestIndex(object):
+    """trigram posting lists over catalog rows (id, location, city, relative_to_gmt)"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self._sizes = []
+        self._city_words = []
+        postings = collections.defaultdict(list)
+        for i, row in enumerate(rows):
+            grams = trigrams(normalize(row[1]) + normalize(row[2]))
+            self._sizes.append(len(grams))
+            self._city_words.append(normalize(row[2]))
+            for gram in grams:
+                postings[gram].append(i)
+        self._postings = dict(postings)
+
+    def suggest(self, text, limit=10):
+        """
+        up to limit (score, row) pairs best matching text, best first
+        """
+        words = normalize(text)
+        if not words:
+            return []
+        query = trigrams(words, prefix=True)
+
+        shared = collections.Counter()
+        for gram in query:
+            shared.update(self._postings.get(gram, ()))
+
+        joined = ' '.join(words)
+        scored = []
+        for i, count in shared.items():
+            match = count / len(query)
+            if match < MIN_MATCH:
+                continue
+            similarity = count / (len(query) + self._sizes[i] - count)
+            score = 0.7 * match + 0.3 * similarity
+            city = ' '.join(self._city_words[i])
+            if city.startswith(joined) or any(x.startswith(joined) for x in self._city_words[i]):
+                score += PREFIX_BONUS
+            scored.append((round(score, 4), -self._sizes[i], -i))
+
+        best = heapq.nlargest(limit, scored)
+        return [(score, self.rows[-i]) for score, _, i in best]
@@ -1,7 +1,10 @@
 import logging
+import datetime
 import sqlalchemy
-import passlib.hash
 from app.storage.db import db
+from app.hashing_pool import hashing_pool
+from app.password_policy import password_policy, hash_password, verify_password, verify_and_update_password
+from app.storage.user_timezones import UserTimeZones
 
 log = logging.getLogger(__name__)
 
@@ -15,8 +18,13 @@ class UserDetails(db.Model):
     username = db.Column(db.String, nullable=False, unique=True)
     email = db.Column(db.String, nullable=False, unique=True)
     password = db.Column(db.String, nullable=False)
-    role_id = db.Column(db.String, db.ForeignKey('UserRoles.id'))
+    role_id = db.Column(db.Integer, db.ForeignKey('UserRoles.id'), index=True)
     enabled = db.Column(db.Boolean, default=False)
+    # bumped on every change, for ETags of the user and of its timezones collection
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    timezones_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # SQLite reuses the id of the last deleted row, the creation time tells a recreated user apart
+    created = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
 
 
     def __repr__(self):
@@ -47,6 +55,15 @@ class UserDetails(db.Model):
         """
         return cls.query.filter_by(username=username).one_or_none()
 
+    @classmethod
+    def get_status(cls, username):
+        """
+        get a user's account status without loading the full entity
+        """
+        from app.storage.user_status_cache import UserStatus
+        res = db.session.query(cls.enabled, cls.role_id, cls.id).filter_by(username=username).one_or_none()
+        return UserStatus(enabled=res.enabled, role_id=res.role_id, user_id=res.id) if res else None
+
     @classmethod
     def get_all(cls):
         """
@@ -58,10 +75,11 @@ class UserDetails(db.Model):
     @classmethod
     def delete(cls, username):
         """
-        delete user matching username
+        delete user matching username, with their timezones
         """
         try:
             user = cls.query.filter_by(username=username).one()
+            UserTimeZones.query.filter_by(user_id=user.id).delete(synchronize_session=False)
             db.session.delete(user)
             db.session.commit()
         except sqlalchemy.exc.SQLAlchemyError:
@@ -85,7 +103,15 @@ class UserDetails(db.Model):
     def generate_hash(password):
         if not password:
             return None
-        return passlib.hash.bcrypt.hash(password)
+        return hashing_pool.run(hash_password, password, *password_policy.settings())
+
+    @staticmethod
+    def generate_hashes(passwords):
+        """
+        hash many passwords in parallel on the hashing pool
+        """
+        scheme, rounds = password_policy.settings()
+        return hashing_pool.map(hash_password, [(x, scheme, rounds) for x in passwords])
 
     @staticmethod
     def verify_hash(supplied_password, stored_password):
@@ -93,7 +119,18 @@ class UserDetails(db.Model):
             return False
         if not stored_password:
             return False
-        return passlib.hash.bcrypt.verify(supplied_password, stored_password)
+        return hashing_pool.run(verify_password, supplied_password, stored_password, *password_policy.settings())
+
+    @staticmethod
+    def verify_and_update_hash(supplied_password, stored_password):
+        """
+        returns (verified, new_hash); new_hash is set when the stored hash predates the current policy
+        """
+        if not supplied_password or not stored_password:
+            return False, None
+        return hashing_pool.run(
+            verify_and_update_password, supplied_password, stored_password, *password_policy.settings()
+        )
 
 
 @sqlalchemy.event.listens_for(UserDetails.__table__, 'after_create')
@@ -1,6 +1,7 @@
 import logging
 import sqlalchemy
 import enum
+import functools
 
 from app.storage.db import db
 
@@ -23,6 +24,46 @@ class UserRolesEnum(enum.Enum):
         """
         return [item.value for item in cls]
 
+    @property
+    def bit(self):
+        """
+        flag bit of this permission in a permissions bitmask
+        """
+        return _PERMISSION_BITS[self]
+
+    @classmethod
+    def to_mask(cls, values):
+        """
+        return the permissions bitmask for a list of permission values
+        """
+        mask = 0
+        for value in values:
+            mask |= cls(value).bit
+        return mask
+
+    @classmethod
+    def from_mask(cls, mask):
+        """
+        return the list of permission values set in a permissions bitmask
+        """
+        return list(_permission_values(mask))
+
+
+# stored in UserRoles.permissions: a member's bit must never change, new members take an unused bit
+_PERMISSION_BITS = {
+    UserRolesEnum.record: 1 << 0,
+    UserRolesEnum.record_all: 1 << 1,
+    UserRolesEnum.user: 1 << 2,
+    UserRolesEnum.user_privileged: 1 << 3,
+    UserRolesEnum.user_all: 1 << 4,
+    UserRolesEnum.role: 1 << 5,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _permission_values(mask):
+    return tuple(item.value for item in UserRolesEnum if mask & item.bit)
+
 
 class UserRoles(db.Model):
     """contains user roles information"""
@@ -30,7 +71,8 @@ class UserRoles(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     role = db.Column(db.String, unique=True, nullable=False)
-    permissions = db.Column(db.String, nullable=False)
+    # bitmask of UserRolesEnum flags
+    permissions = db.Column(db.Integer, nullable=False)
 
     def __repr__(self):
         return (f'<id={self.id}, role={self.role}, permissions={self.permissions}>')
@@ -43,7 +85,8 @@ class UserRoles(db.Model):
         return {
             'id': self.id,
             'role': self.role,
-            'permissions':self.permissions.split(',')
+            'permissions': UserRolesEnum.from_mask(self.permissions),
+            'permission_mask': self.permissions
         }
 
     @classmethod
@@ -55,6 +98,31 @@ class UserRoles(db.Model):
         record = record.to_dict() if record else None
         return record
 
+    @classmethod
+    def get_by_id(cls, id_):
+        """
+        get a user role by id
+        """
+        record = cls.query.filter_by(id=id_).one_or_none()
+        record = record.to_dict() if record else None
+        return record
+
+    @classmethod
+    def get_ids_with_permission(cls, permission):
+        """
+        get the ids of all roles granting a permission
+        """
+        bit = UserRolesEnum(permission).bit
+        return [x.id for x in db.session.query(cls.id).filter(cls.permissions.op('&')(bit) != 0)]
+
+    @classmethod
+    def get_ids_without_permissions(cls, permissions):
+        """
+        get the ids of all roles granting none of the permissions
+        """
+        mask = UserRolesEnum.to_mask(permissions)
+        return [x.id for x in db.session.query(cls.id).filter(cls.permissions.op('&')(mask) == 0)]
+
     @classmethod
     def get_all(cls):
         """
@@ -100,7 +168,7 @@ def insert_initial_values(*args, **kwargs):
         db.session.add(
             UserRoles(
                 role='user',
-                permissions=",".join(permissions)
+                permissions=UserRolesEnum.to_mask(permissions)
             )
         )
         permissions = [
@@ -110,7 +178,7 @@ def insert_initial_values(*args, **kwargs):
         db.session.add(
             UserRoles(
                 role='manager',
-                permissions=",".join(permissions)
+                permissions=UserRolesEnum.to_mask(permissions)
             )
         )
         permissions = [
@@ -121,7 +189,7 @@ def insert_initial_values(*args, **kwargs):
         db.session.add(
             UserRoles(
                 role='admin',
-                permissions=",".join(permissions)
+                permissions=UserRolesEnum.to_mask(permissions)
             )
         )
         db.session.commit()
@@ -0,0 +1,115 @@
+import logging
+import sqlalchemy
+
+from app.storage.db import db
+from app.storage.user_details import UserDetails
+
+log = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'UserDetailsSearch'
+SEARCH_COLUMNS = ['username', 'email', 'first_name', 'last_name']
+
+# FTS5 index over UserDetails; external content, so only the index is stored
+search_table = sqlalchemy.table(SEARCH_TABLE, sqlalchemy.column('rowid'), sqlalchemy.column('rank'))
+
+_columns = ', '.join(SEARCH_COLUMNS)
+_new_values = ', '.join(f'new.{x}' for x in SEARCH_COLUMNS)
+_old_values = ', '.join(f'old.{x}' for x in SEARCH_COLUMNS)
+
+_CREATE_STATEMENTS = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5({_columns}, content='UserDetails', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS UserDetails_search_insert AFTER INSERT ON UserDetails BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS UserDetails_search_delete AFTER DELETE ON UserDetails BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS UserDetails_search_update AFTER UPDATE OF {_columns} ON UserDetails BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+    # index the rows inserted before the triggers existed
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')",
+]
+
+
+# engine url -> whether the search table exists, kept by the create, drop and ensure functions below
+_index_exists = {}
+
+
+def fts5_supported(connection):
+    """
+    whether the database can create FTS5 tables, probed since SQLite may be built without FTS5
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    try:
+        connection.execute(sqlalchemy.text('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(probe)'))
+    except sqlalchemy.exc.OperationalError:
+        return False
+    connection.execute(sqlalchemy.text('DROP TABLE temp.fts5_probe'))
+    return True
+
+
+def index_exists(bind):
+    """
+    whether the search table exists, checked once per engine
+    """
+    key = str(bind.engine.url)
+    if key not in _index_exists:
+        _index_exists[key] = bind.dialect.has_table(bind, SEARCH_TABLE)
+    return _index_exists[key]
+
+
+def _create(connection):
+    if not fts5_supported(connection):
+        log.info('full text user search not supported by database, falling back to prefix matching')
+        return False
+
+    log.info('creating user search index')
+    for statement in _CREATE_STATEMENTS:
+        connection.execute(sqlalchemy.text(statement))
+    return True
+
+
+@sqlalchemy.event.listens_for(UserDetails.__table__, 'after_create')
+def create_search_index(target, connection, **kwargs):
+    _index_exists[str(connection.engine.url)] = _create(connection)
+
+
+@sqlalchemy.event.listens_for(UserDetails.__table__, 'before_drop')
+def drop_search_index(target, connection, **kwargs):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(sqlalchemy.text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+    _index_exists[str(connection.engine.url)] = False
+
+
+def ensure_search_index():
+    """
+    create the search table of a database whose UserDetails table was created without it
+    """
+    connection = db.session.connection()
+    _index_exists.pop(str(connection.engine.url), None)
+    if not index_exists(connection):
+        _index_exists[str(connection.engine.url)] = _create(connection)
+        db.session.commit()
+
+
+def _match_expression(text):
+    '''every whitespace separated term must match as a prefix'''
+    terms = [x.replace('"', '""') for x in text.split()]
+    return ' '.join(f'"{x}"*' for x in terms)
+
+
+def apply_search(query, text):
+    """
+    restrict a UserDetails query to users matching the search text, best matches first
+    """
+    if not index_exists(db.session.connection()):
+        for term in text.split():
+            pattern = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            columns = [getattr(UserDetails, x) for x in SEARCH_COLUMNS]
+            query = query.filter(sqlalchemy.or_(*(x.ilike(pattern, escape='\\') for x in columns)))
+        return query.order_by(UserDetails.username)
+
+    return query.join(search_table, search_table.c.rowid == UserDetails.id)\
+        .filter(sqlalchemy.text(f'{SEARCH_TABLE} MATCH :search_text'))\
+        .params(search_text=_match_expression(text))\
+        .order_by(search_table.c.rank)
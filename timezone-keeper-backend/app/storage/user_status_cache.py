@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+import collections
+
+log = logging.getLogger(__name__)
+
+UserStatus = collections.namedtuple('UserStatus', ['enabled', 'role_id', 'user_id'])
+
+
+class UserStatusCache(object):
+    """
+    bounded, in-process LRU cache of username -> UserStatus entries
+
+    Entries expire after `ttl` seconds, which also bounds how long another
+    worker process may serve a stale status after a write it did not see.
+    """
+
+    def __init__(self, max_size=4096, ttl=30):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # bumped on every invalidation so a load racing with a write is not stored
+        self._generation = 0
+
+    def configure(self, max_size, ttl):
+        """
+        apply new limits and drop all cached entries
+        """
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._generation += 1
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, username, loader):
+        """
+        get the cached status for username, calling loader(username) on a miss
+
+        loader returns a UserStatus or None; None results are not cached
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(username)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        status = loader(username)
+        if status is None or self.max_size <= 0:
+            return status
+
+        with self._lock:
+            if generation != self._generation:
+                return status
+            self._entries[username] = (now + self.ttl, status)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return status
+
+    def invalidate(self, username):
+        """
+        drop the cached status for username
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(username, None)
+
+    def clear(self):
+        """
+        drop all cached entries
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """
+        return cache counters
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+user_status_cache = UserStatusCache()
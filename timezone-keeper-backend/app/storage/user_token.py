@@ -1,7 +1,6 @@
 import logging
 import sqlalchemy
 import datetime
-import jwt
 
 from app.storage.db import db
 
@@ -14,9 +13,10 @@ class RevokedUserTokens(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(120), index=True, unique=True, nullable=False)
     revoke_ts = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+    exp = db.Column(db.DateTime, index=True, nullable=False)
 
     def __repr__(self):
-        return (f'<id={self.id}, jti={self.jti}, revoke_ts={self.revoke_ts}>')
+        return (f'<id={self.id}, jti={self.jti}, revoke_ts={self.revoke_ts}, exp={self.exp}>')
 
 
     def to_dict(self):
@@ -26,7 +26,8 @@ class RevokedUserTokens(db.Model):
         return {
             'id': self.id,
             'jti': self.jti,
-            'revoke_ts': self.revoke_ts
+            'revoke_ts': self.revoke_ts,
+            'exp': self.exp
         }
 
     @classmethod
@@ -37,6 +38,29 @@ class RevokedUserTokens(db.Model):
         result = cls.query.all()
         return list(result)
 
+    @classmethod
+    def count(cls):
+        """
+        get the number of revoked tokens
+        """
+        return db.session.query(sqlalchemy.func.count(cls.id)).scalar()
+
+    @classmethod
+    def delete_expired(cls, now, batch_size):
+        """
+        delete at most batch_size revoked tokens that expired before now
+        """
+        try:
+            ids = [x.id for x in db.session.query(cls.id).filter(cls.exp <= now).limit(batch_size)]
+            if not ids:
+                return 0
+            nr_deleted = db.session.query(cls).filter(cls.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            return nr_deleted
+        except sqlalchemy.exc.SQLAlchemyError:
+            db.session.rollback()
+            raise
+
     @classmethod
     def delete_all(cls):
         """
@@ -49,11 +73,3 @@ class RevokedUserTokens(db.Model):
         except sqlalchemy.exc.SQLAlchemyError:
             db.session.rollback()
             raise
-
-    @classmethod
-    def is_blacklisted(cls, jti):
-        '''
-        checks if token jti is revoked
-        '''
-        token_jti = cls.query.filter_by(jti=jti).one_or_none()
-        return token_jti is not None
\ No newline at end of file
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+import bisect
+import heapq
+import collections
+
+import sqlalchemy
+from app.storage.db import db
+from app.storage.user_timezones import UserTimeZones
+from app.storage.timezone_catalog import timezone_catalog
+from app.storage.timezone_index import parse_offset
+
+log = logging.getLogger(__name__)
+
+
+class WorkingHoursIndex(object):
+    """
+    in-memory index from current UTC offset, in minutes, to the ids of the users
+    whose primary timezone, their first UserTimeZones row, is at that offset
+
+    The primary timezone of each user is loaded once and kept up to date by
+    refresh_user on every change to a user's timezones; changes made by other
+    worker processes are picked up by a full reload every `refresh_interval`
+    seconds. The offset buckets are rebuilt from it, without reading the
+    database, whenever the timezones catalog snapshot changes, which it does
+    at every DST transition.
+    """
+
+    def __init__(self, refresh_interval=60):
+        self._lock = threading.Lock()
+        # user id -> (UserTimeZones id, TimeZones id) of the primary timezone
+        self._primary = {}
+        self._buckets = {}
+        self._snapshot = None
+        self._loaded = False
+        self.refresh_interval = refresh_interval
+        self._next_reload = 0
+        self.builds = 0
+
+    def configure(self, refresh_interval):
+        """
+        apply new settings and drop the index
+        """
+        with self._lock:
+            self.refresh_interval = refresh_interval
+            self._primary = {}
+            self._snapshot = None
+            self._loaded = False
+
+    def load(self):
+        """
+        (re)load the primary timezone of every user from the database
+        """
+        first = db.session.query(
+            UserTimeZones.user_id, sqlalchemy.func.min(UserTimeZones.id).label('id')
+        ).group_by(UserTimeZones.user_id).subquery()
+        query = db.session.query(UserTimeZones.user_id, UserTimeZones.id, UserTimeZones.timezone_id)\
+            .join(first, UserTimeZones.id == first.c.id)
+        primary = {x.user_id: (x.id, x.timezone_id) for x in query}
+        with self._lock:
+            self._primary = primary
+            self._snapshot = None
+            self._loaded = True
+            self._next_reload = time.monotonic() + self.refresh_interval
+        log.info(f'loaded the primary timezone of {len(primary)} users')
+
+    def refresh_user(self, user_id):
+        """
+        reload the primary timezone of a user after a change to their timezones
+        """
+        row = db.session.query(UserTimeZones.id, UserTimeZones.timezone_id)\
+            .filter(UserTimeZones.user_id == user_id)\
+            .order_by(UserTimeZones.id).first()
+        with self._lock:
+            self._remove(user_id)
+            if row is not None:
+                self._primary[user_id] = (row.id, row.timezone_id)
+                if self._snapshot is not None:
+                    bisect.insort(self._buckets.setdefault(self._offset(row.timezone_id), []), user_id)
+
+    def drop_users(self, user_ids):
+        """
+        remove deleted users, and new users that have no timezones yet, without reading the database;
+        SQLite reuses the id of the last deleted row, so a new user must not inherit an old entry
+        """
+        with self._lock:
+            for user_id in user_ids:
+                self._remove(user_id)
+
+    def _remove(self, user_id):
+        '''drop a user from the primary timezones and the buckets, with the lock held'''
+        old = self._primary.pop(user_id, None)
+        if old is not None and self._snapshot is not None:
+            bucket = self._buckets[self._offset(old[1])]
+            del bucket[bisect.bisect_left(bucket, user_id)]
+
+    def _offset(self, timezone_id):
+        '''current offset in minutes of a catalog timezone, None when it is not in the catalog'''
+        offset = self._snapshot.offsets_by_id.get(timezone_id)
+        return None if offset is None else parse_offset(offset)
+
+    def _current(self):
+        '''buckets of the current catalog snapshot, reloading or rebuilding them first when stale'''
+        if not self._loaded or time.monotonic() >= self._next_reload:
+            self.load()
+        snapshot = timezone_catalog.get()
+        with self._lock:
+            if snapshot is not self._snapshot:
+                self._snapshot = snapshot
+                buckets = collections.defaultdict(list)
+                for user_id, (_, timezone_id) in self._primary.items():
+                    buckets[self._offset(timezone_id)].append(user_id)
+                for bucket in buckets.values():
+                    bucket.sort()
+                self._buckets = dict(buckets)
+                self.builds += 1
+            return snapshot, self._buckets
+
+    def offsets(self):
+        """
+        (catalog snapshot, current offsets in minutes that have users)
+        """
+        snapshot, buckets = self._current()
+        return snapshot, [x for x, ids in buckets.items() if x is not None and ids]
+
+    def user_ids(self, offsets, after=None):
+        """
+        ids, ascending and greater than after, of the users whose primary timezone is at one of offsets now
+        """
+        _, buckets = self._current()
+        with self._lock:
+            slices = []
+            for offset in offsets:
+                bucket = buckets.get(offset, [])
+                start = 0 if after is None else bisect.bisect_right(bucket, after)
+                slices.append(bucket[start:])
+        return heapq.merge(*slices)
+
+    def user_offsets(self, user_ids):
+        """
+        current offset in minutes of the primary timezone of each of user_ids, None for users without one
+        """
+        self._current()
+        with self._lock:
+            return [self._offset(self._primary[x][1]) if x in self._primary else None for x in user_ids]
+
+    def primary_timezone(self, user_id):
+        """
+        TimeZones id of a user's primary timezone, None when they have none
+        """
+        primary = self._primary.get(user_id)
+        return primary[1] if primary else None
+
+    def stats(self):
+        return {
+            'users': len(self._primary),
+            'buckets': len(self._buckets) if self._snapshot is not None else None,
+            'builds': self.builds
+        }
+
+
+working_hours_index = WorkingHoursIndex()
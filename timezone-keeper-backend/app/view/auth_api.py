@@ -8,6 +8,8 @@ import app.view.serializers as serializers
 import app.queries_handler as qh
 from flask import request
 import flask_jwt_extended
+import app.view.utils as utils
+from app.rate_limiter import login_rate_limiter
 
 log = logging.getLogger(__name__)
 
@@ -16,6 +18,8 @@ ns = flask_api.namespace('auth', validate=True, description=__doc__)
 @ns.route('/login')
 @ns.response(200, 'Success')
 @ns.response(401, 'Unauthenticated')
+@ns.response(429, 'Too many login attempts, retry after the Retry-After delay')
+@ns.response(503, 'Login queue full, retry after the Retry-After delay')
 class UserLogin(Resource):
     @ns.doc('login')
     @ns.expect(serializers.UserAuth, validate=True)
@@ -24,26 +28,49 @@ class UserLogin(Resource):
         Returns JWT token on successful login
         """
         args = request.get_json(force=True)
+        login_rate_limiter.check(args.get('username'), request.remote_addr)
         try:
-            return qh.authenticate_user(
+            tokens = qh.authenticate_user(
                 username = args['username'],
                 passwd = args['password']
             )
         except KeyError:
             raise ValueError('missing required input parameter')
+        login_rate_limiter.succeeded(args['username'])
+        return tokens
+
+
+@ns.route('/refresh')
+@ns.doc(security='apikey')
+@ns.response(200, 'Success')
+@ns.response(401, 'Unauthenticated')
+class UserRefresh(Resource):
+    @ns.doc('refresh')
+    @flask_jwt_extended.jwt_refresh_token_required
+    def post(self):
+        """
+        Returns a new JWT access token for a valid refresh token
+        """
+        return qh.refresh_access_token(
+            flask_jwt_extended.get_jwt_identity(),
+            flask_jwt_extended.get_raw_jwt()
+        )
 
 
 @ns.route('/logout')
 @ns.doc(security='apikey')
 @ns.response(200, 'Success')
-class UserLogin(Resource):
+class UserLogout(Resource):
     @ns.doc('logout')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     def post(self):
         """
-        Revoke the current user's access token
+        Revoke the current user's access token and its refresh token
         """
-        jti = flask_jwt_extended.get_raw_jwt()['jti']
-        qh.revoke_token(jti)
+        raw_jwt = flask_jwt_extended.get_raw_jwt()
+        qh.revoke_token(raw_jwt['jti'], raw_jwt['exp'])
+        claims = flask_jwt_extended.get_jwt_claims()
+        if claims.get('refresh_jti'):
+            qh.revoke_token(claims['refresh_jti'], claims['refresh_exp'])
         log.info(f'successfully logged out user {flask_jwt_extended.get_jwt_identity()}')
         return {}, 200
\ No newline at end of file
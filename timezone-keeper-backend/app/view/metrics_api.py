@@ -0,0 +1,45 @@
+"""
+Metrics API - internal counters for monitoring
+"""
+import logging
+from flask_restplus import Resource
+from app.rest import flask_api
+from app.storage.user_roles import UserRolesEnum
+from app.storage.user_status_cache import user_status_cache
+from app.storage.revoked_token_index import revoked_token_index
+from app.storage.revoked_token_sweeper import revoked_token_sweeper
+from app.storage.user_token import RevokedUserTokens
+from app.storage.timezone_catalog import timezone_catalog
+from app.storage.working_hours_index import working_hours_index
+from app.hashing_pool import hashing_pool
+from app.jwt_cache import verified_token_cache
+from app.rate_limiter import login_rate_limiter
+from app.password_policy import password_policy
+import app.view.utils as utils
+
+log = logging.getLogger(__name__)
+
+ns = flask_api.namespace('metrics', validate=True, description=__doc__)
+
+
+@ns.route('')
+@ns.doc(security='apikey')
+@ns.response(200, 'Metrics returned successfully')
+@ns.response(403, 'Unauthorized')
+class Metrics(Resource):
+    @ns.doc('get_metrics')
+    @utils.jwt_required
+    def get(self):
+        """Get internal cache and storage counters"""
+        utils.check_user_enabled()
+        utils.validate_permissions(required_permission=UserRolesEnum.user_all.value)
+        return {
+            'user_status_cache': user_status_cache.stats(),
+            'verified_token_cache': verified_token_cache.stats(),
+            'revoked_token_index': {'size': len(revoked_token_index)},
+            'revoked_tokens': dict(revoked_token_sweeper.stats(), table_size=RevokedUserTokens.count()),
+            'login_rate_limiter': login_rate_limiter.stats(),
+            'hashing_pool': dict(hashing_pool.stats(), scheme=password_policy.scheme, rounds=password_policy.rounds),
+            'timezone_catalog': timezone_catalog.stats(),
+            'working_hours_index': working_hours_index.stats()
+        }
@@ -7,7 +7,6 @@ from app.rest import flask_api
 import app.view.serializers as serializers
 import app.queries_handler as qh
 from flask import request
-import flask_jwt_extended
 from app.storage.user_roles import UserRolesEnum
 import app.view.utils as utils
 
@@ -21,7 +20,7 @@ ns = flask_api.namespace('user_role', validate=True, description=__doc__)
 @ns.response(400, 'Bad request')
 class ListUserRoles(Resource):
     @ns.doc('create_new_user_role')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.expect(serializers.UserRole, validate=True)
     @ns.marshal_with(serializers.UserRole, skip_none=True)
     @ns.response(200, 'User role successfully created')
@@ -38,7 +37,7 @@ class ListUserRoles(Resource):
 
 
     @ns.doc('list_all_user_roles')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.marshal_with(serializers.UserRolesList, skip_none=True)
     @ns.response(200, 'List of user roles retuned successfully')
     def get(self):
@@ -57,7 +56,7 @@ class ListUserRoles(Resource):
 @ns.response(404, 'User role not found')
 class UserRole(Resource):
     @ns.doc('get_user_role')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.marshal_with(serializers.UserRole, skip_none=True)
     @ns.response(200, 'List of user roles retuned successfully')
     def get(self, role):
@@ -71,7 +70,7 @@ class UserRole(Resource):
             return user_role
 
     @ns.doc('delete_user_role')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.response(200, 'User role deleted successfully')
     def delete(self, role):
         """Delete a user role"""
@@ -29,6 +29,42 @@ UserWithPasswd = rest.flask_api.model('UserWithPasswd', {
     'password': flask_restplus.fields.String(required=True, description='password', example='P@55w0rd!')
 })
 
+UserImportResult = rest.flask_api.model('UserImportResult', {
+    'index': flask_restplus.fields.Integer(description='position of the row in the import', example=0),
+    'username': flask_restplus.fields.String(description='username', example='JohnDoe2'),
+    'status': flask_restplus.fields.String(description='row outcome', enum=['created', 'error'], example='created'),
+    'message': flask_restplus.fields.String(description='reason the row was rejected')
+})
+
+UserImport = rest.flask_api.model('UserImport', {
+    'created': flask_restplus.fields.Integer(description='number of users created'),
+    'failed': flask_restplus.fields.Integer(description='number of rejected rows'),
+    'results': flask_restplus.fields.List(flask_restplus.fields.Nested(UserImportResult, skip_none=True))
+})
+
+UserBatchFilter = rest.flask_api.model('UserBatchFilter', {
+    'role': flask_restplus.fields.String(required=False, description='users with this role', example='user'),
+    'enabled': flask_restplus.fields.Boolean(required=False, description='users with this account status', example=False)
+})
+
+UserBatch = rest.flask_api.model('UserBatch', {
+    'action': flask_restplus.fields.String(
+        required=True, description='operation to apply', enum=['enable', 'disable', 'delete', 'set_role'], example='disable'
+    ),
+    'usernames': flask_restplus.fields.List(
+        flask_restplus.fields.String, required=False, description='users to update', example=['JohnDoe2']
+    ),
+    'filter': flask_restplus.fields.Nested(UserBatchFilter, required=False, description='users to update, instead of usernames'),
+    'role': flask_restplus.fields.String(required=False, description='new role of the set_role action', example='manager')
+})
+
+UserBatchResult = rest.flask_api.model('UserBatchResult', {
+    'action': flask_restplus.fields.String(description='operation applied', example='disable'),
+    'affected': flask_restplus.fields.Integer(description='number of users updated or deleted', example=1),
+    'not_found': flask_restplus.fields.List(flask_restplus.fields.String, description='requested usernames not found'),
+    'skipped': flask_restplus.fields.List(flask_restplus.fields.String, description='usernames left out of a delete, the requester')
+})
+
 UserUpdatable = rest.flask_api.model('UserUpdatable', {
     'first_name': flask_restplus.fields.String(required=False, description='first name', example='John'),
     'last_name': flask_restplus.fields.String(required=False, description='last name', example='Doe'),
@@ -43,21 +79,34 @@ UserAuth = rest.flask_api.model('UserAuth', {
 })
 
 UserData = rest.flask_api.model('UserData', {
-    'data': flask_restplus.fields.List(flask_restplus.fields.Nested(User, skip_none=True))
+    'data': flask_restplus.fields.List(flask_restplus.fields.Nested(User, skip_none=True)),
+    'next_cursor': flask_restplus.fields.String(description='cursor of the next page, absent on the last page')
+})
+
+WorkingUser = rest.flask_api.inherit('WorkingUser', User, {
+    'location': flask_restplus.fields.String(description='primary timezone location', example='Europe'),
+    'city': flask_restplus.fields.String(description='primary timezone city', example='London'),
+    'relative_to_gmt': flask_restplus.fields.String(description='current gmt offset', example='+01:00'),
+    'local_time': flask_restplus.fields.String(description='current local time', example='2020-07-01T13:00:00')
+})
+
+WorkingUserData = rest.flask_api.model('WorkingUserData', {
+    'data': flask_restplus.fields.List(flask_restplus.fields.Nested(WorkingUser, skip_none=True)),
+    'next_cursor': flask_restplus.fields.String(description='cursor of the next page, absent on the last page')
 })
 
 Timezone = rest.flask_api.model('Timezone', {
     'name': flask_restplus.fields.String(required=True, description='timezone name', example='GMT'),
     'location': flask_restplus.fields.String(required=True, description='timezone location', example='Europe'),
     'city': flask_restplus.fields.String(required=True, description='city name withing the timezone', example='London'),
-    'relative_to_gmt': flask_restplus.fields.String(required=True, description='gmt offset, in hours', example='0:00')
+    'relative_to_gmt': flask_restplus.fields.String(required=True, description='current gmt offset, daylight saving time included', example='+01:00')
 })
 
 TimezoneNoId = rest.flask_api.model('TimezoneNoId', {
     'id': flask_restplus.fields.Integer(required=True, description='user timezone id', example=1),
     'location': flask_restplus.fields.String(required=True, description='timezone location', example='Europe'),
     'city': flask_restplus.fields.String(required=True, description='city name withing the timezone', example='London'),
-    'relative_to_gmt': flask_restplus.fields.String(required=True, description='gmt offset, in hours', example='0:00')
+    'relative_to_gmt': flask_restplus.fields.String(required=True, description='current gmt offset, daylight saving time included', example='+01:00')
 })
 
 UserTimezone = rest.flask_api.model('UserTimezone', {
@@ -75,6 +124,112 @@ TimezoneList = rest.flask_api.model('TimezoneList', {
     'data': flask_restplus.fields.List(flask_restplus.fields.Nested(Timezone, skip_none=True))
 })
 
+TimezoneSuggestion = rest.flask_api.inherit('TimezoneSuggestion', TimezoneNoId, {
+    'score': flask_restplus.fields.Float(description='match score, higher is better', example=1.2)
+})
+
+TimezoneSuggestions = rest.flask_api.model('TimezoneSuggestions', {
+    'data': flask_restplus.fields.List(flask_restplus.fields.Nested(TimezoneSuggestion, skip_none=True))
+})
+
 TimezoneListNoId = rest.flask_api.model('TimezoneListNoId', {
-    'data': flask_restplus.fields.List(flask_restplus.fields.Nested(TimezoneNoId, skip_none=True))
-})
\ No newline at end of file
+    'data': flask_restplus.fields.List(flask_restplus.fields.Nested(TimezoneNoId, skip_none=True)),
+    'next_cursor': flask_restplus.fields.String(description='cursor of the next page, absent on the last page')
+})
+
+TimezoneConvert = rest.flask_api.model('TimezoneConvert', {
+    'instants': flask_restplus.fields.List(
+        flask_restplus.fields.Raw, required=True,
+        description='UTC epoch seconds, or ISO 8601 date times without an offset', example=[1593561600]
+    ),
+    'timezone_ids': flask_restplus.fields.List(
+        flask_restplus.fields.Integer, required=True, description='timezones to convert to', example=[2, 5]
+    ),
+    'from_timezone_id': flask_restplus.fields.Integer(
+        required=False, description='instants are wall times in this timezone instead of UTC', example=3
+    ),
+    'format': flask_restplus.fields.String(
+        required=False, description='output format, the input format by default', enum=['epoch', 'iso'], example='iso'
+    )
+})
+
+TimezoneConverted = rest.flask_api.model('TimezoneConverted', {
+    'timezone_id': flask_restplus.fields.Integer(description='timezone id', example=2),
+    'location': flask_restplus.fields.String(description='timezone location', example='Europe'),
+    'city': flask_restplus.fields.String(description='city name withing the timezone', example='London'),
+    'local': flask_restplus.fields.List(flask_restplus.fields.Raw, description='wall times, in input order', example=['2020-07-01T01:00:00']),
+    'offsets': flask_restplus.fields.List(flask_restplus.fields.Integer, description='utc offsets in seconds', example=[3600])
+})
+
+TimezoneConversion = rest.flask_api.model('TimezoneConversion', {
+    'utc': flask_restplus.fields.List(flask_restplus.fields.Raw, description='UTC instants, only with from_timezone_id'),
+    'data': flask_restplus.fields.List(flask_restplus.fields.Nested(TimezoneConverted))
+})
+
+WorldClockEntry = rest.flask_api.model('WorldClockEntry', {
+    'name': flask_restplus.fields.String(description='timezone name', example='GMT'),
+    'timezone_id': flask_restplus.fields.Integer(description='timezone id', example=2),
+    'location': flask_restplus.fields.String(description='timezone location', example='Europe'),
+    'city': flask_restplus.fields.String(description='city name withing the timezone', example='London'),
+    'local_time': flask_restplus.fields.String(description='current local time', example='2020-07-01T13:00:00'),
+    'relative_to_gmt': flask_restplus.fields.String(description='current gmt offset', example='+01:00'),
+    'dst': flask_restplus.fields.Boolean(description='daylight saving time in effect', example=True),
+    'next_transition': flask_restplus.fields.String(description='UTC time of the next offset change', example='2020-10-25T01:00:00')
+})
+
+WorldClock = rest.flask_api.model('WorldClock', {
+    'utc': flask_restplus.fields.String(description='current UTC time', example='2020-07-01T12:00:00'),
+    'data': flask_restplus.fields.List(flask_restplus.fields.Nested(WorldClockEntry, skip_none=True)),
+    'hour_differences': flask_restplus.fields.List(
+        flask_restplus.fields.List(flask_restplus.fields.Float),
+        description='hours to add to the time of the row timezone to get the time of the column timezone',
+        example=[[0, 8], [-8, 0]]
+    )
+})
+
+WorkingHours = rest.flask_api.model('WorkingHours', {
+    'start': flask_restplus.fields.String(required=False, description='local start time, HH:MM', example='09:00'),
+    'end': flask_restplus.fields.String(
+        required=False, description='local end time, HH:MM, before start for windows past midnight', example='17:00'
+    )
+})
+
+MeetingParticipant = rest.flask_api.inherit('MeetingParticipant', WorkingHours, {
+    'username': flask_restplus.fields.String(required=True, description='username', example='JohnDoe2'),
+    'name': flask_restplus.fields.String(required=False, description='user timezone name, the first one by default', example='GMT')
+})
+
+MeetingRequest = rest.flask_api.model('MeetingRequest', {
+    'start_date': flask_restplus.fields.String(required=True, description='first UTC day, YYYY-MM-DD', example='2020-07-01'),
+    'end_date': flask_restplus.fields.String(required=True, description='last UTC day, YYYY-MM-DD', example='2020-07-31'),
+    'usernames': flask_restplus.fields.List(
+        flask_restplus.fields.String, required=False, description='participants, in their first timezone', example=['JohnDoe2']
+    ),
+    'user_timezones': flask_restplus.fields.List(
+        flask_restplus.fields.Nested(MeetingParticipant), required=False, description='participants, in the given timezone'
+    ),
+    'working_hours': flask_restplus.fields.Nested(WorkingHours, required=False, description='default working hours, 09:00 to 17:00'),
+    'weekdays': flask_restplus.fields.List(
+        flask_restplus.fields.Integer, required=False, description='local working days, 0 is Monday', example=[0, 1, 2, 3, 4]
+    ),
+    'min_minutes': flask_restplus.fields.Integer(required=False, description='shortest window returned', example=30)
+})
+
+MeetingTimezone = rest.flask_api.model('MeetingTimezone', {
+    'username': flask_restplus.fields.String(description='username', example='JohnDoe2'),
+    'name': flask_restplus.fields.String(description='timezone name', example='GMT'),
+    'timezone_id': flask_restplus.fields.Integer(description='timezone id', example=2),
+    'location': flask_restplus.fields.String(description='timezone location', example='Europe'),
+    'city': flask_restplus.fields.String(description='city name withing the timezone', example='London')
+})
+
+MeetingWindow = rest.flask_api.model('MeetingWindow', {
+    'start': flask_restplus.fields.String(description='UTC start time', example='2020-07-01T13:00:00'),
+    'end': flask_restplus.fields.String(description='UTC end time', example='2020-07-01T15:00:00'),
+    'minutes': flask_restplus.fields.Integer(description='window length', example=120)
+})
+
+MeetingWindows = rest.flask_api.model('MeetingWindows', {
+    'participants': flask_restplus.fields.List(flask_restplus.fields.Nested(MeetingTimezone)),
+    'windows': flask_restplus.fields.List(flask_restplus.fields.Nested(MeetingWindow))
+})
@@ -2,12 +2,17 @@
 Timezone API
 """
 import logging
+import time
+import zlib
 
 from flask_restplus import Resource
 from app.rest import flask_api
 import app.view.serializers as serializers
 import app.queries_handler as qh
-from flask import request
+from flask import request, Response, current_app
+from werkzeug.http import quote_etag
+import app.pagination as pagination
+from app.storage.timezone_index import SORT_KEYS
 import flask_restplus
 import flask_jwt_extended
 from app.storage.user_roles import UserRolesEnum
@@ -17,22 +22,132 @@ log = logging.getLogger(__name__)
 
 ns = flask_api.namespace('timezone', validate=True, description=__doc__)
 
+CATALOG_QUERY_PARAMS = [
+    'location', 'city', 'relative_to_gmt', 'relative_to_gmt_min', 'relative_to_gmt_max', 'sort', 'limit', 'cursor'
+]
+
 
 @ns.doc(security='apikey')
 @ns.route('')
 @ns.response(404, 'timezone not found')
-@ns.response(200, 'timezone retuned successfully')
+@ns.response(200, 'timezone retuned successfully', serializers.TimezoneListNoId)
+@ns.response(304, 'timezones not modified since the If-None-Match version')
 class Timezones(Resource):
     @ns.doc('list_timezones')
-    @flask_jwt_extended.jwt_required
-    @ns.marshal_with(serializers.TimezoneListNoId, skip_none=True)
+    @utils.jwt_required
+    @ns.param('location', 'location prefix, e.g. America/Arg')
+    @ns.param('city', 'part of the city name')
+    @ns.param('relative_to_gmt', 'exact gmt offset, [+-]HH:MM')
+    @ns.param('relative_to_gmt_min', 'lowest gmt offset, [+-]HH:MM')
+    @ns.param('relative_to_gmt_max', 'highest gmt offset, [+-]HH:MM')
+    @ns.param('sort', 'sort key', enum=SORT_KEYS, default='id')
+    @ns.param('limit', f'page size, 1 to {pagination.MAX_LIMIT}', type=int, default=pagination.DEFAULT_LIMIT)
+    @ns.param('cursor', 'next_cursor value of the previous page')
     def get(self):
-        """Get all timezones"""
+        """Get all timezones, or a filtered page of them"""
         utils.check_user_enabled()
-        data = qh.get_timezone_all()
-        if not data["data"]:
+        catalog = qh.get_timezone_all()
+        if not catalog.rows:
             return {}, 404
-        return data
+
+        query = {x: request.args[x] for x in CATALOG_QUERY_PARAMS if x in request.args}
+        # pages depend on the catalog version and on the query
+        etag = catalog.etag
+        if query:
+            etag += '-' + format(zlib.crc32(request.query_string), 'x')
+        # offsets change at the next transition, cached copies must not outlive it
+        max_age = min(current_app.config['TIMEZONE_CATALOG_MAX_AGE'], catalog.valid_until - time.time())
+        headers = {
+            'ETag': quote_etag(etag),
+            'Cache-Control': f'private, max-age={max(0, int(max_age))}',
+            'Vary': 'Accept-Encoding'
+        }
+        if utils.not_modified(etag):
+            return Response(status=304, headers=headers)
+
+        if query:
+            query['limit'] = pagination.parse_limit(query.get('limit'))
+            data = qh.find_timezones(**query)
+            return flask_restplus.marshal(data, serializers.TimezoneListNoId, skip_none=True), 200, headers
+
+        encoding = request.accept_encodings.best_match(catalog.encodings(), default='identity')
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(catalog.bodies[encoding], mimetype='application/json', headers=headers)
+
+@ns.doc(security='apikey')
+@ns.route('/all/suggest')
+class TimezoneSuggest(Resource):
+    @ns.doc('suggest_timezones')
+    @utils.jwt_required
+    @ns.marshal_with(serializers.TimezoneSuggestions, skip_none=True)
+    @ns.response(200, 'Suggestions returned successfully')
+    @ns.response(400, 'Bad request')
+    @ns.param('q', 'location or city name as typed so far, typos are tolerated', required=True)
+    @ns.param('limit', f'number of suggestions, 1 to {qh.SUGGEST_MAX_LIMIT}', type=int, default=qh.SUGGEST_DEFAULT_LIMIT)
+    def get(self):
+        """Suggest timezones matching a partial or misspelled name, best first"""
+        utils.check_user_enabled()
+        limit = pagination.parse_limit(request.args.get('limit'), qh.SUGGEST_DEFAULT_LIMIT, qh.SUGGEST_MAX_LIMIT)
+        return qh.suggest_timezones(request.args.get('q'), limit=limit)
+
+@ns.doc(security='apikey')
+@ns.route('/all/convert')
+class TimezoneConvert(Resource):
+    @ns.doc('convert_instants')
+    @utils.jwt_required
+    # documented only: qh.convert_instants validates, schema validation of every instant is too slow
+    # for large batches, and ns.expect cannot turn off the namespace wide validation
+    @ns.doc(expect=[serializers.TimezoneConvert], validate=False)
+    @ns.response(200, 'Instants converted successfully', serializers.TimezoneConversion)
+    @ns.response(400, 'Bad request')
+    @ns.response(404, 'Timezone not found')
+    def post(self):
+        """Convert many UTC instants or wall times to wall times in one or more timezones"""
+        utils.check_user_enabled()
+        args = request.get_json(force=True)
+        if not isinstance(args, dict):
+            raise ValueError('invalid input, JSON object expected')
+        instants = args.get('instants')
+        timezone_ids = args.get('timezone_ids')
+        max_instants = current_app.config['TIMEZONE_CONVERT_MAX_INSTANTS']
+        if isinstance(instants, list) and len(instants) > max_instants:
+            raise ValueError(f'invalid instants, at most {max_instants} allowed')
+        # the response holds a wall time and an offset per instant and timezone
+        max_values = current_app.config['TIMEZONE_CONVERT_MAX_VALUES']
+        if isinstance(instants, list) and isinstance(timezone_ids, list) and len(instants) * len(timezone_ids) > max_values:
+            raise ValueError(f'invalid request, at most {max_values} instants times timezone ids allowed')
+        return qh.convert_instants(
+            instants, timezone_ids,
+            from_timezone_id=args.get('from_timezone_id'),
+            output_format=args.get('format')
+        )
+
+@ns.doc(security='apikey')
+@ns.route('/all/meeting_windows')
+class MeetingWindows(Resource):
+    @ns.doc('find_meeting_windows')
+    @utils.jwt_required
+    @ns.expect(serializers.MeetingRequest, validate=True)
+    @ns.marshal_with(serializers.MeetingWindows)
+    @ns.response(200, 'Common windows returned successfully')
+    @ns.response(400, 'Bad request')
+    @ns.response(404, 'Participant timezone not found')
+    def post(self):
+        """Find the windows in which all participants are within their working hours"""
+        utils.check_user_enabled()
+        args = request.get_json(force=True)
+        usernames = set(args.get('usernames') or []) | set(x['username'] for x in args.get('user_timezones') or [])
+        if usernames - {flask_jwt_extended.get_jwt_identity()}:
+            utils.validate_permissions(required_permission=UserRolesEnum.record_all.value)
+        return qh.find_meeting_windows(
+            args['start_date'], args['end_date'],
+            usernames=args.get('usernames'),
+            user_timezones=args.get('user_timezones'),
+            working_hours=args.get('working_hours'),
+            weekdays=args.get('weekdays'),
+            min_minutes=args.get('min_minutes', 30)
+        )
 
 @ns.doc(security='apikey')
 @ns.route('/<username>')
@@ -40,21 +155,27 @@ class Timezones(Resource):
 @ns.response(404, 'User timezone not found')
 class UserTimezones(Resource):
     @ns.doc('list_user_timezones')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.marshal_with(serializers.TimezoneList, skip_none=True)
     @ns.response(200, 'User timezones retuned successfully')
+    @ns.response(304, 'User timezones not modified since the If-None-Match version')
     @ns.response(400, 'Bad request')
+    @ns.param('fields', 'comma separated list of fields to return')
     def get(self, username):
         """Get all timezones for a user"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
         utils.validate_permissions(required_permission=UserRolesEnum.record_all.value, username=username)
-        data = qh.get_user_timezone_all(username)
+        fields = utils.parse_fields(request.args.get('fields'), qh.USER_TIMEZONE_FIELDS)
+        etag = utils.timezones_etag(username, fields)
+        if utils.not_modified(etag):
+            return {}, 304, utils.etag_headers(etag)
+        data = qh.get_user_timezone_all(username, fields=fields)
         if not data["data"]:
             return {}, 404
-        return data
+        return data, 200, utils.etag_headers(etag)
 
     @ns.doc('create_new_user_timezone')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.expect(serializers.UserTimezoneNoId, validate=True)
     @ns.marshal_with(serializers.UserTimezone, skip_none=True)
     @ns.response(201, 'timezone successfully created')
@@ -62,7 +183,7 @@ class UserTimezones(Resource):
     @ns.response(409, 'Conflict. Timezone with same name already exists')
     def post(self, username):
         """Creates a new timezone for a user"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
         utils.validate_permissions(required_permission=UserRolesEnum.record_all.value, username=username)
         args = request.get_json(force=True)
         try:
@@ -75,6 +196,21 @@ class UserTimezones(Resource):
             raise ValueError('missing required input parameter')
 
 
+@ns.doc(security='apikey')
+@ns.route('/<username>/now')
+@ns.param('username', 'username')
+@ns.response(404, 'User timezone not found')
+class UserWorldClock(Resource):
+    @ns.doc('get_user_world_clock')
+    @utils.jwt_required
+    @ns.marshal_with(serializers.WorldClock, skip_none=True)
+    @ns.response(200, 'User world clock returned successfully')
+    def get(self, username):
+        """Get the current time in all timezones of a user"""
+        utils.check_user_enabled(username)
+        utils.validate_permissions(required_permission=UserRolesEnum.record_all.value, username=username)
+        return qh.get_user_world_clock(username)
+
 @ns.doc(security='apikey')
 @ns.route('/<username>/<name>')
 @ns.param('username', 'username')
@@ -82,23 +218,25 @@ class UserTimezones(Resource):
 @ns.response(404, 'Not found error')
 class UserTimezoneName(Resource):
     @ns.doc('get_user_timezone')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.marshal_with(serializers.Timezone)
     def get(self, username, name):
         """Get user timezone by id"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
         utils.validate_permissions(required_permission=UserRolesEnum.record_all.value, username=username)
         return qh.get_user_timezone(username, name)
 
     @ns.doc('update_user_timezone')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.expect(serializers.UserTimezoneNoId, validate=True)
     @ns.response(200, 'User timezone successfully updated')
     @ns.response(400, 'Invalid user timezone data')
+    @ns.response(412, 'User timezones changed since the If-Match version')
     def put(self, username, name):
         """Update user timezone"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
         utils.validate_permissions(required_permission=UserRolesEnum.record_all.value, username=username)
+        utils.check_if_match(utils.timezones_etag(username))
         args = request.get_json(force=True)
 
         update = {}
@@ -119,11 +257,13 @@ class UserTimezoneName(Resource):
 
 
     @ns.doc('delete_user_timezone')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.response(200, 'User timezone successfully removed')
+    @ns.response(412, 'User timezones changed since the If-Match version')
     def delete(self, username, name):
         """Delete user timezone"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
         utils.validate_permissions(required_permission=UserRolesEnum.record_all.value, username=username)
+        utils.check_if_match(utils.timezones_etag(username))
         qh.delete_user_timezone(username, name)
         return {}, 200
@@ -2,15 +2,18 @@
 User API - for user management
 """
 import logging
+import csv
+import io
+import json
 
 from flask_restplus import Resource
 from app.rest import flask_api
 import app.view.serializers as serializers
 import app.queries_handler as qh
-from flask import request
-import flask_jwt_extended
+from flask import request, Response, stream_with_context, current_app
 from app.storage.user_roles import UserRolesEnum
 import app.view.utils as utils
+import app.pagination as pagination
 
 log = logging.getLogger(__name__)
 
@@ -21,16 +24,21 @@ ns = flask_api.namespace('user', validate=True, description=__doc__)
 class ListUsers(Resource):
     @ns.doc(security='apikey')
     @ns.doc('list_all_users')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.marshal_with(serializers.UserData, skip_none=True)
     @ns.response(200, 'User details retuned successfully')
     @ns.response(404, 'No Users found')
     @ns.response(400, 'Bad request')
+    @ns.param('limit', f'page size, 1 to {pagination.MAX_LIMIT}', type=int, default=pagination.DEFAULT_LIMIT)
+    @ns.param('cursor', 'next_cursor value of the previous page')
+    @ns.param('fields', 'comma separated list of fields to return')
     def get(self):
-        """Get all users"""
+        """Get all users, one page at a time"""
         utils.check_user_enabled()
         username, perm = utils.get_user_permissions()
-        users_data = qh.get_user_all(username, perm)
+        limit = pagination.parse_limit(request.args.get('limit'))
+        fields = utils.parse_fields(request.args.get('fields'), qh.USER_FIELDS)
+        users_data = qh.get_user_all(username, perm, limit=limit, cursor=request.args.get('cursor'), fields=fields)
         if not users_data["data"]:
             return {}, 404
         return users_data
@@ -55,33 +63,193 @@ class ListUsers(Resource):
         except KeyError:
             raise ValueError('missing required input parameter')
 
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=qh.EXPORT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+@ns.route('/all/export')
+class ExportUsers(Resource):
+    @ns.doc(security='apikey')
+    @ns.doc('export_users')
+    @utils.jwt_required
+    @ns.param('format', 'export format', enum=list(EXPORT_FORMATS), default='ndjson')
+    @ns.response(200, 'User details streamed successfully')
+    @ns.response(400, 'Bad request')
+    def get(self):
+        """Export all users as NDJSON or CSV"""
+        utils.check_user_enabled()
+        username, perm = utils.get_user_permissions()
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f'invalid format, expected one of {list(EXPORT_FORMATS)}')
+
+        rows = qh.export_users(username, perm)
+        lines = _ndjson_lines(rows) if export_format == 'ndjson' else _csv_lines(rows)
+        return Response(
+            stream_with_context(lines),
+            mimetype=EXPORT_FORMATS[export_format],
+            headers={'Content-Disposition': f'attachment; filename=users.{export_format}'}
+        )
+
+def _import_rows():
+    '''rows of an import request: a JSON array, a CSV body or an uploaded CSV file'''
+    if 'file' in request.files:
+        text = request.files['file'].read().decode('utf-8-sig')
+        return list(csv.DictReader(io.StringIO(text)))
+    if request.mimetype == 'text/csv':
+        return list(csv.DictReader(io.StringIO(request.get_data(as_text=True))))
+    rows = request.get_json(force=True)
+    if not isinstance(rows, list):
+        raise ValueError('invalid import, JSON array expected')
+    return rows
+
+
+@ns.route('/all/import')
+class ImportUsers(Resource):
+    @ns.doc(security='apikey')
+    @ns.doc('import_users')
+    @utils.jwt_required
+    @ns.marshal_with(serializers.UserImport, skip_none=True)
+    @ns.response(200, 'Import processed, see the per-row results')
+    @ns.response(400, 'Bad request')
+    def post(self):
+        """Create many users from a JSON array or a CSV upload"""
+        utils.check_user_enabled()
+        utils.validate_permissions(required_permission=UserRolesEnum.user_all.value)
+        rows = _import_rows()
+        max_rows = current_app.config['USER_IMPORT_MAX_ROWS']
+        if len(rows) > max_rows:
+            raise ValueError(f'invalid import, at most {max_rows} rows allowed')
+        return qh.import_users(rows, batch_size=current_app.config['USER_IMPORT_BATCH_SIZE'])
+
+@ns.route('/all/batch')
+class BatchUsers(Resource):
+    @ns.doc(security='apikey')
+    @ns.doc('batch_update_users')
+    @utils.jwt_required
+    @ns.expect(serializers.UserBatch, validate=True)
+    @ns.marshal_with(serializers.UserBatchResult, skip_none=True)
+    @ns.response(200, 'Operation applied')
+    @ns.response(400, 'Bad request')
+    @ns.response(404, 'Role not found')
+    def post(self):
+        """Enable, disable, delete or change the role of many users at once"""
+        utils.check_user_enabled()
+        req_user, perm = utils.get_user_permissions()
+        args = request.get_json(force=True)
+        batch_filter = args.get('filter') or {}
+        return qh.batch_update_users(
+            req_user, perm, args['action'],
+            usernames=args.get('usernames'),
+            role_filter=batch_filter.get('role'),
+            enabled_filter=batch_filter.get('enabled'),
+            role=args.get('role')
+        )
+
+@ns.route('/all/search')
+class SearchUsers(Resource):
+    @ns.doc(security='apikey')
+    @ns.doc('search_users')
+    @utils.jwt_required
+    @ns.marshal_with(serializers.UserData, skip_none=True)
+    @ns.response(200, 'Matching users returned successfully')
+    @ns.response(400, 'Bad request')
+    @ns.param('q', 'username, email, first or last name prefixes, all terms must match', required=True)
+    @ns.param('limit', f'maximum number of results, 1 to {qh.SEARCH_MAX_LIMIT}', type=int, default=qh.SEARCH_DEFAULT_LIMIT)
+    @ns.param('fields', 'comma separated list of fields to return')
+    def get(self):
+        """Search users, best matches first"""
+        utils.check_user_enabled()
+        username, perm = utils.get_user_permissions()
+        limit = pagination.parse_limit(request.args.get('limit'), qh.SEARCH_DEFAULT_LIMIT, qh.SEARCH_MAX_LIMIT)
+        fields = utils.parse_fields(request.args.get('fields'), qh.USER_FIELDS)
+        return qh.search_users(username, perm, request.args.get('q'), limit=limit, fields=fields)
+
+@ns.route('/all/working_now')
+class UsersWorkingNow(Resource):
+    @ns.doc(security='apikey')
+    @ns.doc('list_users_working_now')
+    @utils.jwt_required
+    @ns.marshal_with(serializers.WorkingUserData, skip_none=True)
+    @ns.response(200, 'Users in working hours returned successfully')
+    @ns.response(400, 'Bad request')
+    @ns.param('start', 'local start of working hours, HH:MM', default=qh.DEFAULT_WORKING_HOURS[0])
+    @ns.param('end', 'local end of working hours, HH:MM, before start for hours past midnight', default=qh.DEFAULT_WORKING_HOURS[1])
+    @ns.param('weekdays', 'comma separated local working days, 0 is Monday', default='0,1,2,3,4')
+    @ns.param('limit', f'page size, 1 to {pagination.MAX_LIMIT}', type=int, default=pagination.DEFAULT_LIMIT)
+    @ns.param('cursor', 'next_cursor value of the previous page')
+    def get(self):
+        """Get the users whose primary timezone is within working hours now, one page at a time"""
+        utils.check_user_enabled()
+        username, perm = utils.get_user_permissions()
+        limit = pagination.parse_limit(request.args.get('limit'))
+        weekdays = request.args.get('weekdays')
+        if weekdays is not None:
+            try:
+                weekdays = [int(x) for x in weekdays.split(',')]
+            except ValueError:
+                raise ValueError('invalid weekdays, comma separated numbers expected')
+        return qh.get_users_working_now(
+            username, perm,
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            weekdays=weekdays,
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+
 @ns.doc(security='apikey')
 @ns.route('/<username>')
 @ns.param('username', 'User name')
 @ns.response(404, 'User not found')
 class User(Resource):
     @ns.doc('get_user')
-    @flask_jwt_extended.jwt_required
-    @ns.marshal_with(serializers.User)
+    @utils.jwt_required
+    @ns.marshal_with(serializers.User, skip_none=True)
     @ns.response(200, 'User successfully returned')
+    @ns.response(304, 'User not modified since the If-None-Match version')
+    @ns.param('fields', 'comma separated list of fields to return')
     def get(self, username):
         """Get user by username"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
         req_user, perm = utils.get_user_permissions()
-        user = qh.get_user(username, req_user, perm)
+        fields = utils.parse_fields(request.args.get('fields'), qh.USER_FIELDS)
+        user = qh.get_user(username, req_user, perm, fields=fields)
         if not user:
             ns.abort(404)
-        else:
-            return user
+        etag = utils.user_etag(username, fields)
+        if utils.not_modified(etag):
+            return {}, 304, utils.etag_headers(etag)
+        return user, 200, utils.etag_headers(etag)
 
     @ns.doc('update_user')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.expect(serializers.UserUpdatable, validate=True)
     @ns.response(200, 'User successfully updated')
     @ns.response(400, 'Invalid user data')
+    @ns.response(412, 'User changed since the If-Match version')
     def put(self, username):
         """Update user"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
+        self._check_if_match(username)
         args = request.get_json(force=True)
 
         update = {}
@@ -102,16 +270,25 @@ class User(Resource):
 
 
     @ns.doc('delete_user')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     @ns.response(200, 'User successfully removed')
     @ns.response(400, 'Bad request')
+    @ns.response(412, 'User changed since the If-Match version')
     def delete(self, username):
         """Delete user"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
+        self._check_if_match(username)
         req_user, perm = utils.get_user_permissions()
         qh.delete_user(username, req_user, perm)
         return {}, 200
 
+    @staticmethod
+    def _check_if_match(username):
+        if request.if_match:
+            req_user, perm = utils.get_user_permissions()
+            qh.get_user(username, req_user, perm)
+            utils.check_if_match(utils.user_etag(username))
+
 @ns.doc(security='apikey')
 @ns.route('/<username>/enable')
 @ns.param('username', 'User name')
@@ -119,10 +296,10 @@ class User(Resource):
 @ns.response(200, 'User account enabled')
 class UserEnable(Resource):
     @ns.doc('enable_user')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     def post(self, username):
         """enable user account"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
         utils.validate_permissions(required_permission=UserRolesEnum.user_all.value)
         qh.enable_user(username, True)
         return {}, 200
@@ -134,10 +311,10 @@ class UserEnable(Resource):
 @ns.response(200, 'User account disabled')
 class UserEnable(Resource):
     @ns.doc('disable_user')
-    @flask_jwt_extended.jwt_required
+    @utils.jwt_required
     def post(self, username):
         """disable user account"""
-        utils.check_user_enabled()
+        utils.check_user_enabled(username)
         utils.validate_permissions(required_permission=UserRolesEnum.user_all.value)
         qh.enable_user(username, False)
         return {}, 200
\ No newline at end of file
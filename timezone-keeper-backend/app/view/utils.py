@@ -1,11 +1,63 @@
 import logging
+import functools
+import flask
 import app.error as err
+import zlib
+import werkzeug.http
 import flask_jwt_extended
+from flask_jwt_extended.config import config as jwt_config
 from app.storage.user_roles import UserRolesEnum
-from app.storage.user_details import UserDetails
+import app.request_context as request_context
+from app.storage.user_status_cache import user_status_cache
+from app.storage.revoked_token_index import revoked_token_index
+from app.jwt_cache import verified_token_cache
+from app.storage.timezone_catalog import timezone_catalog
 
 log = logging.getLogger(__name__)
 
+def _verify_jwt_in_request():
+    '''
+    verify the request's access token, reusing claims of tokens verified before
+    '''
+    raw_header = flask.request.headers.get(jwt_config.header_name)
+    if not raw_header:
+        flask_jwt_extended.verify_jwt_in_request()
+        return
+
+    key = verified_token_cache.key(raw_header)
+    cached = verified_token_cache.get(key)
+    if cached:
+        decoded_token, token_header = cached
+        if not revoked_token_index.is_revoked(decoded_token['jti']):
+            flask._app_ctx_stack.top.jwt = decoded_token
+            flask._app_ctx_stack.top.jwt_header = token_header
+            return
+        verified_token_cache.invalidate(decoded_token['jti'])
+
+    flask_jwt_extended.verify_jwt_in_request()
+    verified_token_cache.put(key, flask_jwt_extended.get_raw_jwt(), flask_jwt_extended.get_raw_jwt_header())
+
+
+def jwt_required(fn):
+    '''
+    flask_jwt_extended.jwt_required with a cache of verified tokens
+    '''
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if flask.request.method not in jwt_config.exempt_methods:
+            _verify_jwt_in_request()
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def _claims_permission_mask(claims):
+    '''permissions bitmask of the token claims'''
+    mask = claims.get('permission_mask')
+    if mask is None:
+        mask = UserRolesEnum.to_mask(claims['permissions'])
+    return mask
+
+
 def validate_permissions(required_permission, username=None):
     '''
     checks if user claims have the right permissions
@@ -19,7 +71,7 @@ def validate_permissions(required_permission, username=None):
             return
 
     claims = flask_jwt_extended.get_jwt_claims()
-    if required_permission not in claims['permissions']:
+    if not _claims_permission_mask(claims) & UserRolesEnum(required_permission).bit:
         if identity_mismatch:
             log.error(f"unauthorized: user {user_identity} cannot access other users data")
             raise err.PermissionsError()
@@ -28,22 +80,96 @@ def validate_permissions(required_permission, username=None):
             raise err.PermissionsError()
 
 
+def parse_fields(fields, allowed):
+    '''
+    parse a comma separated ?fields= value; returns None when all fields are requested
+    '''
+    if not fields:
+        return None
+    requested = set(x.strip() for x in fields.split(',') if x.strip())
+    invalid = requested - set(allowed)
+    if invalid:
+        raise ValueError(f'invalid fields {sorted(invalid)}, allowed values: {list(allowed)}')
+    return [x for x in allowed if x in requested]
+
+
+def _etag(kind, user, version, fields=None):
+    '''strong ETag of a user resource version, distinct for each ?fields= selection'''
+    tag = f'{kind}-{user.id}-{user.created:%Y%m%d%H%M%S%f}-{version}'
+    if fields:
+        tag += '-' + format(zlib.crc32(','.join(fields).encode()), 'x')
+    return tag
+
+
+def user_etag(username, fields=None):
+    '''
+    ETag of a user's details, None if the user does not exist
+    '''
+    user = request_context.current().user(username)
+    return _etag('user', user, user.version, fields) if user else None
+
+
+def timezones_etag(username, fields=None):
+    '''
+    ETag of a user's timezones, None if the user does not exist
+    '''
+    user = request_context.current().user(username)
+    if not user:
+        return None
+    # live offsets are part of the representation, so a catalog rebuild is a new version too
+    version = f'{user.timezones_version}.{timezone_catalog.get().etag[:8]}'
+    return _etag('timezones', user, version, fields)
+
+
+def etag_headers(etag):
+    '''
+    response headers for a resource version; clients must revalidate before reusing it
+    '''
+    return {'ETag': werkzeug.http.quote_etag(etag), 'Cache-Control': 'private, no-cache'}
+
+
+def not_modified(etag):
+    '''
+    true when the request's If-None-Match matches etag
+    '''
+    return etag is not None and flask.request.if_none_match.contains_weak(etag)
+
+
+def check_if_match(etag):
+    '''
+    raise PreconditionFailedError unless the request's If-Match, when present, matches etag
+    '''
+    if_match = flask.request.if_match
+    if if_match and (etag is None or not if_match.contains(etag)):
+        raise err.PreconditionFailedError('resource has changed, please reload it and retry')
+
+
 def get_user_permissions():
     user_identity = flask_jwt_extended.get_jwt_identity()
-    claims = flask_jwt_extended.get_jwt_claims()
+    mask = _claims_permission_mask(flask_jwt_extended.get_jwt_claims())
     permission = UserRolesEnum.user.value
 
-    if UserRolesEnum.user_privileged.value in claims['permissions']:
+    if mask & UserRolesEnum.user_privileged.bit:
         permission = UserRolesEnum.user_privileged.value
-    if UserRolesEnum.user_all.value in claims['permissions']:
+    if mask & UserRolesEnum.user_all.bit:
         permission = UserRolesEnum.user_all.value
 
     return user_identity, permission
 
 
-def check_user_enabled():
+def check_user_enabled(*usernames):
+    '''
+    check the caller's account is enabled; the users the request is about are
+    loaded in the same query as the caller when the caller's status is not cached
+    '''
     user_identity = flask_jwt_extended.get_jwt_identity()
-    user = UserDetails.get(user_identity)
+    context = request_context.current()
+
+    def load_status(username):
+        context.load(username, *usernames)
+        return context.status(username)
+
+    user = user_status_cache.get(user_identity, load_status)
     if not user:
         raise Exception('Could not identify user!')
     if not user.enabled:
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the meeting-overlap planner on participants spread over the
+timezones catalog.
+
+Each participant gets a random catalog timezone and, with --spread-hours,
+working hours starting at a random quarter hour, so few bitmaps are shared.
+Exits with a non-zero status when the slowest round exceeds the budget.
+
+Run from the timezone-keeper-backend directory:
+    python3 -m benchmarks.meeting_windows --participants 500 --days 90 --max-ms 1000
+"""
+import sys
+import time
+import random
+import datetime
+import argparse
+
+from app.storage import timezone_overlap
+from app.storage.timezone_convert import zone_arrays
+from benchmarks.timezone_suggest import catalog_rows
+
+
+def participants(rows, count, spread_hours, seed):
+    rng = random.Random(seed)
+    zones = [(x[0], zone_arrays(f'{x[1]}/{x[2]}')) for x in rows]
+    zones = [x for x in zones if x[1] is not None]
+    found = []
+    for _ in range(count):
+        zone, arrays = rng.choice(zones)
+        start = rng.randrange(0, 96) * 15 if spread_hours else 9 * 60
+        found.append((zone, arrays, (start, (start + 8 * 60) % timezone_overlap.MINUTES_PER_DAY)))
+    return found
+
+
+def setup_argparser():
+    parser = argparse.ArgumentParser(prog='meeting_windows', description='Meeting-overlap planner benchmark')
+    parser.add_argument('--names', default='IANA_timezone_names.json', help='timezone names file')
+    parser.add_argument('--participants', type=int, default=500, help='number of participants')
+    parser.add_argument('--days', type=int, default=90, help='length of the date range')
+    parser.add_argument('--start-date', default='2020-01-01', help='first day of the range')
+    parser.add_argument('--spread-hours', action='store_true', help='random working hours per participant')
+    parser.add_argument('--rounds', type=int, default=5, help='timed runs')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the participants')
+    parser.add_argument('--max-ms', type=float, default=1000.0, help='latency budget of a run')
+    return parser
+
+
+def main():
+    args = setup_argparser().parse_args()
+    people = participants(catalog_rows(args.names), args.participants, args.spread_hours, args.seed)
+    first_day = datetime.date.fromisoformat(args.start_date)
+    start = (first_day - datetime.date(1970, 1, 1)).days * timezone_overlap.MINUTES_PER_DAY
+    end = start + args.days * timezone_overlap.MINUTES_PER_DAY
+
+    latencies = []
+    for _ in range(args.rounds):
+        begin = time.perf_counter()
+        # weekends differ between zones, so every day is a working day here
+        windows = timezone_overlap.meeting_windows(people, range(7), start, end)
+        latencies.append((time.perf_counter() - begin) * 1000)
+    latencies.sort()
+
+    print(f'{len(people)} participants in {len(set(x[0] for x in people))} timezones, {args.days} days, {len(windows)} windows')
+    print(f'{"min ms":>10} {"median ms":>10} {"max ms":>10}')
+    print(f'{latencies[0]:>10.3f} {latencies[len(latencies) // 2]:>10.3f} {latencies[-1]:>10.3f}')
+    if latencies[-1] > args.max_ms:
+        print(f'slowest run {latencies[-1]:.3f}ms over the {args.max_ms}ms budget')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    status = main()
+    sys.exit(status)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+Benchmark password hashing throughput per core for each hashing setting.
+
+Run from the timezone-keeper-backend directory:
+    python3 -m benchmarks.password_hashing --scheme bcrypt --rounds 10 11 12 13
+"""
+import sys
+import time
+import argparse
+import multiprocessing
+import concurrent.futures
+
+from app.password_policy import SCHEMES, hash_password, verify_password
+
+
+def _verify_loop(scheme, rounds, duration):
+    password_hash = hash_password('benchmark-password', scheme, rounds)
+    count = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        verify_password('benchmark-password', password_hash, scheme, rounds)
+        count += 1
+    return count
+
+
+def setup_argparser():
+    parser = argparse.ArgumentParser(prog='password_hashing', description='Password hashing benchmark')
+    parser.add_argument('--scheme', choices=SCHEMES.keys(), default='bcrypt', help='hashing scheme')
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 11, 12, 13], help='rounds settings to measure')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='number of cores to use')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds to measure each setting')
+    return parser
+
+
+def main():
+    args = setup_argparser().parse_args()
+    print(f'{args.scheme}: {args.workers} worker(s), {args.duration}s per setting')
+    print(f'{"rounds":>10} {"hashes/s":>12} {"hashes/s/core":>14} {"ms/hash":>10}')
+
+    ctx = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx) as executor:
+        for rounds in args.rounds:
+            jobs = [executor.submit(_verify_loop, args.scheme, rounds, args.duration) for _ in range(args.workers)]
+            total = sum(job.result() for job in jobs)
+            per_second = total / args.duration
+            per_core = per_second / args.workers
+            print(f'{rounds:>10} {per_second:>12.1f} {per_core:>14.1f} {1000 / per_core:>10.1f}')
+    return 0
+
+if __name__ == '__main__':
+    status = main()
+    sys.exit(status)
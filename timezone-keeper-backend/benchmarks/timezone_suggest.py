@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Benchmark timezone typeahead latency, from the trigram index alone or
+through the full GET /timezone/all/suggest request path.
+
+Queries are every prefix of every city name, plus a copy of each full name
+with one typo. Exits with a non-zero status when the p99 latency exceeds
+the budget.
+
+Run from the timezone-keeper-backend directory:
+    python3 -m benchmarks.timezone_suggest --max-p99-ms 5
+    python3 -m benchmarks.timezone_suggest --http --max-p99-ms 5
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import urllib.parse
+
+from app.storage.timezone_suggest import SuggestIndex
+
+
+def catalog_rows(path):
+    '''catalog rows parsed as the TimeZones seed does'''
+    with open(path) as json_file:
+        data = json.load(json_file)
+    rows = []
+    for key, value in data.items():
+        if '/' in key:
+            location = key.split('/')
+            rows.append((len(rows) + 1, '/'.join(location[:-1]), location[-1], value))
+    return rows
+
+
+def typeahead_queries(rows, seed):
+    rng = random.Random(seed)
+    queries = []
+    for row in rows:
+        city = row[2].replace('_', ' ')
+        queries.extend(city[:n] for n in range(1, len(city) + 1))
+        if len(city) > 3:
+            pos = rng.randrange(1, len(city) - 1)
+            queries.append(city[:pos] + city[pos + 1] + city[pos] + city[pos + 2:])
+    return queries
+
+
+def index_runner(rows, limit):
+    index = SuggestIndex(rows)
+    return lambda query: index.suggest(query, limit)
+
+
+def http_runner(limit):
+    import flask_jwt_extended
+    from app.server import initialize_app
+    from app.app_config import TestingConfig
+    from test import test_helpers as th
+
+    app = initialize_app(TestingConfig)
+    app.app_context().push()
+    headers = {'Authorization': 'Bearer ' + flask_jwt_extended.create_access_token(identity=th.get_user_details('admin'))}
+    client = app.test_client()
+
+    def run(query):
+        url = '/api/v1/timezone/all/suggest?' + urllib.parse.urlencode({'q': query, 'limit': limit})
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, response.data
+        return response
+    return run
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def setup_argparser():
+    parser = argparse.ArgumentParser(prog='timezone_suggest', description='Timezone typeahead latency benchmark')
+    parser.add_argument('--names', default='IANA_timezone_names.json', help='timezone names file')
+    parser.add_argument('--http', action='store_true', help='measure the full request path instead of the index')
+    parser.add_argument('--limit', type=int, default=10, help='suggestions per query')
+    parser.add_argument('--rounds', type=int, default=3, help='passes over the query set')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the generated typos')
+    parser.add_argument('--max-p99-ms', type=float, default=5.0, help='p99 latency budget')
+    return parser
+
+
+def main():
+    args = setup_argparser().parse_args()
+    rows = catalog_rows(args.names)
+    queries = typeahead_queries(rows, args.seed)
+    run = http_runner(args.limit) if args.http else index_runner(rows, args.limit)
+
+    for query in queries[:100]:
+        run(query)
+
+    latencies = []
+    for _ in range(args.rounds):
+        for query in queries:
+            start = time.perf_counter()
+            run(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    p99 = percentile(latencies, 0.99)
+    print(f'{"http" if args.http else "index"}: {len(rows)} zones, {len(latencies)} queries')
+    print(f'{"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10} {"max ms":>10}')
+    print(f'{percentile(latencies, 0.5):>10.3f} {percentile(latencies, 0.95):>10.3f} {p99:>10.3f} {latencies[-1]:>10.3f}')
+    if p99 > args.max_p99_ms:
+        print(f'p99 {p99:.3f}ms over the {args.max_p99_ms}ms budget')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    status = main()
+    sys.exit(status)
@@ -1,10 +1,19 @@
 import flask
 import flask_jwt_extended
+import os
 import json
+import signal
+import datetime
 import app.error as error
 from test.base import BaseTestCase
 from app.storage.user_token import RevokedUserTokens
+from app.storage.revoked_token_index import revoked_token_index
+from app.storage.revoked_token_sweeper import RevokedTokenSweeper
+from app.hashing_pool import hashing_pool
+from app.jwt_cache import verified_token_cache
+from app.rate_limiter import login_rate_limiter
 from app.storage.db import db
+import app.storage.schema_upgrade as schema_upgrade
 
 
 class TestAuthApi(BaseTestCase):
@@ -167,3 +176,294 @@ class TestAuthApi(BaseTestCase):
         )
 
         self.assertStatus(response, 401)
+
+    def test_revoked_token_index_loaded_at_startup(self):
+        user = {
+            'username': 'admin',
+            'role': 'admin',
+            'permissions': ['CRUD-user-roles'],
+        }
+        access_token = flask_jwt_extended.create_access_token(identity=user)
+        decoded_token = flask_jwt_extended.decode_token(access_token)
+
+        db.session.add(RevokedUserTokens(
+            jti=decoded_token['jti'],
+            exp=datetime.datetime.utcfromtimestamp(decoded_token['exp'])
+        ))
+        db.session.commit()
+        revoked_token_index.load()
+
+        response = self.client.open(
+            '/api/v1/auth/logout',
+            method='POST',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 401)
+
+    def test_revoked_token_index_prunes_expired_tokens(self):
+        revoked_token_index.add('expired-jti', expires=0)
+        revoked_token_index.add('active-jti')
+
+        self.assertEqual(revoked_token_index.prune(), 1)
+        self.assertFalse(revoked_token_index.is_revoked('expired-jti'))
+        self.assertTrue(revoked_token_index.is_revoked('active-jti'))
+
+    def test_sweeper_purges_expired_revoked_tokens(self):
+        now = datetime.datetime.utcnow()
+        for i in range(5):
+            db.session.add(RevokedUserTokens(jti=f'expired-{i}', exp=now - datetime.timedelta(minutes=1)))
+        db.session.add(RevokedUserTokens(jti='active', exp=now + datetime.timedelta(minutes=1)))
+        db.session.commit()
+
+        sweeper = RevokedTokenSweeper(batch_size=2, batch_pause=0)
+        self.assertEqual(sweeper.sweep(now), 5)
+
+        revoked_tokens = RevokedUserTokens.get_all()
+        self.assertEqual(len(revoked_tokens), 1)
+        self.assertEqual(revoked_tokens[0].jti, 'active')
+        self.assertEqual(sweeper.stats()['table_size'], 1)
+
+    def test_schema_upgrade_adds_revocation_expiry(self):
+        # RevokedUserTokens as created before exp was added
+        db.session.execute('DROP TABLE "RevokedUserTokens"')
+        db.session.execute(
+            'CREATE TABLE "RevokedUserTokens" (id INTEGER PRIMARY KEY, jti VARCHAR(120) NOT NULL UNIQUE, revoke_ts DATETIME NOT NULL)'
+        )
+        db.session.execute(
+            'INSERT INTO "RevokedUserTokens" (jti, revoke_ts) VALUES (:jti, :revoke_ts)',
+            {'jti': 'old-jti', 'revoke_ts': datetime.datetime(2020, 5, 1, 12, 0, 0)}
+        )
+        db.session.commit()
+
+        schema_upgrade.upgrade(self.app.config)
+        schema_upgrade.upgrade(self.app.config)
+
+        token = RevokedUserTokens.query.filter_by(jti='old-jti').one()
+        self.assertEqual(token.exp, datetime.datetime(2020, 5, 1, 12, 0, 0) + self.app.config['JWT_REFRESH_TOKEN_EXPIRES'])
+        self.assertEqual(RevokedUserTokens.delete_expired(datetime.datetime.utcnow(), 10), 1)
+
+    def test_get_token_hashing_queue_full(self):
+        hashing_pool.configure(workers=0, max_pending=0, retry_after=3)
+
+        response = self.client.open(
+            '/api/v1/auth/login',
+            method='POST',
+            content_type='application/json',
+            data=json.dumps({"username": 'admin', "password": 'admin'})
+        )
+
+        self.assertStatus(response, 503)
+        self.assertEqual(response.headers['Retry-After'], '3')
+
+    def test_hashing_pool_map_takes_a_slot_per_chunk(self):
+        hashing_pool.configure(workers=0, max_pending=1, retry_after=3)
+
+        # every chunk runs as a job of its own, so a batch fits in a single slot at a time
+        pending = hashing_pool.map(lambda x: (x, hashing_pool.pending), [(x,) for x in range(40)], chunksize=16)
+        self.assertEqual(pending, [(x, 1) for x in range(40)])
+        self.assertEqual(hashing_pool.stats()['pending'], 0)
+
+        # and is rejected like any other job once the pool is full
+        hashing_pool.configure(workers=0, max_pending=0, retry_after=3)
+        with self.assertRaises(error.ServiceBusyError):
+            hashing_pool.map(lambda x: x, [(x,) for x in range(40)])
+
+    def test_hashing_pool_replaces_dead_worker(self):
+        hashing_pool.configure(workers=1, max_pending=4, retry_after=3)
+        try:
+            pid = hashing_pool.run(os.getpid)
+            os.kill(pid, signal.SIGKILL)
+
+            # the job lost with the worker is retried on a new pool
+            self.assertNotEqual(hashing_pool.run(os.getpid), pid)
+            self.assertEqual(hashing_pool.stats()['restarts'], 1)
+
+            response = self.client.open(
+                '/api/v1/auth/login',
+                method='POST',
+                content_type='application/json',
+                data=json.dumps({"username": 'admin', "password": 'admin'})
+            )
+            self.assertStatus(response, 200)
+
+            # a batch in flight when its worker dies is rejected, the next one runs
+            os.kill(hashing_pool.run(os.getpid), signal.SIGKILL)
+            with self.assertRaises(error.ServiceBusyError):
+                hashing_pool.map(os.getpid, [()] * 4, chunksize=1)
+            self.assertEqual(len(hashing_pool.map(os.getpid, [()] * 4, chunksize=1)), 4)
+            self.assertEqual(hashing_pool.stats()['pending'], 0)
+        finally:
+            hashing_pool.configure(workers=0, max_pending=4, retry_after=3)
+
+    def test_login_rehashes_outdated_password_hash(self):
+        from app.storage.user_details import UserDetails
+        from app.password_policy import hash_password
+        db.session.add(
+            UserDetails(
+                first_name='test',
+                last_name='test',
+                username='test',
+                email='testr@timezonekeeper.com',
+                password=hash_password('test', 'pbkdf2_sha256', 1000),
+                role_id=1,
+                enabled=True
+            )
+        )
+        db.session.commit()
+
+        response = self.client.open(
+            '/api/v1/auth/login',
+            method='POST',
+            content_type='application/json',
+            data=json.dumps({"username": 'test', "password": 'test'})
+        )
+        self.assertStatus(response, 200)
+
+        stored_hash = UserDetails.get('test').password
+        self.assertTrue(stored_hash.startswith('$2b$04$'))
+        self.assertTrue(UserDetails.verify_hash('test', stored_hash))
+
+    def test_password_policy_calibration(self):
+        from app.password_policy import calibrate, MIN_ROUNDS
+        self.assertEqual(calibrate('bcrypt', 0.001), MIN_ROUNDS['bcrypt'])
+        self.assertGreater(calibrate('pbkdf2_sha256', 20), MIN_ROUNDS['pbkdf2_sha256'])
+
+    def _login(self, username='admin', passw='admin'):
+        response = self.client.open(
+            '/api/v1/auth/login',
+            method='POST',
+            content_type='application/json',
+            data=json.dumps({"username": username, "password": passw})
+        )
+        self.assertStatus(response, 200)
+        return response.json
+
+    def test_refresh_token(self):
+        tokens = self._login()
+        self.assertIn('refresh_token', tokens)
+
+        response = self.client.open(
+            '/api/v1/auth/refresh',
+            method='POST',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + tokens['refresh_token']}
+        )
+        self.assertStatus(response, 200)
+        access_token = response.json['access_token']
+
+        claims = flask_jwt_extended.decode_token(access_token)['user_claims']
+        self.assertEqual(claims['role'], 'admin')
+        self.assertIn('CRUD-all-user-details', claims['permissions'])
+
+        response = self.client.open(
+            '/api/v1/user/admin',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+
+    def test_refresh_with_access_token(self):
+        tokens = self._login()
+
+        response = self.client.open(
+            '/api/v1/auth/refresh',
+            method='POST',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + tokens['access_token']}
+        )
+        self.assertStatus(response, 422)
+
+    def test_logout_revokes_refresh_token(self):
+        tokens = self._login()
+
+        response = self.client.open(
+            '/api/v1/auth/logout',
+            method='POST',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + tokens['access_token']}
+        )
+        self.assertStatus(response, 200)
+
+        revoked_tokens = RevokedUserTokens.get_all()
+        self.assertEqual(len(revoked_tokens), 2)
+
+        response = self.client.open(
+            '/api/v1/auth/refresh',
+            method='POST',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + tokens['refresh_token']}
+        )
+        self.assertStatus(response, 401)
+
+    def test_verified_token_cache(self):
+        tokens = self._login()
+        headers = {'Authorization': 'Bearer ' + tokens['access_token']}
+
+        for _ in range(3):
+            response = self.client.open('/api/v1/user/admin', method='GET', headers=headers)
+            self.assertStatus(response, 200)
+
+        stats = verified_token_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['size'], 1)
+
+        response = self.client.open('/api/v1/auth/logout', method='POST', headers=headers)
+        self.assertStatus(response, 200)
+        self.assertEqual(verified_token_cache.stats()['size'], 0)
+
+        response = self.client.open('/api/v1/user/admin', method='GET', headers=headers)
+        self.assertStatus(response, 401)
+
+    def test_login_rate_limited_per_user(self):
+        login_rate_limiter.configure(
+            user_rate=0.01, user_burst=2, address_rate=100, address_burst=100, max_keys=10
+        )
+
+        for expected_status in [401, 401, 429]:
+            response = self.client.open(
+                '/api/v1/auth/login',
+                method='POST',
+                content_type='application/json',
+                data=json.dumps({"username": 'admin', "password": 'wrong'})
+            )
+            self.assertStatus(response, expected_status)
+
+        self.assertIn('Retry-After', response.headers)
+
+        response = self.client.open(
+            '/api/v1/auth/login',
+            method='POST',
+            content_type='application/json',
+            data=json.dumps({"username": 'other', "password": 'wrong'})
+        )
+        self.assertStatus(response, 401)
+
+    def test_login_rate_limit_spares_successful_logins(self):
+        login_rate_limiter.configure(
+            user_rate=0.01, user_burst=2, address_rate=100, address_burst=100, max_keys=10
+        )
+
+        def login(password):
+            return self.client.open(
+                '/api/v1/auth/login',
+                method='POST',
+                content_type='application/json',
+                data=json.dumps({"username": 'admin', "password": password})
+            )
+
+        for _ in range(5):
+            self.assertStatus(login('admin'), 200)
+        self.assertStatus(login('wrong'), 401)
+        self.assertStatus(login('wrong'), 401)
+        self.assertStatus(login('admin'), 429)
+
+    def test_login_rate_limiter_bounded_keys(self):
+        from app.rate_limiter import TokenBucketLimiter
+        limiter = TokenBucketLimiter(rate=1, burst=1, max_keys=3)
+        for i in range(10):
+            self.assertEqual(limiter.acquire(f'user{i}'), 0)
+        self.assertEqual(limiter.stats()['keys'], 3)
+        self.assertGreater(limiter.acquire('user9'), 0)
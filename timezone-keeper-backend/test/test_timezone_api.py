@@ -0,0 +1,481 @@
+import flask_jwt_extended
+import json
+import gzip
+import time
+import calendar
+import datetime
+import pytz
+import random
+import threading
+import sqlalchemy
+import app.queries_handler as qh
+from test.base import BaseTestCase
+from test import test_helpers as th
+from app.storage.user_details import UserDetails
+from app.storage.user_roles import UserRoles
+from app.storage.user_timezones import UserTimeZones
+from app.storage.timezones import TimeZones
+from app.storage.timezone_catalog import timezone_catalog
+from app.storage.timezone_offsets import zone_transitions, format_offset
+from app.storage.timezone_convert import ZoneTable, NO_TRANSITION
+from app.storage.db import db
+
+
+class TestTimezoneApi(BaseTestCase):
+    """Timezone test stubs"""
+
+    def setUp(self):
+        '''called before each test'''
+        user = UserRoles.get('user')
+
+        db.session.add(
+            UserDetails(
+                first_name='user_first_name',
+                last_name='user_last_name',
+                username='user',
+                email='user@timezonekeeper.com',
+                password=UserDetails.generate_hash('user'),
+                role_id=user['id'],
+                enabled=True
+            )
+        )
+        db.session.commit()
+
+        user_id = UserDetails.get('user').id
+        london = TimeZones.query.filter_by(location='Europe', city='London').one()
+        tokyo = TimeZones.query.filter_by(location='Asia', city='Tokyo').one()
+        db.session.add(UserTimeZones(user_id=user_id, name='home', timezone_id=london.id))
+        db.session.add(UserTimeZones(user_id=user_id, name='office', timezone_id=tokyo.id))
+        db.session.commit()
+
+        self.access_token = flask_jwt_extended.create_access_token(identity=th.get_user_details('user'))
+
+    def tearDown(self):
+        '''called after each test'''
+        db.session.remove()
+        db.drop_all()
+
+    def _get(self, url, headers=None):
+        return self.client.open(
+            url,
+            method='GET',
+            content_type='application/json',
+            headers = dict({'Authorization': 'Bearer ' + self.access_token}, **(headers or {}))
+        )
+
+    def _post(self, url, data):
+        return self.client.open(
+            url,
+            method='POST',
+            content_type='application/json',
+            data=json.dumps(data),
+            headers={'Authorization': 'Bearer ' + self.access_token}
+        )
+
+    def test_get_user_timezones(self):
+        response = self._get('/api/v1/timezone/user')
+        self.assertStatus(response, 200)
+
+        data = response.json['data']
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0]['name'], 'home')
+        self.assertEqual(data[0]['location'], 'Europe')
+        self.assertEqual(data[0]['city'], 'London')
+        self.assertEqual(data[1]['name'], 'office')
+        self.assertEqual(data[1]['city'], 'Tokyo')
+
+    def test_get_user_timezones_sparse_fields(self):
+        response = self._get('/api/v1/timezone/user?fields=name,city')
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['data'], [
+            {'name': 'home', 'city': 'London'},
+            {'name': 'office', 'city': 'Tokyo'}
+        ])
+
+        response = self._get('/api/v1/timezone/user?fields=user_id')
+        self.assertStatus(response, 400)
+
+    def test_get_user_timezones_etag(self):
+        response = self._get('/api/v1/timezone/user')
+        self.assertStatus(response, 200)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        response = self._get('/api/v1/timezone/user', headers={'If-None-Match': etag})
+        self.assertStatus(response, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.data, b'')
+
+        # a sparse fieldset is a different representation
+        response = self._get('/api/v1/timezone/user?fields=name', headers={'If-None-Match': etag})
+        self.assertStatus(response, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        london = TimeZones.query.filter_by(location='Europe', city='London').one()
+        response = self.client.open(
+            '/api/v1/timezone/user/home',
+            method='PUT',
+            data=json.dumps({'name': 'house', 'timezone_id': london.id}),
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + self.access_token, 'If-Match': etag}
+        )
+        self.assertStatus(response, 200)
+
+        response = self._get('/api/v1/timezone/user', headers={'If-None-Match': etag})
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['data'][0]['name'], 'house')
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        # the stale version no longer matches
+        response = self.client.open(
+            '/api/v1/timezone/user/house',
+            method='DELETE',
+            headers = {'Authorization': 'Bearer ' + self.access_token, 'If-Match': etag}
+        )
+        self.assertStatus(response, 412)
+        self.assertEqual(len(UserTimeZones.query.all()), 2)
+
+    def test_delete_user_deletes_timezones(self):
+        admin_token = flask_jwt_extended.create_access_token(identity=th.get_user_details('admin'))
+        response = self.client.open(
+            '/api/v1/user/user',
+            method='DELETE',
+            headers = {'Authorization': 'Bearer ' + admin_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(UserTimeZones.query.count(), 0)
+
+    def test_get_timezone_catalog(self):
+        response = self._get('/api/v1/timezone')
+        self.assertStatus(response, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('max-age=', response.headers['Cache-Control'])
+        data = response.json['data']
+        self.assertEqual(len(data), len(TimeZones.get_all()))
+        london = [x for x in data if x['city'] == 'London'][0]
+        self.assertEqual(set(london), {'id', 'location', 'city', 'relative_to_gmt'})
+        etag = response.headers['ETag']
+
+        response = self._get('/api/v1/timezone', headers={'Accept-Encoding': 'gzip'})
+        self.assertStatus(response, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.data))['data'], data)
+
+        response = self._get('/api/v1/timezone', headers={'If-None-Match': etag})
+        self.assertStatus(response, 304)
+
+    def test_timezone_catalog_rebuilt_on_change(self):
+        etag = self._get('/api/v1/timezone').headers['ETag']
+
+        TimeZones.delete(TimeZones.query.filter_by(location='Asia', city='Tokyo').one().id)
+        response = self._get('/api/v1/timezone', headers={'If-None-Match': etag})
+        self.assertStatus(response, 200)
+        self.assertNotIn('Tokyo', [x['city'] for x in response.json['data']])
+
+    def test_find_timezones(self):
+        def cities(query):
+            response = self._get('/api/v1/timezone?' + query)
+            self.assertStatus(response, 200)
+            return [x['city'] for x in response.json['data']], response.json.get('next_cursor')
+
+        found, _ = cities('location=america/arg&sort=city')
+        self.assertEqual(found[0], 'Buenos_Aires')
+        self.assertTrue(all(x['location'] == 'America/Argentina' for x in
+                            self._get('/api/v1/timezone?location=America/Arg').json['data']))
+
+        found, _ = cities('city=lond')
+        self.assertEqual(found, ['London'])
+
+        response = self._get('/api/v1/timezone?relative_to_gmt=%2B05:45')
+        self.assertTrue(response.json['data'])
+        self.assertTrue(all(x['relative_to_gmt'] == '+05:45' for x in response.json['data']))
+
+        response = self._get('/api/v1/timezone?relative_to_gmt_min=%2B05:00&relative_to_gmt_max=%2B06:00&sort=relative_to_gmt')
+        offsets = [x['relative_to_gmt'] for x in response.json['data']]
+        self.assertEqual(offsets, sorted(offsets))
+        self.assertEqual(offsets[0], '+05:00')
+        self.assertEqual(offsets[-1], '+06:00')
+
+        # paging through a filtered listing returns every match once, in order
+        expected, _ = cities('location=Europe&sort=city&limit=1000')
+        pages, cursor = [], ''
+        while True:
+            found, cursor = cities(f'location=Europe&sort=city&limit=7&cursor={cursor or ""}')
+            pages += found
+            if not cursor:
+                break
+        self.assertEqual(pages, expected)
+        self.assertEqual(expected, sorted(expected))
+
+        for query in ['sort=population', 'relative_to_gmt=noon', 'cursor=garbage', 'limit=0']:
+            self.assertStatus(self._get('/api/v1/timezone?' + query), 400)
+
+    def test_suggest_timezones(self):
+        def suggest(query):
+            response = self._get('/api/v1/timezone/all/suggest?' + query)
+            self.assertStatus(response, 200)
+            return [f"{x['location']}/{x['city']}" for x in response.json['data']]
+
+        self.assertEqual(suggest('q=Buenos&limit=2'), ['America/Buenos_Aires', 'America/Argentina/Buenos_Aires'])
+        self.assertEqual(suggest('q=Kolkatta')[0], 'Asia/Kolkata')
+        self.assertEqual(suggest('q=new%20yor')[0], 'America/New_York')
+        self.assertEqual(suggest('q=tokio')[0], 'Asia/Tokyo')
+        self.assertEqual(len(suggest('q=a&limit=5')), 5)
+        self.assertEqual(suggest('q=xqzvw'), [])
+
+        response = self._get('/api/v1/timezone/all/suggest?q=lond')
+        self.assertGreater(response.json['data'][0]['score'], response.json['data'][1]['score'])
+
+        self.assertStatus(self._get('/api/v1/timezone/all/suggest?q=%20'), 400)
+        self.assertStatus(self._get('/api/v1/timezone/all/suggest?q=lond&limit=500'), 400)
+
+    def test_timezones_of_users_named_like_collection_actions(self):
+        self.access_token = flask_jwt_extended.create_access_token(identity=th.get_user_details('admin'))
+        london = TimeZones.query.filter_by(location='Europe', city='London').one()
+        # accounts created before the collection actions existed keep their timezones reachable
+        for username in ['suggest', 'convert', 'meeting_windows']:
+            db.session.add(
+                UserDetails(
+                    first_name='first_name',
+                    last_name='last_name',
+                    username=username,
+                    email=f'{username}@timezonekeeper.com',
+                    password=UserDetails.generate_hash(username),
+                    role_id=UserRoles.get('user')['id'],
+                    enabled=True
+                )
+            )
+            db.session.commit()
+            response = self._post(f'/api/v1/timezone/{username}', {'name': 'home', 'timezone_id': london.id})
+            self.assertStatus(response, 200)
+            response = self._get(f'/api/v1/timezone/{username}')
+            self.assertStatus(response, 200)
+            self.assertEqual([x['name'] for x in response.json['data']], ['home'])
+
+    def test_timezone_offsets_follow_dst(self):
+        table = ZoneTable(['Europe/London', 'Asia/Kolkata', 'Nowhere/Atlantis'])
+        self.assertEqual(table.known.tolist(), [True, True, False])
+        offsets, dst, _ = table.at([0, 1], calendar.timegm((2020, 1, 15, 12, 0, 0)))
+        self.assertEqual((offsets.tolist(), dst.tolist()), ([0, 19800], [False, False]))
+        offsets, dst, _ = table.at([0], calendar.timegm((2020, 7, 15, 12, 0, 0)))
+        self.assertEqual((offsets.tolist(), dst.tolist()), ([3600], [True]))
+        # clocks went forward at 01:00 UTC on 29 March 2020, Kolkata has not changed since 1945
+        _, _, next_transitions = table.at([0, 1], calendar.timegm((2020, 3, 1, 0, 0, 0)))
+        self.assertEqual(next_transitions.tolist(), [calendar.timegm((2020, 3, 29, 1, 0, 0)), NO_TRANSITION])
+        self.assertIsNone(zone_transitions('Nowhere/Atlantis'))
+
+        expected = format_offset(int(pytz.timezone('Europe/London').utcoffset(datetime.datetime.utcnow()).total_seconds()))
+        response = self._get('/api/v1/timezone?city=London')
+        self.assertEqual(response.json['data'][0]['relative_to_gmt'], expected)
+        response = self._get('/api/v1/timezone/user')
+        self.assertEqual(response.json['data'][0]['relative_to_gmt'], expected)
+        response = self._get('/api/v1/timezone/user/home')
+        self.assertEqual(response.json['relative_to_gmt'], expected)
+
+    def test_timezone_catalog_rebuilt_at_transition(self):
+        snapshot = timezone_catalog.get()
+        self.assertGreater(snapshot.valid_until, time.time())
+        builds = timezone_catalog.builds
+
+        snapshot.valid_until = 0
+        self.assertIsNot(timezone_catalog.get(), snapshot)
+        self.assertEqual(timezone_catalog.builds, builds + 1)
+
+    def test_timezone_catalog_rebuilt_once_by_concurrent_requests(self):
+        snapshot = timezone_catalog.get()
+        builds = timezone_catalog.builds
+        snapshot.valid_until = 0
+
+        barrier = threading.Barrier(8)
+        found = []
+        def get():
+            barrier.wait()
+            found.append(timezone_catalog.get())
+        threads = [threading.Thread(target=get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(timezone_catalog.builds, builds + 1)
+        self.assertEqual(len(set(map(id, found))), 1)
+        self.assertIsNot(found[0], snapshot)
+
+    def test_convert_instants(self):
+        ids = {
+            x: TimeZones.query.filter_by(location=x.split('/')[0], city=x.split('/')[1]).one().id
+            for x in ['Europe/London', 'America/New_York', 'Asia/Kolkata']
+        }
+        winter, summer = calendar.timegm((2020, 1, 15, 12, 0, 0)), calendar.timegm((2020, 7, 15, 12, 0, 0))
+        response = self._post('/api/v1/timezone/all/convert', {
+            'instants': [winter, summer],
+            'timezone_ids': [ids['Europe/London'], ids['America/New_York']]
+        })
+        self.assertStatus(response, 200)
+        london, new_york = response.json['data']
+        self.assertEqual(london['city'], 'London')
+        self.assertEqual(london['offsets'], [0, 3600])
+        self.assertEqual(london['local'], [winter, summer + 3600])
+        self.assertEqual(new_york['offsets'], [-18000, -14400])
+        self.assertNotIn('utc', response.json)
+
+        # wall times skipped or repeated by a transition take the offset before it
+        response = self._post('/api/v1/timezone/all/convert', {
+            'instants': ['2020-03-29T01:30:00', '2020-10-25T01:30:00', '2020-07-01T12:00:00'],
+            'from_timezone_id': ids['Europe/London'],
+            'timezone_ids': [ids['Asia/Kolkata']]
+        })
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['utc'], ['2020-03-29T01:30:00', '2020-10-25T00:30:00', '2020-07-01T11:00:00'])
+        self.assertEqual(response.json['data'][0]['local'][2], '2020-07-01T16:30:00')
+
+        rng = random.Random(1)
+        instants = [rng.randrange(0, 2000000000) for _ in range(100000)]
+        response = self._post('/api/v1/timezone/all/convert', {
+            'instants': instants, 'timezone_ids': [ids['America/New_York']], 'format': 'epoch'
+        })
+        self.assertStatus(response, 200)
+        offsets = response.json['data'][0]['offsets']
+        self.assertEqual(len(offsets), len(instants))
+        new_york = pytz.timezone('America/New_York')
+        for i in range(0, len(instants), 997):
+            expected = datetime.datetime.fromtimestamp(instants[i], new_york).utcoffset().total_seconds()
+            self.assertEqual(offsets[i], expected)
+
+        self.assertStatus(self._post('/api/v1/timezone/all/convert', {'instants': [0], 'timezone_ids': [999999]}), 404)
+        for bad in [
+            {'instants': [], 'timezone_ids': [ids['Europe/London']]},
+            {'instants': ['yesterday'], 'timezone_ids': [ids['Europe/London']]},
+            {'instants': [True], 'timezone_ids': [ids['Europe/London']]},
+            {'instants': [0], 'timezone_ids': []},
+            {'instants': [0], 'timezone_ids': [ids['Europe/London']], 'format': 'rfc'},
+        ]:
+            self.assertStatus(self._post('/api/v1/timezone/all/convert', bad), 400)
+
+        # the instants times timezones product and the body size are capped
+        self.app.config['TIMEZONE_CONVERT_MAX_VALUES'] = 4
+        body = {'instants': [0, 1, 2], 'timezone_ids': [ids['Europe/London'], ids['Asia/Kolkata']]}
+        self.assertStatus(self._post('/api/v1/timezone/all/convert', body), 400)
+        self.app.config['MAX_CONTENT_LENGTH'] = 64
+        body = {'instants': list(range(100)), 'timezone_ids': [ids['Europe/London']]}
+        response = self._post('/api/v1/timezone/all/convert', body)
+        self.assertStatus(response, 413)
+        self.assertIn('message', response.json['error'])
+
+    def test_get_user_world_clock(self):
+        self._get('/api/v1/timezone/user/now')
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = self._get('/api/v1/timezone/user/now')
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertStatus(response, 200)
+        # the user, then all of their timezones in one query
+        self.assertEqual(len(statements), 2)
+
+        home, office = response.json['data']
+        self.assertEqual([home['name'], office['name']], ['home', 'office'])
+        now = datetime.datetime.strptime(response.json['utc'], '%Y-%m-%dT%H:%M:%S')
+
+        london = pytz.timezone('Europe/London').fromutc(now)
+        self.assertEqual(home['relative_to_gmt'], format_offset(int(london.utcoffset().total_seconds())))
+        self.assertEqual(home['dst'], bool(london.dst()))
+        self.assertEqual(home['local_time'], london.strftime('%Y-%m-%dT%H:%M:%S'))
+        self.assertGreater(home['next_transition'], response.json['utc'])
+
+        self.assertEqual(office['relative_to_gmt'], '+09:00')
+        self.assertFalse(office['dst'])
+        self.assertNotIn('next_transition', office)
+        self.assertEqual(office['local_time'], (now + datetime.timedelta(hours=9)).strftime('%Y-%m-%dT%H:%M:%S'))
+
+        difference = 9 - london.utcoffset().total_seconds() / 3600
+        self.assertEqual(response.json['hour_differences'], [[0, difference], [-difference, 0]])
+
+        self.assertStatus(self._get('/api/v1/timezone/admin/now'), 403)
+        # other timezone routes of the user still resolve
+        self.assertStatus(self._get('/api/v1/timezone/user/home'), 200)
+
+        # a user without timezones has an empty world clock
+        UserTimeZones.query.delete()
+        db.session.commit()
+        response = self._get('/api/v1/timezone/user/now')
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['data'], [])
+        self.assertEqual(response.json['hour_differences'], [])
+
+    def test_reserved_timezone_name(self):
+        london = TimeZones.query.filter_by(location='Europe', city='London').one()
+        response = self._post('/api/v1/timezone/user', {'name': 'now', 'timezone_id': london.id})
+        self.assertStatus(response, 400)
+
+        response = self.client.open(
+            '/api/v1/timezone/user/home',
+            method='PUT',
+            data=json.dumps({'name': 'now', 'timezone_id': london.id}),
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + self.access_token}
+        )
+        self.assertStatus(response, 400)
+        self.assertEqual(sorted(x.name for x in UserTimeZones.query.all()), ['home', 'office'])
+
+        # a timezone stored with the name before it was reserved is reported at startup
+        self.assertEqual(qh.report_reserved_names()['timezones'], [])
+        UserTimeZones.query.filter_by(name='home').update({'name': 'now'})
+        db.session.commit()
+        self.assertEqual(qh.report_reserved_names()['timezones'], [('user', 'now')])
+
+    def test_find_meeting_windows(self):
+        def windows(**request):
+            response = self._post('/api/v1/timezone/all/meeting_windows', request)
+            self.assertStatus(response, 200)
+            return [(x['start'], x['end'], x['minutes']) for x in response.json['windows']]
+
+        # London 09:00-17:00 at +01:00 and Tokyo 15:00-23:00 at +09:00 overlap 08:00-14:00 UTC
+        response = self._post('/api/v1/timezone/all/meeting_windows', {
+            'start_date': '2020-07-03', 'end_date': '2020-07-06',
+            'usernames': ['user'],
+            'user_timezones': [{'username': 'user', 'name': 'office', 'start': '15:00', 'end': '23:00'}]
+        })
+        self.assertStatus(response, 200)
+        self.assertEqual([(x['name'], x['city']) for x in response.json['participants']], [('home', 'London'), ('office', 'Tokyo')])
+        self.assertEqual([(x['start'], x['end'], x['minutes']) for x in response.json['windows']], [
+            ('2020-07-03T08:00:00', '2020-07-03T14:00:00', 360),
+            ('2020-07-06T08:00:00', '2020-07-06T14:00:00', 360)
+        ])
+        self.assertEqual(windows(
+            start_date='2020-07-03', end_date='2020-07-03', usernames=['user'], user_timezones=[{'username': 'user', 'name': 'office'}]
+        ), [])
+
+        # clocks went back on 25 October 2020
+        self.assertEqual(windows(start_date='2020-10-24', end_date='2020-10-26', usernames=['user'], weekdays=list(range(7))), [
+            ('2020-10-24T08:00:00', '2020-10-24T16:00:00', 480),
+            ('2020-10-25T09:00:00', '2020-10-25T17:00:00', 480),
+            ('2020-10-26T09:00:00', '2020-10-26T17:00:00', 480)
+        ])
+
+        # night shifts run past midnight, windows shorter than min_minutes are left out
+        self.assertEqual(windows(
+            start_date='2020-01-15', end_date='2020-01-15', usernames=['user'], working_hours={'start': '22:00', 'end': '06:00'}
+        ), [('2020-01-15T00:00:00', '2020-01-15T06:00:00', 360), ('2020-01-15T22:00:00', '2020-01-16T00:00:00', 120)])
+        self.assertEqual(windows(
+            start_date='2020-01-15', end_date='2020-01-15', usernames=['user'], working_hours={'start': '22:00', 'end': '06:00'},
+            min_minutes=180
+        ), [('2020-01-15T00:00:00', '2020-01-15T06:00:00', 360)])
+
+        meeting = {'start_date': '2020-07-01', 'end_date': '2020-07-31'}
+        self.assertStatus(self._post('/api/v1/timezone/all/meeting_windows', dict(meeting, usernames=['admin'])), 403)
+        self.assertStatus(self._post('/api/v1/timezone/all/meeting_windows', dict(
+            meeting, user_timezones=[{'username': 'user', 'name': 'beach'}]
+        )), 404)
+        for bad in [
+            dict(meeting),
+            dict(meeting, usernames=['user'], start_date='July'),
+            dict(meeting, usernames=['user'], end_date='2022-01-01'),
+            dict(meeting, usernames=['user'], weekdays=[7]),
+            dict(meeting, usernames=['user'], working_hours={'start': '25:00'}),
+            dict(meeting, usernames=['user'], working_hours={'start': '10:00', 'end': '10:00'}),
+        ]:
+            self.assertStatus(self._post('/api/v1/timezone/all/meeting_windows', bad), 400)
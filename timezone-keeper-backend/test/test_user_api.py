@@ -1,11 +1,21 @@
 import flask
 import flask_jwt_extended
 import json
+import sqlalchemy
+import datetime
+import pytz
 import app.error as error
+import app.queries_handler as qh
+import app.storage.user_search as user_search
+import app.storage.schema_upgrade as schema_upgrade
 from test.base import BaseTestCase
 from test import test_helpers as th
 from app.storage.user_details import UserDetails
-from app.storage.user_roles import UserRoles
+from app.storage.user_roles import UserRoles, UserRolesEnum
+from app.storage.timezones import TimeZones
+from app.storage.user_timezones import UserTimeZones
+from app.storage.timezone_catalog import timezone_catalog
+from app.storage.working_hours_index import working_hours_index
 from app.storage.db import db
 
 
@@ -420,6 +430,36 @@ class TestUserApi(BaseTestCase):
         )
         self.assertStatus(response, 400)
 
+    def test_create_user_reserved_username(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        for username in sorted(qh.RESERVED_USERNAMES):
+            user_data = {
+                'first_name': 'first_name',
+                'last_name': 'last_name',
+                'username': username,
+                'email': f'{username}@test.com',
+                'password': 'password'
+            }
+            response = self.client.open(
+                '/api/v1/user',
+                method='POST',
+                content_type='application/json',
+                data=json.dumps(user_data)
+            )
+            self.assertStatus(response, 400)
+
+            response = self.client.open(
+                '/api/v1/user/all/import',
+                method='POST',
+                content_type='application/json',
+                data=json.dumps([user_data]),
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+            self.assertStatus(response, 200)
+            self.assertEqual(response.json['results'][0]['status'], 'error')
+
     def test_create_user_conflict(self):
         user_data = {
             'first_name': 'first_name',
@@ -943,4 +983,815 @@ class TestUserApi(BaseTestCase):
             content_type='application/json',
             headers = {'Authorization': 'Bearer ' + access_token}
         )
-        self.assertStatus(response, 403)
\ No newline at end of file
+        self.assertStatus(response, 403)
+
+    def test_disable_user_invalidates_status_cache(self):
+        admin_user = th.get_user_details('admin')
+        admin_token = flask_jwt_extended.create_access_token(identity=admin_user)
+        user = th.get_user_details('user')
+        access_token = flask_jwt_extended.create_access_token(identity=user)
+
+        username = 'user'
+        for _ in range(2):
+            response = self.client.open(
+                f'/api/v1/user/{username}',
+                method='GET',
+                content_type='application/json',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+            self.assertStatus(response, 200)
+
+        response = self.client.open(
+            f'/api/v1/user/{username}/disable',
+            method='POST',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + admin_token}
+        )
+        self.assertStatus(response, 200)
+
+        response = self.client.open(
+            f'/api/v1/user/{username}',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 403)
+
+        response = self.client.open(
+            '/api/v1/metrics',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + admin_token}
+        )
+        self.assertStatus(response, 200)
+
+        stats = response.json['user_status_cache']
+        self.assertEqual(stats['misses'], 3)
+        self.assertEqual(stats['hits'], 2)
+
+    def test_metrics_requires_privileges(self):
+        user = th.get_user_details('manager')
+        access_token = flask_jwt_extended.create_access_token(identity=user)
+
+        response = self.client.open(
+            '/api/v1/metrics',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 403)
+
+    def test_role_permissions_bitmask(self):
+        from app.storage.user_roles import UserRolesEnum
+        permissions = [UserRolesEnum.record.value, UserRolesEnum.user_privileged.value]
+        mask = UserRolesEnum.to_mask(permissions)
+
+        self.assertEqual(mask, UserRolesEnum.record.bit | UserRolesEnum.user_privileged.bit)
+        self.assertEqual(UserRolesEnum.from_mask(mask), permissions)
+        # stored masks rely on every member keeping its bit
+        self.assertEqual([x.bit for x in UserRolesEnum], [1, 2, 4, 8, 16, 32])
+
+        manager_role = UserRoles.get('manager')
+        self.assertEqual(manager_role['permissions'], permissions)
+        self.assertEqual(manager_role['permission_mask'], mask)
+        self.assertEqual(UserRoles.get_ids_with_permission(UserRolesEnum.user_privileged.value), [manager_role['id']])
+
+    def test_get_all_users_paginated(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        usernames = []
+        cursor = ''
+        while True:
+            response = self.client.open(
+                f'/api/v1/user?limit=2&cursor={cursor}',
+                method='GET',
+                content_type='application/json',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+            self.assertStatus(response, 200)
+            usernames.extend(x['username'] for x in response.json['data'])
+            self.assertLessEqual(len(response.json['data']), 2)
+            cursor = response.json.get('next_cursor')
+            if not cursor:
+                break
+
+        self.assertEqual(usernames, ['admin', 'user', 'manager'])
+
+    def test_get_all_users_invalid_pagination(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        for query in ['limit=0', 'limit=abc', 'cursor=not-a-cursor']:
+            response = self.client.open(
+                f'/api/v1/user?{query}',
+                method='GET',
+                content_type='application/json',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+            self.assertStatus(response, 400)
+
+    def test_export_users(self):
+        user = th.get_user_details('manager')
+        access_token = flask_jwt_extended.create_access_token(identity=user)
+
+        response = self.client.open(
+            '/api/v1/user/all/export',
+            method='GET',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+
+        rows = [json.loads(x) for x in response.data.decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['username'], 'user')
+        self.assertEqual(rows[0]['role'], 'user')
+        self.assertNotIn('password', rows[0])
+
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        response = self.client.open(
+            '/api/v1/user/all/export?format=csv',
+            method='GET',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+
+        lines = response.data.decode().splitlines()
+        self.assertEqual(lines[0], 'id,username,first_name,last_name,email,role,enabled')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith('1,admin,Administrator,SuperUser,'))
+
+        response = self.client.open(
+            '/api/v1/user/all/export?format=xml',
+            method='GET',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 400)
+
+    def test_users_named_like_collection_actions(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        # accounts created before the collection actions existed stay reachable
+        for username in ['export', 'search', 'import', 'working_now']:
+            db.session.add(
+                UserDetails(
+                    first_name='first_name',
+                    last_name='last_name',
+                    username=username,
+                    email=f'{username}@timezonekeeper.com',
+                    password=UserDetails.generate_hash(username),
+                    role_id=UserRoles.get('user')['id'],
+                    enabled=True
+                )
+            )
+            db.session.commit()
+            response = self.client.open(
+                f'/api/v1/user/{username}',
+                method='GET',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+            self.assertStatus(response, 200)
+            self.assertEqual(response.json['username'], username)
+        self.assertEqual(qh.report_reserved_names()['usernames'], [])
+
+        # a stored user with a reserved name is reported at startup
+        db.session.add(
+            UserDetails(
+                first_name='first_name',
+                last_name='last_name',
+                username='all',
+                email='all@timezonekeeper.com',
+                password=UserDetails.generate_hash('all'),
+                role_id=UserRoles.get('user')['id'],
+                enabled=True
+            )
+        )
+        db.session.commit()
+        self.assertEqual(qh.report_reserved_names()['usernames'], ['all'])
+
+    def test_get_users_sparse_fields(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        response = self.client.open(
+            '/api/v1/user?fields=username,role',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['data'][1], {'username': 'user', 'role': 'user'})
+
+        response = self.client.open(
+            '/api/v1/user/manager?fields=email',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json, {'email': 'manager@timezonekeeper.com'})
+
+        response = self.client.open(
+            '/api/v1/user?fields=username,password',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 400)
+
+    def test_search_users(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        def search(query):
+            response = self.client.open(
+                '/api/v1/user/all/search?' + query,
+                method='GET',
+                content_type='application/json',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+            self.assertStatus(response, 200)
+            return sorted(x['username'] for x in response.json['data'])
+
+        self.assertEqual(search('q=man'), ['manager'])
+        self.assertEqual(search('q=Admin'), ['admin'])
+        self.assertEqual(search('q=timezonekeeper'), ['admin', 'manager', 'user'])
+        self.assertEqual(search('q=user_first'), ['user'])
+        self.assertEqual(search('q=timezonekeeper%20manager'), ['manager'])
+        self.assertEqual(search('q=nobody'), [])
+        self.assertEqual(len(search('q=timezonekeeper&limit=2')), 2)
+
+        # the index follows updates and deletes
+        self.client.open(
+            '/api/v1/user/user',
+            method='PUT',
+            data=json.dumps({'first_name': 'renamed_first_name'}),
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertEqual(search('q=renamed'), ['user'])
+        self.assertEqual(search('q=user_first'), [])
+
+        self.client.open(
+            '/api/v1/user/manager',
+            method='DELETE',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertEqual(search('q=man'), [])
+
+        response = self.client.open(
+            '/api/v1/user/all/search?q=',
+            method='GET',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 400)
+
+    def test_search_users_scoped_by_role(self):
+        manager_user = th.get_user_details('manager')
+        access_token = flask_jwt_extended.create_access_token(identity=manager_user)
+
+        response = self.client.open(
+            '/api/v1/user/all/search?q=timezonekeeper&fields=username',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['data'], [{'username': 'user'}])
+
+        user = th.get_user_details('user')
+        access_token = flask_jwt_extended.create_access_token(identity=user)
+        response = self.client.open(
+            '/api/v1/user/all/search?q=timezonekeeper&fields=username',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['data'], [{'username': 'user'}])
+
+    def test_search_users_without_index(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        def search(query):
+            response = self.client.open(
+                '/api/v1/user/all/search?' + query,
+                method='GET',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+            self.assertStatus(response, 200)
+            return sorted(x['username'] for x in response.json['data'])
+
+        # a database created without the search table falls back to prefix matching
+        for trigger in ['insert', 'delete', 'update']:
+            db.session.execute(f'DROP TRIGGER UserDetails_search_{trigger}')
+        db.session.execute(f'DROP TABLE {user_search.SEARCH_TABLE}')
+        db.session.commit()
+        user_search._index_exists.clear()
+        self.assertFalse(user_search.index_exists(db.session.connection()))
+        self.assertEqual(search('q=man'), ['manager'])
+        self.assertEqual(search('q=user_first%20user_last'), ['user'])
+
+        # and the table is created, with the existing users, when the app starts
+        user_search.ensure_search_index()
+        self.assertTrue(user_search.index_exists(db.session.connection()))
+        self.assertEqual(search('q=man'), ['manager'])
+        self.assertEqual(search('q=timezonekeeper'), ['admin', 'manager', 'user'])
+
+    def test_get_user_single_query(self):
+        manager_user = th.get_user_details('manager')
+        access_token = flask_jwt_extended.create_access_token(identity=manager_user)
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            # caller status not cached yet, then cached
+            for _ in range(2):
+                del statements[:]
+                response = self.client.open(
+                    '/api/v1/user/user',
+                    method='GET',
+                    content_type='application/json',
+                    headers = {'Authorization': 'Bearer ' + access_token}
+                )
+                self.assertStatus(response, 200)
+                self.assertEqual(response.json['username'], 'user')
+                self.assertEqual(len(statements), 1)
+
+            del statements[:]
+            response = self.client.open(
+                '/api/v1/user/admin',
+                method='GET',
+                content_type='application/json',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+            self.assertStatus(response, 403)
+            self.assertEqual(len(statements), 1)
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute', count)
+
+    def test_get_user_without_role(self):
+        db.session.add(
+            UserDetails(
+                first_name='norole_first_name',
+                last_name='norole_last_name',
+                username='norole',
+                email='norole@timezonekeeper.com',
+                password=UserDetails.generate_hash('norole'),
+                role_id=None,
+                enabled=True
+            )
+        )
+        db.session.commit()
+
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+        response = self.client.open(
+            '/api/v1/user/norole',
+            method='GET',
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 404)
+
+    def test_import_users(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        rows = [
+            {'first_name': 'first', 'last_name': 'last', 'username': 'imported1',
+             'email': 'imported1@timezonekeeper.com', 'password': 'imported_password'},
+            {'first_name': 'first', 'last_name': 'last', 'username': 'imported2',
+             'email': 'imported2@timezonekeeper.com', 'password': 'imported_password'},
+            {'first_name': 'first', 'last_name': 'last', 'username': 'imported3',
+             'email': 'invalid', 'password': 'imported_password'},
+            {'first_name': 'first', 'last_name': 'last', 'username': 'manager',
+             'email': 'other@timezonekeeper.com', 'password': 'imported_password'},
+            {'first_name': 'first', 'last_name': 'last', 'username': 'imported1',
+             'email': 'imported4@timezonekeeper.com', 'password': 'imported_password'},
+            {'first_name': 'first', 'username': 'imported5'},
+        ]
+        response = self.client.open(
+            '/api/v1/user/all/import',
+            method='POST',
+            data=json.dumps(rows),
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['created'], 2)
+        self.assertEqual(response.json['failed'], 4)
+        results = response.json['results']
+        self.assertEqual([x['status'] for x in results], ['created', 'created', 'error', 'error', 'error', 'error'])
+        self.assertEqual(results[2]['message'], 'Invalid email address format')
+        self.assertEqual(results[3]['message'], 'username already exists')
+        self.assertEqual(results[4]['message'], 'duplicate username in import')
+
+        imported = UserDetails.get('imported2')
+        self.assertEqual(imported.email, 'imported2@timezonekeeper.com')
+        self.assertFalse(imported.enabled)
+        self.assertTrue(UserDetails.verify_hash('imported_password', imported.password))
+
+        csv_rows = (
+            'first_name,last_name,username,email,password\n'
+            'first,last,imported6,imported6@timezonekeeper.com,imported_password\n'
+        )
+        response = self.client.open(
+            '/api/v1/user/all/import',
+            method='POST',
+            data=csv_rows,
+            content_type='text/csv',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['created'], 1)
+        self.assertIsNotNone(UserDetails.get('imported6'))
+
+    def test_import_users_requires_privileges(self):
+        manager_user = th.get_user_details('manager')
+        access_token = flask_jwt_extended.create_access_token(identity=manager_user)
+
+        response = self.client.open(
+            '/api/v1/user/all/import',
+            method='POST',
+            data=json.dumps([]),
+            content_type='application/json',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 403)
+
+    def test_batch_update_users(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        def batch(body):
+            return self.client.open(
+                '/api/v1/user/all/batch',
+                method='POST',
+                data=json.dumps(body),
+                content_type='application/json',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+
+        response = batch({'action': 'disable', 'usernames': ['user', 'manager', 'nobody']})
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json, {'action': 'disable', 'affected': 2, 'not_found': ['nobody']})
+        self.assertFalse(UserDetails.get('user').enabled)
+        self.assertFalse(UserDetails.get('manager').enabled)
+
+        response = batch({'action': 'enable', 'filter': {'enabled': False}})
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json, {'action': 'enable', 'affected': 2})
+        self.assertTrue(UserDetails.get('user').enabled)
+
+        response = batch({'action': 'set_role', 'filter': {'role': 'user'}, 'role': 'manager'})
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['affected'], 1)
+        self.assertEqual(UserDetails.get('user').role_id, UserRoles.get('manager')['id'])
+
+        response = batch({'action': 'set_role', 'usernames': ['user'], 'role': 'nonexistent'})
+        self.assertStatus(response, 404)
+
+        # the requester is never deleted
+        response = batch({'action': 'delete', 'usernames': ['user', 'manager', 'admin']})
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json, {'action': 'delete', 'affected': 2, 'skipped': ['admin'], 'not_found': []})
+        self.assertEqual(len(UserDetails.get_all()), 1)
+        self.assertIsNotNone(UserDetails.get('admin'))
+
+        response = batch({'action': 'delete'})
+        self.assertStatus(response, 400)
+
+    def test_batch_update_users_permissions(self):
+        manager_user = th.get_user_details('manager')
+        access_token = flask_jwt_extended.create_access_token(identity=manager_user)
+
+        def batch(body):
+            return self.client.open(
+                '/api/v1/user/all/batch',
+                method='POST',
+                data=json.dumps(body),
+                content_type='application/json',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+
+        # enabling and disabling accounts needs admin rights
+        response = batch({'action': 'disable', 'usernames': ['user']})
+        self.assertStatus(response, 403)
+
+        # managers cannot delete admins, nothing is deleted
+        response = batch({'action': 'delete', 'usernames': ['user', 'admin']})
+        self.assertStatus(response, 403)
+        self.assertEqual(len(UserDetails.get_all()), 3)
+
+        # a filter only reaches the users the manager may modify, other than the manager
+        response = batch({'action': 'delete', 'filter': {'enabled': True}})
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json, {'action': 'delete', 'affected': 1, 'skipped': ['manager']})
+        self.assertIsNone(UserDetails.get('user'))
+        self.assertIsNotNone(UserDetails.get('manager'))
+        self.assertIsNotNone(UserDetails.get('admin'))
+
+    def test_get_user_etag(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        def request(method, url, **headers):
+            headers['Authorization'] = 'Bearer ' + access_token
+            return self.client.open(
+                url,
+                method=method,
+                data=json.dumps({'first_name': 'renamed'}) if method == 'PUT' else None,
+                content_type='application/json',
+                headers=headers
+            )
+
+        response = request('GET', '/api/v1/user/user')
+        self.assertStatus(response, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+
+        response = request('GET', '/api/v1/user/user', **{'If-None-Match': etag})
+        self.assertStatus(response, 304)
+
+        response = request('PUT', '/api/v1/user/user', **{'If-Match': '"stale"'})
+        self.assertStatus(response, 412)
+        self.assertEqual(UserDetails.get('user').first_name, 'user_first_name')
+
+        response = request('PUT', '/api/v1/user/user', **{'If-Match': etag})
+        self.assertStatus(response, 200)
+        self.assertEqual(UserDetails.get('user').first_name, 'renamed')
+
+        response = request('GET', '/api/v1/user/user', **{'If-None-Match': etag})
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json['first_name'], 'renamed')
+        new_etag = response.headers['ETag']
+        self.assertNotEqual(new_etag, etag)
+
+        # account status changes are new versions too
+        request('POST', '/api/v1/user/user/disable')
+        response = request('DELETE', '/api/v1/user/user', **{'If-Match': new_etag})
+        self.assertStatus(response, 412)
+        self.assertIsNotNone(UserDetails.get('user'))
+
+    def test_get_user_etag_of_recreated_user(self):
+        admin_user = th.get_user_details('admin')
+        access_token = flask_jwt_extended.create_access_token(identity=admin_user)
+
+        def get_etag():
+            response = self.client.open(
+                '/api/v1/user/manager',
+                method='GET',
+                headers = {'Authorization': 'Bearer ' + access_token}
+            )
+            self.assertStatus(response, 200)
+            return response.headers['ETag']
+
+        # the last user's id is reused by SQLite once deleted
+        manager = UserDetails.get('manager')
+        user_id, etag = manager.id, get_etag()
+        UserDetails.delete('manager')
+        db.session.add(
+            UserDetails(
+                first_name='manager_first_name',
+                last_name='manager_last_name',
+                username='manager',
+                email='manager@timezonekeeper.com',
+                password=UserDetails.generate_hash('manager'),
+                role_id=UserRoles.get('manager')['id'],
+                enabled=True
+            )
+        )
+        db.session.commit()
+        self.assertEqual(UserDetails.get('manager').id, user_id)
+        self.assertNotEqual(get_etag(), etag)
+
+    def test_schema_upgrade_adds_user_versions(self):
+        # UserDetails as created before the version columns were added
+        db.session.execute('DROP TABLE "UserDetails"')
+        db.session.execute(
+            'CREATE TABLE "UserDetails" (id INTEGER PRIMARY KEY, first_name VARCHAR NOT NULL, last_name VARCHAR NOT NULL, '
+            'username VARCHAR NOT NULL UNIQUE, email VARCHAR NOT NULL UNIQUE, password VARCHAR NOT NULL, role_id INTEGER, enabled BOOLEAN)'
+        )
+        db.session.execute(
+            'INSERT INTO "UserDetails" (first_name, last_name, username, email, password, role_id, enabled) '
+            'VALUES (:name, :name, :name, :email, :password, :role_id, 1)',
+            {'name': 'olduser', 'email': 'olduser@timezonekeeper.com', 'password': UserDetails.generate_hash('olduser'),
+             'role_id': UserRoles.get('user')['id']}
+        )
+        db.session.commit()
+
+        schema_upgrade.upgrade(self.app.config)
+        schema_upgrade.upgrade(self.app.config)
+
+        user = UserDetails.get('olduser')
+        self.assertEqual((user.version, user.timezones_version), (1, 1))
+        self.assertEqual(user.created, datetime.datetime(1970, 1, 1))
+
+        access_token = flask_jwt_extended.create_access_token(identity=th.get_user_details('olduser'))
+        response = self.client.open(
+            '/api/v1/user/olduser',
+            method='GET',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertIn('ETag', response.headers)
+
+    def test_schema_upgrade_converts_permissions(self):
+        # UserRoles and UserDetails as created when permissions were comma joined strings
+        db.session.execute('DROP TABLE "UserDetails"')
+        db.session.execute('DROP TABLE "UserRoles"')
+        db.session.execute(
+            'CREATE TABLE "UserRoles" (id INTEGER PRIMARY KEY, role VARCHAR NOT NULL UNIQUE, permissions VARCHAR NOT NULL)'
+        )
+        db.session.execute(
+            'CREATE TABLE "UserDetails" (id INTEGER PRIMARY KEY, first_name VARCHAR NOT NULL, last_name VARCHAR NOT NULL, '
+            'username VARCHAR NOT NULL UNIQUE, email VARCHAR NOT NULL UNIQUE, password VARCHAR NOT NULL, '
+            'role_id VARCHAR REFERENCES "UserRoles" (id), enabled BOOLEAN)'
+        )
+        db.session.execute(
+            'INSERT INTO "UserRoles" (role, permissions) VALUES '
+            "('user', 'CRUD-own-records,CRUD-own-user-details'), "
+            "('admin', 'CRUD-user-roles,CRUD-all-records,CRUD-all-user-details')"
+        )
+        db.session.execute(
+            'INSERT INTO "UserDetails" (first_name, last_name, username, email, password, role_id, enabled) '
+            "VALUES ('olduser', 'olduser', 'olduser', 'olduser@timezonekeeper.com', :password, '2', 1)",
+            {'password': UserDetails.generate_hash('olduser')}
+        )
+        db.session.commit()
+
+        schema_upgrade.upgrade(self.app.config)
+        schema_upgrade.upgrade(self.app.config)
+        user_search.ensure_search_index()
+
+        self.assertEqual(UserRoles.get('user')['permission_mask'], UserRolesEnum.to_mask(
+            [UserRolesEnum.record.value, UserRolesEnum.user.value]
+        ))
+        self.assertEqual(
+            sorted(UserRoles.get('admin')['permissions']),
+            sorted([UserRolesEnum.role.value, UserRolesEnum.record_all.value, UserRolesEnum.user_all.value])
+        )
+        self.assertEqual(UserDetails.get('olduser').role_id, 2)
+
+        response = self.client.open(
+            '/api/v1/auth/login',
+            method='POST',
+            content_type='application/json',
+            data=json.dumps({'username': 'olduser', 'password': 'olduser'})
+        )
+        self.assertStatus(response, 200)
+        access_token = response.json['access_token']
+        response = self.client.open(
+            '/api/v1/user/all/search?q=old',
+            method='GET',
+            headers = {'Authorization': 'Bearer ' + access_token}
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual([x['username'] for x in response.json['data']], ['olduser'])
+
+    def test_get_users_working_now(self):
+        admin_token = flask_jwt_extended.create_access_token(identity=th.get_user_details('admin'))
+        user_token = flask_jwt_extended.create_access_token(identity=th.get_user_details('user'))
+        london = TimeZones.query.filter_by(location='Europe', city='London').one().id
+        tokyo = TimeZones.query.filter_by(location='Asia', city='Tokyo').one().id
+
+        def request(method, url, token=admin_token, data=None):
+            return self.client.open(
+                url, method=method, content_type='application/json',
+                data=json.dumps(data) if data is not None else None,
+                headers={'Authorization': 'Bearer ' + token}
+            )
+
+        # two hours around the current time in London, Tokyo is 8 or 9 hours ahead
+        local = datetime.datetime.now(pytz.timezone('Europe/London'))
+        start = (local - datetime.timedelta(hours=1)).strftime('%H:%M')
+        end = (local + datetime.timedelta(hours=1)).strftime('%H:%M')
+        url = f'/api/v1/user/all/working_now?start={start}&end={end}&weekdays=0,1,2,3,4,5,6'
+
+        def working(token=admin_token, query=''):
+            response = request('GET', url + query, token)
+            self.assertStatus(response, 200)
+            return response.json
+
+        self.assertEqual(working()['data'], [])
+        request('POST', '/api/v1/timezone/user', data={'name': 'home', 'timezone_id': london})
+        request('POST', '/api/v1/timezone/manager', data={'name': 'home', 'timezone_id': london})
+        # only the first timezone of a user counts
+        request('POST', '/api/v1/timezone/admin', data={'name': 'home', 'timezone_id': tokyo})
+        request('POST', '/api/v1/timezone/admin', data={'name': 'office', 'timezone_id': london})
+
+        page = working(query='&limit=1')
+        self.assertEqual([x['username'] for x in page['data']], ['user'])
+        self.assertEqual(page['data'][0]['city'], 'London')
+        self.assertEqual(page['data'][0]['local_time'][:13], local.strftime('%Y-%m-%dT%H'))
+        page = working(query='&limit=1&cursor=' + page['next_cursor'])
+        self.assertEqual([x['username'] for x in page['data']], ['manager'])
+        self.assertNotIn('next_cursor', page)
+
+        # a user role only sees itself
+        self.assertEqual([x['username'] for x in working(user_token)['data']], ['user'])
+
+        request('PUT', '/api/v1/timezone/manager/home', data={'name': 'home', 'timezone_id': tokyo})
+        request('PUT', '/api/v1/timezone/admin/home', data={'name': 'home', 'timezone_id': london})
+        self.assertEqual([x['username'] for x in working()['data']], ['admin', 'user'])
+        request('DELETE', '/api/v1/timezone/admin/home')
+        request('POST', '/api/v1/timezone/admin', data={'name': 'travel', 'timezone_id': tokyo})
+        self.assertEqual([x['username'] for x in working()['data']], ['admin', 'user'])
+        request('DELETE', '/api/v1/timezone/admin/office')
+        self.assertEqual([x['username'] for x in working()['data']], ['user'])
+
+        # offset buckets are rebuilt at DST transitions, without reloading the users
+        builds = working_hours_index.builds
+        timezone_catalog.get().valid_until = 0
+        self.assertEqual([x['username'] for x in working()['data']], ['user'])
+        self.assertEqual(working_hours_index.builds, builds + 1)
+
+        for query in ['?start=25:00', '?start=10:00&end=10:00', '?weekdays=monday', '?weekdays=7', '?cursor=garbage']:
+            self.assertStatus(request('GET', '/api/v1/user/all/working_now' + query), 400)
+
+    def test_get_users_working_now_scoped(self):
+        london = TimeZones.query.filter_by(location='Europe', city='London').one().id
+        admin_role = UserRoles.get('admin')['id']
+        db.session.bulk_insert_mappings(UserDetails, [
+            {'first_name': 'first_name', 'last_name': 'last_name', 'username': f'working{i}',
+             'email': f'working{i}@timezonekeeper.com', 'password': 'password', 'role_id': admin_role, 'enabled': True}
+            for i in range(1500)
+        ])
+        db.session.commit()
+        db.session.bulk_insert_mappings(UserTimeZones, [
+            {'user_id': x, 'name': 'home', 'timezone_id': london}
+            for x, in db.session.query(UserDetails.id).filter(UserDetails.username.like('working%'))
+        ])
+        db.session.add(UserTimeZones(user_id=UserDetails.get('user').id, name='home', timezone_id=london))
+        db.session.commit()
+        working_hours_index.load()
+
+        local = datetime.datetime.now(pytz.timezone('Europe/London'))
+        start = (local - datetime.timedelta(hours=1)).strftime('%H:%M')
+        end = (local + datetime.timedelta(hours=1)).strftime('%H:%M')
+        weekdays = list(range(7))
+        self.assertEqual(len(qh.get_users_working_now('admin', UserRolesEnum.user_all.value, start, end, weekdays,
+                                                      limit=1000)['data']), 1000)
+
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            own = qh.get_users_working_now('user', UserRolesEnum.user.value, start, end, weekdays)
+            managed = qh.get_users_working_now('manager', UserRolesEnum.user_privileged.value, start, end, weekdays)
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual([x['username'] for x in own['data']], ['user'])
+        self.assertEqual([x['username'] for x in managed['data']], ['user'])
+        # the scoped ids, then the page, however many users are working out of scope;
+        # plus the roles with the user permission for the manager
+        self.assertEqual(len(statements), 5)
+
+    def test_get_users_working_now_after_delete(self):
+        admin_token = flask_jwt_extended.create_access_token(identity=th.get_user_details('admin'))
+        london = TimeZones.query.filter_by(location='Europe', city='London').one().id
+
+        def request(method, url, data=None):
+            return self.client.open(
+                url, method=method, content_type='application/json',
+                data=json.dumps(data) if data is not None else None,
+                headers={'Authorization': 'Bearer ' + admin_token}
+            )
+
+        local = datetime.datetime.now(pytz.timezone('Europe/London'))
+        start = (local - datetime.timedelta(hours=1)).strftime('%H:%M')
+        end = (local + datetime.timedelta(hours=1)).strftime('%H:%M')
+
+        def working():
+            response = request('GET', f'/api/v1/user/all/working_now?start={start}&end={end}&weekdays=0,1,2,3,4,5,6')
+            self.assertStatus(response, 200)
+            return [x['username'] for x in response.json['data']]
+
+        request('POST', '/api/v1/timezone/user', data={'name': 'home', 'timezone_id': london})
+        request('POST', '/api/v1/timezone/manager', data={'name': 'home', 'timezone_id': london})
+        self.assertEqual(working(), ['user', 'manager'])
+        user_id = UserDetails.get('user').id
+
+        request('POST', '/api/v1/user/all/batch', data={'action': 'delete', 'usernames': ['manager']})
+        self.assertEqual(working(), ['user'])
+        request('DELETE', '/api/v1/user/user')
+        self.assertEqual(working(), [])
+
+        # SQLite gives the id of the last deleted user to the next one, who has no timezones
+        response = request('POST', '/api/v1/user/all/import', data=[
+            {'first_name': 'first', 'last_name': 'last', 'username': 'newcomer',
+             'email': 'newcomer@timezonekeeper.com', 'password': 'newcomer_password'}
+        ])
+        self.assertStatus(response, 200)
+        self.assertEqual(UserDetails.get('newcomer').id, user_id)
+        self.assertEqual(working(), [])
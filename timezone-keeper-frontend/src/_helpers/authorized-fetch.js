@@ -0,0 +1,47 @@
+import config from 'config';
+import { authHeader } from './auth-header';
+
+let refreshing = null;
+
+function refreshAccessToken() {
+    let user = JSON.parse(localStorage.getItem('user'));
+    if (!user || !user.refresh_token) {
+        return Promise.resolve(false);
+    }
+
+    // concurrent requests failing together share a single refresh call
+    if (!refreshing) {
+        const requestOptions = {
+            method: 'POST',
+            headers: { 'Authorization': 'Bearer ' + user.refresh_token }
+        };
+        refreshing = fetch(`${config.apiUrl}/auth/refresh`, requestOptions)
+            .then(resp => resp.ok ? resp.json() : null)
+            .then(data => {
+                if (data && data.access_token) {
+                    user.access_token = data.access_token;
+                    localStorage.setItem('user', JSON.stringify(user));
+                    return true;
+                }
+                return false;
+            })
+            .catch(() => false)
+            .then(refreshed => {
+                refreshing = null;
+                return refreshed;
+            });
+    }
+    return refreshing;
+}
+
+// fetch with the stored access token, refreshing it once if the api rejects it
+export function authorizedFetch(url, options = {}) {
+    const send = () => fetch(url, { ...options, headers: { ...options.headers, ...authHeader() } });
+
+    return send().then(response => {
+        if (response.status !== 401) {
+            return response;
+        }
+        return refreshAccessToken().then(refreshed => refreshed ? send() : response);
+    });
+}
@@ -1,2 +1,3 @@
 export * from './router';
-export * from './auth-header';
\ No newline at end of file
+export * from './auth-header';
+export * from './authorized-fetch';
\ No newline at end of file
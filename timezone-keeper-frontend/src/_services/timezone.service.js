@@ -1,5 +1,5 @@
 import config from 'config';
-import { authHeader } from '../_helpers';
+import { authorizedFetch } from '../_helpers';
 import { logout } from './user.service.js';
 
 export const timezoneService = {
@@ -12,50 +12,47 @@ export const timezoneService = {
 
 function getAll() {
     const requestOptions = {
-        method: 'GET',
-        headers: authHeader()
+        method: 'GET'
     };
     let username = JSON.parse(localStorage.getItem('user'))['username'];
-    return fetch(`${config.apiUrl}/timezone`, requestOptions).then(handleResponse);
+    return authorizedFetch(`${config.apiUrl}/timezone`, requestOptions).then(handleResponse);
 }
 
 function getAllByUsername() {
     const requestOptions = {
-        method: 'GET',
-        headers: authHeader()
+        method: 'GET'
     };
     let username = JSON.parse(localStorage.getItem('user'))['username'];
-    return fetch(`${config.apiUrl}/timezone/${username}`, requestOptions).then(handleResponse);
+    return authorizedFetch(`${config.apiUrl}/timezone/${username}`, requestOptions).then(handleResponse);
 }
 
 function create(timezone_details) {
     const requestOptions = {
         method: 'POST',
-        headers: {  ...authHeader(), 'Content-Type': 'application/json', "Access-Control-Allow-Origin": "*"},
+        headers: { 'Content-Type': 'application/json', "Access-Control-Allow-Origin": "*"},
         body: JSON.stringify(timezone_details)
     };
     let username = JSON.parse(localStorage.getItem('user'))['username'];
-    return fetch(`${config.apiUrl}/timezone/${username}`, requestOptions).then(handleResponse);
+    return authorizedFetch(`${config.apiUrl}/timezone/${username}`, requestOptions).then(handleResponse);
 }
 
 function update(timezone_name, timezone_details) {
     const requestOptions = {
         method: 'PUT',
-        headers: { ...authHeader(), 'Content-Type': 'application/json'},
+        headers: { 'Content-Type': 'application/json'},
         body: JSON.stringify(timezone_details)
     };
     let username = JSON.parse(localStorage.getItem('user'))['username'];
-    return fetch(`${config.apiUrl}/timezone/${username}/${timezone_name}`, requestOptions).then(handleResponse);
+    return authorizedFetch(`${config.apiUrl}/timezone/${username}/${timezone_name}`, requestOptions).then(handleResponse);
 }
 
 // prefixed function name with underscore because delete is a reserved word in javascript
 function _delete(timezone_name) {
     const requestOptions = {
-        method: 'DELETE',
-        headers: authHeader()
+        method: 'DELETE'
     };
     let username = JSON.parse(localStorage.getItem('user'))['username'];
-    return fetch(`${config.apiUrl}/timezone/${username}/${timezone_name}`, requestOptions).then(handleResponse);
+    return authorizedFetch(`${config.apiUrl}/timezone/${username}/${timezone_name}`, requestOptions).then(handleResponse);
 }
 
 function handleResponse(response) {
@@ -1,5 +1,5 @@
 import config from 'config';
-import { authHeader } from '../_helpers';
+import { authHeader, authorizedFetch } from '../_helpers';
 import { router } from '../_helpers';
 
 export const userService = {
@@ -30,6 +30,7 @@ function login(username, password) {
                 // store user details and jwt token in local storage to keep user logged in between page refreshes
                 var user_data = {
                     "access_token": resp.access_token,
+                    "refresh_token": resp.refresh_token,
                     "username": username
                 }
                 localStorage.setItem('user', JSON.stringify(user_data));
@@ -63,40 +64,47 @@ function register(user) {
 
 function getAll() {
     const requestOptions = {
-        method: 'GET',
-        headers: authHeader()
+        method: 'GET'
     };
 
-    return fetch(`${config.apiUrl}/user`, requestOptions).then(handleResponse);
+    // the user list is paginated, follow next_cursor until the last page
+    const getPage = (users, cursor) => {
+        const query = cursor ? `?limit=1000&cursor=${encodeURIComponent(cursor)}` : '?limit=1000';
+        return authorizedFetch(`${config.apiUrl}/user${query}`, requestOptions)
+            .then(handleResponse)
+            .then(page => {
+                users = users.concat(page.data);
+                return page.next_cursor ? getPage(users, page.next_cursor) : { data: users };
+            });
+    };
+    return getPage([], null);
 }
 
 function getUserDetails() {
     const requestOptions = {
-        method: 'GET',
-        headers: authHeader()
+        method: 'GET'
     };
     let username = JSON.parse(localStorage.getItem('user'))['username'];
-    return fetch(`${config.apiUrl}/user/${username}`, requestOptions).then(handleResponse);
+    return authorizedFetch(`${config.apiUrl}/user/${username}`, requestOptions).then(handleResponse);
 }
 
 function updateUserDetails(user) {
     const requestOptions = {
         method: 'PUT',
-        headers: { ...authHeader(), 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(user)
     };
     let username = JSON.parse(localStorage.getItem('user'))['username'];
-    return fetch(`${config.apiUrl}/user/${username}`, requestOptions).then(handleResponse);
+    return authorizedFetch(`${config.apiUrl}/user/${username}`, requestOptions).then(handleResponse);
 }
 
 // prefixed function name with underscore because delete is a reserved word in javascript
 function _delete(username) {
     const requestOptions = {
-        method: 'DELETE',
-        headers: authHeader()
+        method: 'DELETE'
     };
 
-    return fetch(`${config.apiUrl}/user/${username}`, requestOptions).then(handleResponse);
+    return authorizedFetch(`${config.apiUrl}/user/${username}`, requestOptions).then(handleResponse);
 }
 
 function handleResponse(response, options) {